@@ -0,0 +1,89 @@
+import logging
+import queue
+import threading
+
+
+log = logging.getLogger(__name__)
+
+
+class BackgroundWriter:
+    """
+    Runs file writes on a background thread so that output I/O overlaps with the
+    computation of the next image.
+
+    The queue is bounded: submit() blocks while max_pending writes are already waiting,
+    which caps the memory held by images queued for writing.
+    The first write error is re-raised from the next submit(), flush() or close(), so
+    failures are never lost when the process exits.
+    """
+
+    def __init__(self, max_pending=4, num_threads=1):
+        self._queue = queue.Queue(maxsize=max(1, max_pending))
+        self._errors = []
+        self._lock = threading.Lock()
+        self._threads = [
+            threading.Thread(target=self._run, name=f"writer-{i}", daemon=True)
+            for i in range(max(1, num_threads))
+        ]
+        for t in self._threads:
+            t.start()
+        self._closed = False
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                fn, args, kwargs = item
+                try:
+                    fn(*args, **kwargs)
+                except Exception as e:
+                    log.error(f"background write failed: {e}")
+                    with self._lock:
+                        self._errors.append(e)
+            finally:
+                self._queue.task_done()
+
+    def _raise_errors(self):
+        with self._lock:
+            if not self._errors:
+                return
+            error = self._errors[0]
+            self._errors = []
+        raise error
+
+    def submit(self, fn, *args, **kwargs):
+        if self._closed:
+            raise RuntimeError("BackgroundWriter is closed")
+        self._raise_errors()
+        # blocks while the queue is full
+        self._queue.put((fn, args, kwargs))
+
+    def flush(self):
+        # wait for every queued write to finish
+        self._queue.join()
+        self._raise_errors()
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            for _ in self._threads:
+                self._queue.put(None)
+            for t in self._threads:
+                t.join()
+        self._raise_errors()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            # don't hide the original exception behind a write error
+            try:
+                self.close()
+            except Exception as e:
+                log.error(f"background write failed: {e}")
+        return False
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+
+import argparse
+import csv
+import io
+import sys
+import time
+import traceback
+
+from cellbrowser_tools.ome_tiff_source import OmeTiffSource
+from cellbrowser_tools.ome_tiff_writer import (
+    LEVELED_COMPRESSIONS,
+    OME_TIFF_COMPRESSIONS,
+    write_ome_tiff_planes,
+)
+
+# channels added by fov_processing for segmentations and contours
+SEGMENTATION_PREFIXES = ("SEG_", "CON_")
+
+
+def channel_type(name):
+    if name and name.startswith(SEGMENTATION_PREFIXES):
+        return "segmentation"
+    return "raw"
+
+
+def channel_names(source):
+    try:
+        return [c.name for c in source.ome.images[0].pixels.channels]
+    except Exception:
+        return [f"CH_{c}" for c in range(source.size_c)]
+
+
+def settings(codecs, levels):
+    # uncompressed first, as the baseline for write time
+    result = [(None, None)]
+    for codec in codecs:
+        if codec in LEVELED_COMPRESSIONS and levels:
+            result.extend([(codec, level) for level in levels])
+        else:
+            result.append((codec, None))
+    return result
+
+
+def benchmark(files, codecs, levels, workers):
+    # (channel type, codec, level) -> [raw bytes, written bytes, seconds]
+    totals = {}
+    # codecs whose encoder is not installed (zstd and lzw need imagecodecs)
+    unavailable = set()
+    for path in files:
+        print(f"reading {path}")
+        with OmeTiffSource(path) as source:
+            names = channel_names(source)
+            for c in range(source.size_c):
+                volume = source.read_zyx(c=c)
+                ctype = channel_type(names[c] if c < len(names) else None)
+                for codec, level in settings(codecs, levels):
+                    if codec in unavailable:
+                        continue
+                    buffer = io.BytesIO()
+                    start = time.perf_counter()
+                    try:
+                        write_ome_tiff_planes(
+                            buffer,
+                            iter(volume),
+                            "benchmark",
+                            (volume.shape[0], 1, volume.shape[1], volume.shape[2]),
+                            volume.dtype,
+                            compression=codec,
+                            compression_level=level,
+                            workers=workers,
+                        )
+                    except (ImportError, KeyError) as e:
+                        print(f"skipping {codec}: {e}")
+                        unavailable.add(codec)
+                        continue
+                    seconds = time.perf_counter() - start
+                    entry = totals.setdefault((ctype, codec, level), [0, 0, 0.0])
+                    entry[0] += volume.nbytes
+                    entry[1] += buffer.getbuffer().nbytes
+                    entry[2] += seconds
+    rows = []
+    for (ctype, codec, level), (raw, written, seconds) in sorted(
+        totals.items(), key=lambda kv: (kv[0][0], str(kv[0][1]), str(kv[0][2]))
+    ):
+        rows.append(
+            {
+                "channel_type": ctype,
+                "compression": codec or "none",
+                "level": "" if level is None else level,
+                "raw_mb": raw / 1e6,
+                "written_mb": written / 1e6,
+                "ratio": raw / written if written else 0.0,
+                "seconds": seconds,
+                "mb_per_second": raw / 1e6 / seconds if seconds else 0.0,
+            }
+        )
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure OME-TIFF write time and compression ratio per channel type "
+        "(raw vs segmentation) for the codecs supported by fov_processing. "
+        "Example: benchmark_compression fov1.ome.tif fov2.ome.tif --levels 1 6 9"
+    )
+    parser.add_argument("files", nargs="+", help="OME-TIFF files, e.g. FOV outputs")
+    parser.add_argument(
+        "--codecs",
+        nargs="+",
+        choices=OME_TIFF_COMPRESSIONS,
+        default=OME_TIFF_COMPRESSIONS,
+        help="codecs to compare against uncompressed output",
+    )
+    parser.add_argument(
+        "--levels",
+        nargs="+",
+        type=int,
+        default=None,
+        help="compression levels for zlib and zstd (default is the codec default)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="threads encoding each plane (0 = automatic)",
+    )
+    parser.add_argument("--csv", default=None, help="also write the results here")
+    args = parser.parse_args()
+
+    rows = benchmark(args.files, args.codecs, args.levels, args.workers)
+
+    print(
+        f"{'channel type':<14}{'compression':<13}{'level':>6}{'raw MB':>10}"
+        f"{'written MB':>12}{'ratio':>8}{'seconds':>9}{'MB/s':>9}"
+    )
+    for r in rows:
+        print(
+            f"{r['channel_type']:<14}{r['compression']:<13}{str(r['level']):>6}"
+            f"{r['raw_mb']:>10.1f}{r['written_mb']:>12.1f}{r['ratio']:>8.2f}"
+            f"{r['seconds']:>9.2f}{r['mb_per_second']:>9.1f}"
+        )
+
+    if args.csv:
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+        sys.exit(0)
+
+    except Exception as e:
+        print(str(e), file=sys.stderr)
+        print(traceback.format_exc(), file=sys.stderr)
+        sys.exit(1)
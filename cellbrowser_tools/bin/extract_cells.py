@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+import argparse
+import sys
+import traceback
+
+from cellbrowser_tools.cell_extraction import extract_cells, find_cell_records
+from cellbrowser_tools.ome_tiff_writer import OME_TIFF_COMPRESSIONS
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Write the masked cell crops of cell records (make_images --cell_records) "
+        "as OME-TIFFs, cut out of their full field OME-TIFFs. "
+        "Example: extract_cells output/images --output_dir output/cells --workers 4"
+    )
+    parser.add_argument(
+        "records",
+        nargs="+",
+        help="cell record files, or directories to search for them",
+    )
+    parser.add_argument(
+        "--output_dir", required=True, help="directory to write the cell OME-TIFFs to"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of full field images processed at the same time",
+    )
+    parser.add_argument(
+        "--compression",
+        choices=OME_TIFF_COMPRESSIONS,
+        default=None,
+        help="compress the OME-TIFFs with this codec (default is uncompressed)",
+    )
+    parser.add_argument(
+        "--compression_level",
+        type=int,
+        default=None,
+        help="compression level for zlib or zstd (default is the codec default)",
+    )
+    args = parser.parse_args()
+
+    record_paths = find_cell_records(args.records)
+    print(f"extracting {len(record_paths)} cells")
+    paths = extract_cells(
+        record_paths,
+        args.output_dir,
+        workers=args.workers,
+        compression=args.compression,
+        compression_level=args.compression_level,
+    )
+    print(f"wrote {len(paths)} cells to {args.output_dir}")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+        sys.exit(0)
+
+    except Exception as e:
+        print(str(e), file=sys.stderr)
+        print(traceback.format_exc(), file=sys.stderr)
+        sys.exit(1)
@@ -5,7 +5,11 @@ import traceback
 
 from datetime import datetime
 from logging import FileHandler, StreamHandler, Formatter
-from cellbrowser_tools.dataHandoffUtils import QueryOptions, ActionOptions
+from cellbrowser_tools.dataHandoffUtils import (
+    QueryOptions,
+    ActionOptions,
+    ProcessingOptions,
+)
 from cellbrowser_tools import build_images
 
 
@@ -17,11 +21,31 @@ class Args(argparse.Namespace):
         self.env = "stg"
         self.distributed = False
         self.debug = False
+        self.force = False
         self.cell_lines = None
         self.plates = None
         self.fovids = None
         self.start_date = None
         self.end_date = None
+        self.cell_workers = 1
+        self.write_queue_size = 0
+        self.alias_duplicate_channels = False
+        self.ome_cache_dir = None
+        self.memory_budget_mb = 0
+        self.scratch_dir = None
+        self.staging_dir = None
+        self.staging_max_gb = 50
+        self.compression = None
+        self.compression_level = None
+        self.compression_workers = 0
+        self.tile_size = 0
+        self.pyramid_levels = 0
+        self.cell_records = False
+        self.segmentation_only = False
+        self.batch_cell_thumbnails = False
+        self.batch_cell_atlases = False
+        self.atlas_levels = 0
+        self.save_raw = False
         #
         self.__parse()
 
@@ -57,6 +81,13 @@ class Args(argparse.Namespace):
             required=False,
             action="store_true",
         )
+        p.add_argument(
+            "--force",
+            help="Rebuild every FOV, including those unchanged since their last build",
+            default=False,
+            required=False,
+            action="store_true",
+        )
         actions_group = p.add_argument_group(
             "Actions",
             "Combine any of the following flags to determine the image outputs",
@@ -82,6 +113,143 @@ class Args(argparse.Namespace):
             required=False,
             action="store_true",
         )
+        actions_group.add_argument(
+            "--save_raw",
+            help="Save OME-TIFFs of the combined channels (full field, and cells with --do_crop)",
+            default=False,
+            required=False,
+            action="store_true",
+        )
+        processing_group = p.add_argument_group(
+            "Processing options",
+            "Options for how the image outputs of each FOV are generated.",
+        )
+        processing_group.add_argument(
+            "--cell_workers",
+            type=int,
+            help="Number of threads processing the cells of one FOV (0 = all cpus)",
+            default=1,
+            required=False,
+        )
+        processing_group.add_argument(
+            "--write_queue_size",
+            type=int,
+            help="Number of output writes queued for a background thread (0 = write synchronously)",
+            default=0,
+            required=False,
+        )
+        processing_group.add_argument(
+            "--alias_duplicate_channels",
+            help="Store channels that duplicate another channel as aliases instead of copies",
+            default=False,
+            required=False,
+            action="store_true",
+        )
+        processing_group.add_argument(
+            "--ome_cache_dir",
+            type=str,
+            help="Directory to cache cleaned OME metadata of source images between runs",
+            default=None,
+            required=False,
+        )
+        processing_group.add_argument(
+            "--memory_budget_mb",
+            type=int,
+            help="Stream FOVs larger than this many MB through in z slabs (0 = no limit)",
+            default=0,
+            required=False,
+        )
+        processing_group.add_argument(
+            "--scratch_dir",
+            type=str,
+            help="Local scratch directory for memory mapping the combined image of each FOV",
+            default=None,
+            required=False,
+        )
+        processing_group.add_argument(
+            "--staging_dir",
+            type=str,
+            help="Node-local directory to cache copies of the source files in",
+            default=None,
+            required=False,
+        )
+        processing_group.add_argument(
+            "--staging_max_gb",
+            type=float,
+            help="Size cap of the staging directory in GB",
+            default=50,
+            required=False,
+        )
+        processing_group.add_argument(
+            "--compression",
+            choices=["zlib", "zstd", "lzw"],
+            help="Compress the OME-TIFFs of --save_raw with this codec (default is uncompressed)",
+            default=None,
+            required=False,
+        )
+        processing_group.add_argument(
+            "--compression_level",
+            type=int,
+            help="Compression level for zlib or zstd (default is the codec default)",
+            default=None,
+            required=False,
+        )
+        processing_group.add_argument(
+            "--compression_workers",
+            type=int,
+            help="Number of threads encoding each OME-TIFF plane (0 = automatic)",
+            default=0,
+            required=False,
+        )
+        processing_group.add_argument(
+            "--tile_size",
+            type=int,
+            help="Store the planes of full-field OME-TIFFs (--save_raw) as tiles of this size (0 = whole planes)",
+            default=0,
+            required=False,
+        )
+        processing_group.add_argument(
+            "--pyramid_levels",
+            type=int,
+            help="Number of downsampled SubIFD levels in full-field OME-TIFFs (--save_raw)",
+            default=0,
+            required=False,
+        )
+        processing_group.add_argument(
+            "--cell_records",
+            help="With --save_raw and --do_crop, store cropped cells as references into the full field OME-TIFF instead of copies (see extract_cells)",
+            default=False,
+            required=False,
+            action="store_true",
+        )
+        processing_group.add_argument(
+            "--segmentation_only",
+            help="Reuse the raw channels of previous outputs and only rebuild what depends on the segmentations",
+            default=False,
+            required=False,
+            action="store_true",
+        )
+        processing_group.add_argument(
+            "--batch_cell_thumbnails",
+            help="Make all cell thumbnails of a FOV in one pass over it, with one noise floor per FOV channel",
+            default=False,
+            required=False,
+            action="store_true",
+        )
+        processing_group.add_argument(
+            "--batch_cell_atlases",
+            help="Scale the cell texture atlases of a FOV by one intensity range per FOV channel, packed in one pass per cell",
+            default=False,
+            required=False,
+            action="store_true",
+        )
+        processing_group.add_argument(
+            "--atlas_levels",
+            type=int,
+            help="Number of half resolution levels of detail saved with each texture atlas",
+            default=0,
+            required=False,
+        )
         filter_group = p.add_argument_group(
             "Filter options",
             "Combine any of the following options to filter FOVs that will be processed.",
@@ -149,6 +317,37 @@ def configure_logging(debug: bool):
     log.setLevel(logging.DEBUG if debug else logging.INFO)
 
 
+def make_options(args):
+    # the actions and processing options of a make_images run
+    action_options = ActionOptions(
+        do_thumbnails=args.do_thumbnails,
+        do_atlases=args.do_atlases,
+        do_crop=args.do_crop,
+        save_raw=args.save_raw,
+    )
+    processing_options = ProcessingOptions(
+        cell_workers=args.cell_workers,
+        write_queue_size=args.write_queue_size,
+        alias_duplicate_channels=args.alias_duplicate_channels,
+        ome_cache_dir=args.ome_cache_dir,
+        memory_budget_mb=args.memory_budget_mb,
+        scratch_dir=args.scratch_dir,
+        staging_dir=args.staging_dir,
+        staging_max_gb=args.staging_max_gb,
+        compression=args.compression,
+        compression_level=args.compression_level,
+        compression_workers=args.compression_workers,
+        tile_size=args.tile_size,
+        pyramid_levels=args.pyramid_levels,
+        cell_records=args.cell_records,
+        segmentation_only=args.segmentation_only,
+        batch_cell_thumbnails=args.batch_cell_thumbnails,
+        batch_cell_atlases=args.batch_cell_atlases,
+        atlas_levels=args.atlas_levels,
+    )
+    return action_options, processing_options
+
+
 def main():
     args = Args()
     debug = args.debug
@@ -163,15 +362,15 @@ def main():
         query_options = QueryOptions(
             args.fovids, args.plates, args.cell_lines, args.start_date, args.end_date,
         )
-        action_options = ActionOptions(
-            args.do_thumbnails, args.do_atlases, args.do_crop
-        )
+        action_options, processing_options = make_options(args)
         build_images.build_images(
             args.input_manifest,
             args.output_dir,
             args.distributed,
             query_options,
             action_options,
+            processing_options,
+            args.force,
         )
 
     except Exception as e:
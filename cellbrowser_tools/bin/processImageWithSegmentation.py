@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 
-from cellbrowser_tools import cellJob, zarr_fov_processing
+from cellbrowser_tools import cellJob, fov_processing
+from cellbrowser_tools.build_ledger import record_fov_done
 
 import argparse
 from distributed import LocalCluster, Client
@@ -19,7 +20,9 @@ def do_main_image(fname):
         #     sys.stderr.write("\n\nEncountered parsing error!\n\n###\nCell Job Object\n###\n")
         #     pprint.pprint(jobspec, stream=sys.stderr)
         #     return
-    return zarr_fov_processing.do_main_image_with_celljob(info)
+    result = fov_processing.do_main_image_with_celljob(info)
+    record_fov_done(info)
+    return result
 
 
 def main():
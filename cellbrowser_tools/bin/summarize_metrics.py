@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+
+import argparse
+import sys
+import traceback
+
+from cellbrowser_tools.metrics import summarize
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Total time and bytes per processing stage, from the metrics that "
+        "every fov job of make_images, local or on the cluster, appends to "
+        "<output_dir>/processing/data_jobs_out.jsonl. "
+        "Example: summarize_metrics output/processing/data_jobs_out.jsonl"
+    )
+    parser.add_argument("files", nargs="+", help="json lines metrics files")
+    args = parser.parse_args()
+
+    totals = summarize(args.files)
+
+    print(
+        f"{'stage':<20}{'count':>8}{'seconds':>12}{'mean s':>10}"
+        f"{'read MB':>12}{'written MB':>12}"
+    )
+    # slowest stages first
+    for stage, t in sorted(totals.items(), key=lambda kv: -kv[1]["seconds"]):
+        print(
+            f"{stage:<20}{t['count']:>8}{t['seconds']:>12.1f}"
+            f"{t['seconds'] / t['count']:>10.3f}"
+            f"{t['bytes_read'] / 1e6:>12.1f}{t['bytes_written'] / 1e6:>12.1f}"
+        )
+
+
+if __name__ == "__main__":
+    try:
+        main()
+        sys.exit(0)
+
+    except Exception as e:
+        print(str(e), file=sys.stderr)
+        print(traceback.format_exc(), file=sys.stderr)
+        sys.exit(1)
@@ -1,10 +1,17 @@
-from cellbrowser_tools.dataHandoffUtils import ActionOptions, OutputPaths
+from cellbrowser_tools.dataHandoffUtils import (
+    ActionOptions,
+    OutputPaths,
+    ProcessingOptions,
+)
 import logging
 import os
 
 from . import createJobsFromCSV
 from . import dataHandoffUtils
 from . import jobScheduler
+from .build_ledger import BuildLedger, fov_fingerprint
+from .dataset_constants import BUILD_LEDGER_DIR
+from .staging import fov_read_paths, get_staging_cache
 
 
 log = logging.getLogger(__name__)
@@ -17,7 +24,14 @@ def submit_done(prefs, job_ids):
     return new_job_ids
 
 
-def submit_fov_rows(distributed: bool, prefs, groups, action_options: ActionOptions):
+def submit_fov_rows(
+    distributed: bool,
+    prefs,
+    groups,
+    action_options: ActionOptions,
+    processing_options: ProcessingOptions = None,
+    force: bool = False,
+):
     # if not distributed:
     #     # cluster = LocalCluster(processes=True)
     #     # cluster = LocalCluster(n_workers=4, processes=True, threads_per_worker=1)
@@ -26,10 +40,35 @@ def submit_fov_rows(distributed: bool, prefs, groups, action_options: ActionOpti
     #     # client = Client(cluster)
     #     # client
 
+    # skip fovs whose inputs, manifest rows, code and options are the same as in their
+    # last successful build. every scheduled fov records its fingerprint when done.
+    ledger = BuildLedger(os.path.join(prefs["status_dir"], BUILD_LEDGER_DIR))
+    dirty = []
+    for rows in groups:
+        fingerprint = fov_fingerprint(
+            rows, action_options, processing_options, action_options.save_raw
+        )
+        name = dataHandoffUtils.get_fov_name_from_row(rows[0])
+        if force or not ledger.is_up_to_date(name, fingerprint):
+            dirty.append((rows, fingerprint))
+    log.info(f"{len(groups) - len(dirty)} of {len(groups)} FOVS ARE UP TO DATE")
+    if force:
+        log.info("FORCING A REBUILD OF ALL FOVS")
+
+    # when fovs are processed right here one after another, stage the source files
+    # of the next fov in the background while the current one is computed
+    staging = None
+    if not distributed and processing_options is not None:
+        staging = get_staging_cache(
+            processing_options.staging_dir, processing_options.staging_max_gb
+        )
+
     # gather cluster commands and submit in batch
     jobdata_list = []
-    log.info("PREPARING " + str(len(groups)) + " JOBS")
-    for index, rows in enumerate(groups):
+    log.info("PREPARING " + str(len(dirty)) + " JOBS")
+    for index, (rows, fingerprint) in enumerate(dirty):
+        if staging is not None and index + 1 < len(dirty):
+            staging.prefetch(fov_read_paths(dirty[index + 1][0][0]))
         jobdata = createJobsFromCSV.do_image(
             distributed,
             not distributed,
@@ -37,11 +76,14 @@ def submit_fov_rows(distributed: bool, prefs, groups, action_options: ActionOpti
             rows,
             do_thumbnails=action_options.do_thumbnails,
             do_crop=action_options.do_crop,
-            save_raw=False,
+            save_raw=action_options.save_raw,
+            processing_options=processing_options,
+            ledger_dir=ledger.ledger_dir,
+            build_fingerprint=fingerprint,
         )
         jobdata_list.append(jobdata)
 
-    log.info("SUBMITTING " + str(len(groups)) + " JOBS")
+    log.info("SUBMITTING " + str(len(dirty)) + " JOBS")
     job_ids = jobScheduler.submit_batch(jobdata_list, prefs, name="fovs")
     return job_ids
 
@@ -52,6 +94,8 @@ def build_images(
     distributed: bool,
     query_options: dataHandoffUtils.QueryOptions,
     action_options: dataHandoffUtils.ActionOptions,
+    processing_options: dataHandoffUtils.ProcessingOptions = None,
+    force: bool = False,
 ):
     # setup directories
     output_paths = OutputPaths(output_dir)
@@ -73,6 +117,8 @@ def build_images(
         output_paths.__dict__,
         groups,
         action_options,
+        processing_options,
+        force,
     )
     job_ids = submit_done(output_paths.__dict__, job_ids)
     log.info("All Jobs Submitted!")
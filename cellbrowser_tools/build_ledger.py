@@ -0,0 +1,126 @@
+import functools
+import hashlib
+import json
+import logging
+import os
+
+from . import __version__
+from . import dataHandoffUtils as utils
+from .file_utils import atomic_path, file_fingerprint
+from .staging import fov_read_paths
+
+log = logging.getLogger(__name__)
+
+# processing options that change how the files of a fov are made, but not the files
+_NON_OUTPUT_OPTIONS = {
+    "cell_workers",
+    "write_queue_size",
+    "ome_cache_dir",
+    "memory_budget_mb",
+    "scratch_dir",
+    "staging_dir",
+    "staging_max_gb",
+    "compression_workers",
+    "segmentation_only",
+}
+# processing options that only change the ome-tiffs, which are only written with
+# save_raw
+_OME_TIFF_OPTIONS = {
+    "compression",
+    "compression_level",
+    "tile_size",
+    "pyramid_levels",
+    "cell_records",
+}
+
+
+# package version and a digest of every module of this package, so that any code
+# change makes every fov dirty, even without a version bump
+@functools.lru_cache(maxsize=None)
+def code_version():
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    digest = hashlib.sha256(__version__.encode("utf-8"))
+    for root, dirs, files in os.walk(package_dir):
+        dirs.sort()
+        for file_name in sorted(files):
+            if file_name.endswith((".py", ".j2")):
+                path = os.path.join(root, file_name)
+                digest.update(os.path.relpath(path, package_dir).encode("utf-8"))
+                with open(path, "rb") as f:
+                    digest.update(f.read())
+    return f"{__version__}+{digest.hexdigest()[:16]}"
+
+
+def fov_fingerprint(rows, action_options, processing_options=None, save_raw=True):
+    """
+    Digest of everything the outputs of one fov depend on: its source files (path,
+    size and modification time), its manifest rows, the code version, and the options.
+    """
+    inputs = []
+    for path in fov_read_paths(rows[0]):
+        try:
+            inputs.append([path, file_fingerprint(path)])
+        except OSError:
+            # a missing file is part of the state too; the job will report it
+            inputs.append([path, None])
+    options = {}
+    if processing_options is not None:
+        options = {
+            key: value
+            for key, value in processing_options.__dict__.items()
+            if key not in _NON_OUTPUT_OPTIONS
+            and (save_raw or key not in _OME_TIFF_OPTIONS)
+        }
+    state = {
+        "inputs": inputs,
+        "rows": rows,
+        "code": code_version(),
+        "actions": action_options.__dict__,
+        "options": options,
+        "save_raw": save_raw,
+    }
+    # default=str covers numpy scalars and timestamps in the manifest rows
+    text = json.dumps(state, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class BuildLedger:
+    """
+    Fingerprint of the last successful build of each fov, one small file per fov so
+    that concurrent cluster jobs never write the same file.
+    A fov is up to date when its recorded fingerprint equals the current one.
+    """
+
+    def __init__(self, ledger_dir):
+        self.ledger_dir = ledger_dir
+        os.makedirs(ledger_dir, exist_ok=True)
+
+    def _entry_path(self, name):
+        return os.path.join(self.ledger_dir, f"{name}.json")
+
+    def get(self, name):
+        try:
+            with open(self._entry_path(name)) as f:
+                return json.load(f).get("fingerprint")
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            # a damaged entry only means the fov is built again
+            log.warning(f"ignoring unreadable build ledger entry for {name}: {e}")
+            return None
+
+    def is_up_to_date(self, name, fingerprint):
+        return self.get(name) == fingerprint
+
+    def record(self, name, fingerprint):
+        # a job killed while writing never leaves a partial entry
+        with atomic_path(self._entry_path(name)) as tmp:
+            with open(tmp, "w") as f:
+                json.dump({"fingerprint": fingerprint, "code": code_version()}, f)
+
+
+# mark the fov of a finished CellJob as built, if it was scheduled with a fingerprint
+def record_fov_done(info):
+    if info.ledger_dir and info.build_fingerprint:
+        name = utils.get_fov_name_from_row(info.cells[0])
+        BuildLedger(info.ledger_dir).record(name, info.build_fingerprint)
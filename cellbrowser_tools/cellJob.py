@@ -15,3 +15,57 @@ class CellJob(object):
         self.do_crop = True
         # whether or not to save ome-tiff files with reordered channels
         self.save_raw = True
+        # number of threads processing segmented cells of one fov concurrently
+        # (1 processes cells one after another, 0 uses every available cpu)
+        self.cell_workers = 1
+        # number of output writes that may be queued for a background writer thread
+        # (0 writes every output synchronously)
+        self.write_queue_size = 0
+        # whether to store a channel that duplicates an earlier channel (same file and
+        # channel index) as an alias in the metadata instead of a second copy
+        self.alias_duplicate_channels = False
+        # directory of a persistent cache of cleaned OME metadata of the source
+        # images, shared between runs (None disables the cache)
+        self.ome_cache_dir = None
+        # approximate ceiling in MB on the pixel data of one fov held in memory.
+        # fovs whose combined image would not fit are streamed in z slabs instead
+        # (0 means no ceiling)
+        self.memory_budget_mb = 0
+        # local scratch directory (e.g. $TMPDIR on the compute node) for a memory
+        # mapped file holding the combined image (None keeps it in memory)
+        self.scratch_dir = None
+        # node-local directory caching copies of the source files (None reads them
+        # from the network share), and its size cap in GB
+        self.staging_dir = None
+        self.staging_max_gb = 50
+        # codec for ome-tiff outputs ("zlib", "zstd", "lzw" or None for uncompressed),
+        # its level (None for the codec default), and the number of threads encoding
+        # the strips of each plane (0 lets tifffile decide)
+        self.compression = None
+        self.compression_level = None
+        self.compression_workers = 0
+        # full field ome-tiffs: edge length of square tiles (0 stores whole planes), and
+        # the number of half resolution levels stored as SubIFDs of each plane
+        self.tile_size = 0
+        self.pyramid_levels = 0
+        # store each cropped cell as a json record of its bounds and label index in
+        # the full field ome-tiff, instead of an ome-tiff of its own
+        self.cell_records = False
+        # rebuild only what depends on the segmentations, reusing the raw channels
+        # stored by a previous build of the fov (if its raw source is unchanged)
+        self.segmentation_only = False
+        # make the thumbnails of all cells of the fov in one pass over it, instead of
+        # one masked projection per cell crop
+        self.batch_cell_thumbnails = False
+        # scale the atlases of all cells of the fov by the same intensity range per
+        # channel, taken from the whole fov, instead of each by its own maximum
+        self.batch_cell_atlases = False
+        # number of half resolution levels of detail saved with every texture atlas
+        self.atlas_levels = 0
+        # json lines file that the time and bytes of every processing stage are
+        # appended to (None records nothing)
+        self.metrics_path = None
+        # directory of the build ledger, and the fingerprint recorded there for this
+        # fov once it is done (None records nothing)
+        self.ledger_dir = None
+        self.build_fingerprint = None
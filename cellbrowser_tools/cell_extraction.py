@@ -0,0 +1,156 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+import os
+
+import numpy as np
+from ome_types import to_xml
+from ome_types.model import TiffData
+
+from .fov_processing import (
+    CELL_RECORD_SUFFIX,
+    CELL_RECORD_VERSION,
+    OmeTemplate,
+    image_to_mask_in_place,
+)
+from .ome_tiff_source import OmeTiffSource, check_num_planes
+from .ome_tiff_writer import write_ome_tiff_planes
+
+
+log = logging.getLogger(__name__)
+
+
+def read_cell_record(record_path):
+    with open(record_path) as f:
+        record = json.load(f)
+    version = record.get("version")
+    if version != CELL_RECORD_VERSION:
+        raise ValueError(
+            f"{record_path}: unsupported cell record version {version}, expected {CELL_RECORD_VERSION}"
+        )
+    # resolve the parent image now, so the record can be used from anywhere
+    record["parent_path"] = os.path.join(
+        os.path.dirname(os.path.abspath(record_path)), record["parent_image"]
+    )
+    record["name"] = os.path.basename(record_path)[: -len(CELL_RECORD_SUFFIX)]
+    return record
+
+
+# all cell records in the given files and directories
+def find_cell_records(paths):
+    result = []
+    for path in paths:
+        if os.path.isdir(path):
+            for file_name in sorted(os.listdir(path)):
+                if file_name.endswith(CELL_RECORD_SUFFIX):
+                    result.append(os.path.join(path, file_name))
+        else:
+            result.append(path)
+    return result
+
+
+def extract_cell(record, source=None):
+    """
+    Cut the cell of record out of its full field ome-tiff, as a CZYX array with the
+    segmentation channels masked to the cell, the same as the cropped ome-tiffs that
+    fov_processing writes without cell records.
+    Only the z range of the cell is decoded. Pass an open OmeTiffSource of the parent
+    image to reuse it across cells of the same fov.
+    """
+    if source is None:
+        with OmeTiffSource(record["parent_path"]) as source:
+            return extract_cell(record, source)
+    b = record["bounds"]
+    cropped = np.empty(
+        (
+            source.size_c,
+            b["zmax"] - b["zmin"],
+            b["ymax"] - b["ymin"],
+            b["xmax"] - b["xmin"],
+        ),
+        dtype=source.dtype,
+    )
+    for c in range(source.size_c):
+        volume = source.read_zyx(c=c, z_start=b["zmin"], z_stop=b["zmax"])
+        cropped[c] = volume[:, b["ymin"] : b["ymax"], b["xmin"] : b["xmax"]]
+    scratch = np.empty(cropped.shape[1:], dtype=bool)
+    for mi in record["channels_to_mask"]:
+        image_to_mask_in_place(
+            cropped[mi], record["index"], record["mask_value"], scratch=scratch
+        )
+    return cropped
+
+
+def cell_ome(record, source):
+    # the cell's metadata, derived from the full field metadata like fov_processing does
+    b = record["bounds"]
+    return OmeTemplate(source.ome).crop(
+        size_x=b["xmax"] - b["xmin"],
+        size_y=b["ymax"] - b["ymin"],
+        zmin=b["zmin"],
+        zmax=b["zmax"],
+    )
+
+
+def write_cell(record, out_dir, source=None, compression=None, compression_level=None):
+    """
+    Write the masked crop of record to out_dir as <cell name>.ome.tif.
+    Returns the path of the written file.
+    """
+    if source is None:
+        with OmeTiffSource(record["parent_path"]) as source:
+            return write_cell(record, out_dir, source, compression, compression_level)
+    image = extract_cell(record, source)
+    omexml = cell_ome(record, source)
+    omepixels = omexml.images[0].pixels
+    check_num_planes(omepixels)
+    omepixels.tiff_data_blocks = [
+        TiffData(plane_count=omepixels.size_c * omepixels.size_z * omepixels.size_t)
+    ]
+    # the planes are written z by z with channels varying fastest
+    omepixels.dimension_order = type(omepixels.dimension_order)("XYCZT")
+    ome_str = '<?xml version="1.0" encoding="UTF-8"?>' + to_xml(omexml)
+    size_c, size_z, size_y, size_x = image.shape
+    path = os.path.join(out_dir, record["name"] + ".ome.tif")
+    write_ome_tiff_planes(
+        path,
+        (image[c, z] for z in range(size_z) for c in range(size_c)),
+        ome_str,
+        (size_z, size_c, size_y, size_x),
+        image.dtype,
+        compression=compression,
+        compression_level=compression_level,
+    )
+    return path
+
+
+def extract_cells(
+    record_paths, out_dir, workers=1, compression=None, compression_level=None
+):
+    """
+    Bulk version of write_cell. Records are grouped by parent image, so that each full
+    field ome-tiff is opened and its metadata parsed once; parent images are processed
+    by up to workers threads. Returns the paths of the written files.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    # parent path -> records, in the order given
+    groups = {}
+    for record_path in record_paths:
+        record = read_cell_record(record_path)
+        groups.setdefault(record["parent_path"], []).append(record)
+
+    def do_parent(item):
+        parent_path, records = item
+        log.info(f"extracting {len(records)} cells from {parent_path}")
+        with OmeTiffSource(parent_path) as source:
+            return [
+                write_cell(record, out_dir, source, compression, compression_level)
+                for record in records
+            ]
+
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(do_parent, groups.items()))
+    else:
+        results = [do_parent(item) for item in groups.items()]
+    return [path for paths in results for path in paths]
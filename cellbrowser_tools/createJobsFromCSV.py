@@ -6,10 +6,12 @@ import sys
 from . import cellJob
 from . import dataHandoffUtils as lkutils
 from . import jobScheduler
+from .build_ledger import record_fov_done
 from .dataset_constants import DataField, SLURM_SCRIPTS_DIR
 
-# from .fov_processing import do_main_image_with_celljob
-from .zarr_fov_processing import do_main_image_with_celljob
+# the zarr path (zarr_fov_processing) ignores the processing options, so jobs go
+# through fov_processing
+from .fov_processing import do_main_image_with_celljob
 
 # cbrImageLocation path to cellbrowser images
 # cbrThumbnailLocation path to cellbrowser thumbnails
@@ -76,6 +78,9 @@ def do_image(
     do_thumbnails=True,
     do_crop=True,
     save_raw=True,
+    processing_options: lkutils.ProcessingOptions = None,
+    ledger_dir=None,
+    build_fingerprint=None,
 ):
     # use row 0 as the "full field" row
     row = rows[0]
@@ -91,6 +96,13 @@ def do_image(
     info.do_thumbnails = do_thumbnails
     info.do_crop = do_crop
     info.save_raw = save_raw
+    if processing_options is not None:
+        for key, value in processing_options.__dict__.items():
+            setattr(info, key, value)
+    info.ledger_dir = ledger_dir
+    info.build_fingerprint = build_fingerprint
+    # per stage metrics of every fov go to one file in the status directory
+    info.metrics_path = prefs.get("save_log_path")
 
     # drop images here
     info.cbrDataRoot = prefs["images_dir"]
@@ -115,6 +127,7 @@ def do_image(
 
     if run_now:
         do_main_image_with_celljob(info)
+        record_fov_done(info)
     elif make_job:
         # TODO: set arg to copy each indiv file to another output
         return make_json(jobname, info, prefs)
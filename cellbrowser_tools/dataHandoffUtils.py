@@ -33,11 +33,69 @@ class ActionOptions:
     """
 
     def __init__(
-        self, do_thumbnails: bool = True, do_atlases: bool = True, do_crop: bool = True
+        self,
+        do_thumbnails: bool = True,
+        do_atlases: bool = True,
+        do_crop: bool = True,
+        save_raw: bool = False,
     ):
         self.do_thumbnails = do_thumbnails
         self.do_atlases = do_atlases
         self.do_crop = do_crop
+        # ome-tiffs of the full field (and of each cell, with do_crop)
+        self.save_raw = save_raw
+
+
+class ProcessingOptions:
+    """
+    Options for how the files of each fov are generated.
+    Every option is copied onto the CellJob of each fov.
+    """
+
+    def __init__(
+        self,
+        cell_workers: int = 1,
+        write_queue_size: int = 0,
+        alias_duplicate_channels: bool = False,
+        ome_cache_dir: str = None,
+        memory_budget_mb: int = 0,
+        scratch_dir: str = None,
+        staging_dir: str = None,
+        staging_max_gb: float = 50,
+        compression: str = None,
+        compression_level: int = None,
+        compression_workers: int = 0,
+        tile_size: int = 0,
+        pyramid_levels: int = 0,
+        cell_records: bool = False,
+        segmentation_only: bool = False,
+        batch_cell_thumbnails: bool = False,
+        batch_cell_atlases: bool = False,
+        atlas_levels: int = 0,
+    ):
+        self.cell_workers = cell_workers
+        self.write_queue_size = write_queue_size
+        self.alias_duplicate_channels = alias_duplicate_channels
+        self.ome_cache_dir = ome_cache_dir
+        self.memory_budget_mb = memory_budget_mb
+        self.scratch_dir = scratch_dir
+        self.staging_dir = staging_dir
+        self.staging_max_gb = staging_max_gb
+        self.compression = compression
+        self.compression_level = compression_level
+        self.compression_workers = compression_workers
+        self.tile_size = tile_size
+        self.pyramid_levels = pyramid_levels
+        self.cell_records = cell_records
+        self.segmentation_only = segmentation_only
+        self.batch_cell_thumbnails = batch_cell_thumbnails
+        self.batch_cell_atlases = batch_cell_atlases
+        self.atlas_levels = atlas_levels
+
+    @classmethod
+    def from_job(cls, job):
+        # the options as copied onto a CellJob by createJobsFromCSV.do_image
+        return cls(**{key: getattr(job, key) for key in vars(cls())})
 
 
 class QueryOptions:
@@ -17,7 +17,9 @@ STATUS_DIR = "processing"
 SLURM_SCRIPTS_DIR = "scripts_slurm"
 SLURM_OUTPUT_DIR = "out/"
 SLURM_ERROR_DIR = "err/"
-DATA_LOG_NAME = "data_jobs_out.csv"
+# json lines with the time and bytes of each processing stage of each fov and cell
+DATA_LOG_NAME = "data_jobs_out.jsonl"
+BUILD_LEDGER_DIR = "ledger"
 
 
 # the expected column names returned from labkey
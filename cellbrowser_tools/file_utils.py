@@ -0,0 +1,36 @@
+import contextlib
+import hashlib
+import os
+import uuid
+
+
+# a directory given with variables such as $TMPDIR, resolved on the node running the job
+def local_dir(path):
+    return os.path.abspath(os.path.expandvars(path))
+
+
+# sha256 hex digest of the absolute path, size and modification time of a file,
+# followed by any extra parts of the key. a file that is rewritten gets a new one.
+def file_fingerprint(path, *extra):
+    st = os.stat(path)
+    parts = [os.path.abspath(path), st.st_size, st.st_mtime_ns, *extra]
+    key = "|".join(str(part) for part in parts)
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+@contextlib.contextmanager
+def atomic_path(path, suffix=".part"):
+    """
+    Yields a unique path next to path to write to, which is renamed to path when the
+    block completes, and removed if it raises. Readers of path, including processes on
+    other nodes, never see a partially written file. The file is created by the caller,
+    so it gets the usual permissions.
+    """
+    tmp = f"{path}.{uuid.uuid4().hex}{suffix}"
+    try:
+        yield tmp
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
@@ -1,28 +1,48 @@
-from aicsimageio.writers import OmeTiffWriter
 from aicsimageio.writers.two_d_writer import TwoDWriter
 from aicsimageio import AICSImage
 from . import cellJob
 from . import dataHandoffUtils as utils
+from .background_writer import BackgroundWriter
 from .dataset_constants import AugmentedDataField, DataField
+from .file_utils import atomic_path, file_fingerprint, local_dir
+from .label_stats import (
+    LabelHistograms,
+    LabelIndex,
+    LabelProjections,
+    LabelValueCounts,
+    pad_bounds,
+)
+from .metrics import StageMetrics, file_size
+from .ome_cache import OmeMetadataCache
+from .ome_tiff_source import OmeTiffSource, SourceCache, check_num_planes
+from .ome_tiff_writer import write_ome_tiff_planes
+from .staging import get_staging_cache
+from .texture_atlas import (
+    atlas_levels,
+    atlas_tile_size,
+    build_texture_atlas,
+    load_atlas_metadata,
+    save_texture_atlas,
+)
 from aicsimageprocessing import thumbnailGenerator
-from aicsimageprocessing import textureAtlas
 
 # import copy
 import argparse
 import collections
-from copy import deepcopy
+from concurrent.futures import ThreadPoolExecutor
 import errno
 import json
 import logging
 import numpy as np
-from ome_types import from_xml, to_xml
-from ome_types.model import Channel, TiffData, Plane
+from ome_types import to_xml
+from ome_types.model import Channel, CommentAnnotation, TiffData, Plane
 import os
-import re
+import skimage.transform as sktransform
 import sys
-from tifffile import TiffFile
+import tempfile
+import threading
+import time
 import traceback
-import xml.etree.ElementTree as ET
 
 
 log = logging.getLogger()
@@ -31,277 +51,6 @@ log = logging.getLogger()
 ###############################################################################
 
 
-def check_num_planes(omepixels):
-    if len(omepixels.planes) != omepixels.size_c * omepixels.size_t * omepixels.size_z:
-        raise ValueError(
-            f"number of planes {len(omepixels.planes)} not consistent with sizeC*sizeZ*sizeT {omepixels.size_c}*{omepixels.size_t}*{omepixels.size_z}"
-        )
-
-
-def _clean_ome_xml_for_known_issues(xml: str) -> str:
-    # This is a known issue that could have been caused by prior versions of aicsimageio
-    # due to our old OMEXML.py file.
-    #
-    # You can see the PR that updated this exact line here:
-    # https://github.com/AllenCellModeling/aicsimageio/pull/116/commits/e3f9cde7f680edeef3ef3586a67fd8106e746167#diff-46a483e94af833f7eaa1106921191fed5e7c77f33a5c0c47a8f5a2d35ad3ba96L47
-    #
-    # Notably why this is invalid is that the 2012-03 schema _doesn't exist_
-    #
-    # Don't know how this wasn't ever caught before that PR but to ensure that we don't
-    # error in reading the OME in aicsimageio>=4.0.0, we manually find and replace this
-    # line in OME xml prior to creating the OME object.
-    KNOWN_INVALID_OME_XSD_REFERENCES = [
-        "www.openmicroscopy.org/Schemas/ome/2013-06",
-        "www.openmicroscopy.org/Schemas/OME/2012-03",
-    ]
-    REPLACEMENT_OME_XSD_REFERENCE = "www.openmicroscopy.org/Schemas/OME/2016-06"
-    # Store list of changes to print out with warning
-    metadata_changes = []
-
-    # Fix xsd reference
-    # This is from OMEXML object just having invalid reference
-    for known_invalid_ref in KNOWN_INVALID_OME_XSD_REFERENCES:
-        if known_invalid_ref in xml:
-            xml = xml.replace(
-                known_invalid_ref,
-                REPLACEMENT_OME_XSD_REFERENCE,
-            )
-            metadata_changes.append(
-                f"Replaced '{known_invalid_ref}' with "
-                f"'{REPLACEMENT_OME_XSD_REFERENCE}'."
-            )
-
-    # Read in XML
-    root = ET.fromstring(xml)
-
-    # Get the namespace
-    # In XML etree this looks like
-    # "{http://www.openmicroscopy.org/Schemas/OME/2016-06}"
-    # and must prepend any etree finds
-    namespace_matches = re.match(r"\{.*\}", root.tag)
-    if namespace_matches is not None:
-        namespace = namespace_matches.group(0)
-    else:
-        raise ValueError("XML does not contain a namespace")
-
-    # Find all Image elements and fix IDs
-    # This is for certain for test files of ours and ACTK files
-    for image_index, image in enumerate(root.findall(f"{namespace}Image")):
-        image_id = image.get("ID")
-        if not image_id.startswith("Image"):
-            image.set("ID", f"Image:{image_id}")
-            metadata_changes.append(
-                f"Updated attribute 'ID' from '{image_id}' to 'Image:{image_id}' "
-                f"on Image element at position {image_index}."
-            )
-
-        # Find all Pixels elements and fix IDs
-        for pixels_index, pixels in enumerate(image.findall(f"{namespace}Pixels")):
-            pixels_id = pixels.get("ID")
-            if not pixels_id.startswith("Pixels"):
-                pixels.set("ID", f"Pixels:{pixels_id}")
-                metadata_changes.append(
-                    f"Updated attribute 'ID' from '{pixels_id}' to "
-                    f"Pixels:{pixels_id}' on Pixels element at "
-                    f"position {pixels_index}."
-                )
-
-            # Determine if there is an out-of-order channel / plane elem
-            # This is due to OMEXML "add channel" function
-            # That added Channels and appropriate Planes to the XML
-            # But, placed them in:
-            # Channel
-            # Plane
-            # Plane
-            # ...
-            # Channel
-            # Plane
-            # Plane
-            #
-            # Instead of grouped together:
-            # Channel
-            # Channel
-            # ...
-            # Plane
-            # Plane
-            # ...
-            #
-            # This effects all CFE files (new and old) but for different reasons
-            pixels_children_out_of_order = False
-            encountered_something_besides_channel = False
-            for child in pixels:
-                if child.tag != f"{namespace}Channel":
-                    encountered_something_besides_channel = True
-                if (
-                    encountered_something_besides_channel
-                    and child.tag == f"{namespace}Channel"
-                ):
-                    pixels_children_out_of_order = True
-                    break
-
-            # Ensure order of:
-            # channels -> bindata | tiffdata | metadataonly -> planes
-            # setting this to true means just ALWAYS do this.
-            pixels_children_out_of_order = True
-            if pixels_children_out_of_order:
-                # Get all relevant elems
-                channels = [deepcopy(c) for c in pixels.findall(f"{namespace}Channel")]
-                bin_data = [deepcopy(b) for b in pixels.findall(f"{namespace}BinData")]
-                tiff_data = [
-                    deepcopy(t) for t in pixels.findall(f"{namespace}TiffData")
-                ]
-                # There should only be one metadata only element but to standardize
-                # list comprehensions later we findall
-                metadata_only = [
-                    deepcopy(m) for m in pixels.findall(f"{namespace}MetadataOnly")
-                ]
-                planes = [deepcopy(p) for p in pixels.findall(f"{namespace}Plane")]
-
-                # Old (2018 ish) cell feature explorer files sometimes contain both
-                # an empty metadata only element and filled tiffdata elements
-                # Since the metadata only elements are empty we can check this and
-                # choose the tiff data elements instead
-                #
-                # First check if there are any metadata only elements
-                if len(metadata_only) == 1:
-                    # Now check if _one of_ of the other two choices are filled
-                    # ^ in Python is XOR
-                    if (len(bin_data) > 0) ^ (len(tiff_data) > 0):
-                        metadata_children = list(metadata_only[0])
-                        # Now check if the metadata only elem has no children
-                        if len(metadata_children) == 0:
-                            # If so, just "purge" by creating empty list
-                            metadata_only = []
-
-                        # If there are children elements
-                        # Return XML and let XMLSchema Validation show error
-                        else:
-                            return xml
-
-                # After cleaning metadata only, validate the normal behaviors of
-                # OME schema
-                #
-                # Validate that there is only one of bindata, tiffdata, or metadata
-                if len(bin_data) > 0:
-                    if len(tiff_data) == 0 and len(metadata_only) == 0:
-                        selected_choice = bin_data
-                    else:
-                        # Return XML and let XMLSchema Validation show error
-                        return xml
-                elif len(tiff_data) > 0:
-                    if len(bin_data) == 0 and len(metadata_only) == 0:
-                        selected_choice = tiff_data
-                    else:
-                        # Return XML and let XMLSchema Validation show error
-                        return xml
-                elif len(metadata_only) == 1:
-                    if len(bin_data) == 0 and len(tiff_data) == 0:
-                        selected_choice = metadata_only
-                    else:
-                        # Return XML and let XMLSchema Validation show error
-                        return xml
-                else:
-                    # Return XML and let XMLSchema Validation show error
-                    return xml
-
-                # Remove all children from element to be replaced
-                # with ordered elements
-                for elem in list(pixels):
-                    pixels.remove(elem)
-
-                # Re-attach elements
-                for channel in channels:
-                    pixels.append(channel)
-                for elem in selected_choice:
-                    pixels.append(elem)
-                for plane in planes:
-                    pixels.append(plane)
-
-                metadata_changes.append(
-                    f"Reordered children of Pixels element at "
-                    f"position {pixels_index}."
-                )
-
-    # This is a result of dumping basically all experiement metadata
-    # into "StructuredAnnotation" blocks
-    #
-    # This affects new (2020) Cell Feature Explorer files
-    #
-    # Because these are structured annotations we don't want to mess with anyones
-    # besides the AICS generated bad structured annotations
-    aics_anno_removed_count = 0
-    sa = root.find(f"{namespace}StructuredAnnotations")
-    if sa is not None:
-        for xml_anno in sa.findall(f"{namespace}XMLAnnotation"):
-            # At least these are namespaced
-            if xml_anno.get("Namespace") == "alleninstitute.org/CZIMetadata":
-                # Get ID because some elements have annotation refs
-                # in both the base Image element and all plane elements
-                aics_anno_id = xml_anno.get("ID")
-                for image in root.findall(f"{namespace}Image"):
-                    for anno_ref in image.findall(f"{namespace}AnnotationRef"):
-                        if anno_ref.get("ID") == aics_anno_id:
-                            image.remove(anno_ref)
-
-                    # Clean planes
-                    pixels = image.find(f"{namespace}Pixels")
-                    for plane in pixels.findall(f"{namespace}Plane"):
-                        for anno_ref in plane.findall(f"{namespace}AnnotationRef"):
-                            if anno_ref.get("ID") == aics_anno_id:
-                                plane.remove(anno_ref)
-
-                # Remove the whole etree
-                sa.remove(xml_anno)
-                aics_anno_removed_count += 1
-
-    # Log changes
-    if aics_anno_removed_count > 0:
-        metadata_changes.append(
-            f"Removed {aics_anno_removed_count} AICS generated XMLAnnotations."
-        )
-
-    # If there are no annotations in StructuredAnnotations, remove it
-    if sa is not None:
-        if len(list(sa)) == 0:
-            root.remove(sa)
-
-    # If any piece of metadata was changed alert and rewrite
-    if len(metadata_changes) > 0:
-        log.debug("OME metadata was cleaned for known AICSImageIO 3.x OMEXML errors.")
-        log.debug(f"Full list of OME cleaning changes: {metadata_changes}")
-
-        # Register namespace
-        ET.register_namespace("", f"http://{REPLACEMENT_OME_XSD_REFERENCE}")
-
-        # Write out cleaned XML to string
-        xml = ET.tostring(
-            root,
-            encoding="unicode",
-            method="xml",
-        )
-
-    return xml
-
-
-def retrieve_file(read_path, file_name):
-    """
-    Copy a file to a temporary directory, assign it the given name, and return the full destination path.
-    """
-    return read_path
-    # output_directory = Path(tempfile.gettempdir())
-    # if not output_directory.is_dir():
-    #     raise Exception(f"Output directory {output_directory} does not exist!")
-
-    # destination = output_directory / file_name
-    # shutil.copyfile(read_path, destination)
-    # return destination
-
-
-def unretrieve_file(localpath):
-    # os.remove(localpath)
-    return
-
-
 def _int32(x):
     if x > 0xFFFFFFFF:
         raise OverflowError
@@ -323,50 +72,130 @@ def _rgba255(r, g, b, a):
     return _int32(x)
 
 
-# note that shape is expected to be z,y,x
-def clamp(x, y, z, shape):
-    # do not subtract 1 from max sizes because this will be used as an array range
-    # in crop_to_segmentation below
-    return max(0, min(x, shape[2])), max(0, min(y, shape[1])), max(0, min(z, shape[0]))
+# the value subtract_noise_floor of aicsimageprocessing would subtract from values
+def noise_floor(values, bins=32):
+    counts, edges = np.histogram(values, bins=bins, range=(values.min(), values.max()))
+    return float(edges[np.argmax(counts)])
+
+
+# CXY shape of the thumbnail of a YX image, scaled so that its longer edge is size.
+# same math as ThumbnailGenerator uses
+def _thumbnail_shape(size_y, size_x, size):
+    out_y = size if size_y > size_x else size * (float(size_y) / size_x)
+    out_x = size if size_y < size_x else size * (float(size_x) / size_y)
+    return 3, int(np.ceil(out_x)), int(np.ceil(out_y))
+
+
+# where a thumbnail of scaled_size goes, centered in one of full_size (both CXY)
+def _letterbox_bounds(full_size, scaled_size):
+    x0 = (full_size[1] - scaled_size[1]) // 2
+    x1 = x0 + scaled_size[1]
+    y0 = (full_size[2] - scaled_size[2]) // 2
+    y1 = y0 + scaled_size[2]
+    return x0, x1, y0, y1
+
+
+# Same thumbnail as the masked "max" ThumbnailGenerator.make_thumbnail, made from the
+# CYX masked max projections of the generator's channels instead of the cell crop.
+# Subtracting the noise floor and normalizing commute with the max projection.
+def projection_thumbnail(generator, projections, noise_floors):
+    size_y, size_x = projections.shape[1:]
+    shape_out_rgb = _thumbnail_shape(size_y, size_x, generator.size)
+    final_size = (shape_out_rgb[0], generator.size, generator.size)
+    composite = np.zeros(final_size)
+    for proj, floor, color in zip(projections, noise_floors, generator.colors):
+        thumb = np.maximum(proj - np.float32(floor), 0)
+        thmax = thumb.max()
+        if thmax > 0:
+            thumb /= thmax
+        rgb_out = np.repeat(np.expand_dims(thumb, 2), 3, 2) * np.float32(color)
+        rgbmax = rgb_out.max()
+        if rgbmax > 0:
+            rgb_out /= rgbmax
+        rgb_out = thumbnailGenerator.resize_cyx_image(
+            rgb_out.transpose((2, 1, 0)), shape_out_rgb
+        ).astype(np.float32)
+        x0, x1, y0, y1 = _letterbox_bounds(final_size, shape_out_rgb)
+        composite[:, x0:x1, y0:y1] += rgb_out
+    if composite.max() > 0:
+        composite /= composite.max()
+    return (composite.clip(0, 1) * 255.0).astype(np.uint8)
+
+
+def make_fov_thumbnail(image, channel_indices, colors, size, projection="slice"):
+    """
+    Full field thumbnail of a CZYX image (numpy or dask) without converting the whole
+    volume: only the thumbnail channels, only the center slice for the "slice"
+    projection, and only every n-th pixel in y and x are taken, with n as large as
+    possible while the longer edge keeps at least size pixels. The noise floor is then
+    estimated from those pixels.
+    """
+    _, size_z, size_y, size_x = image.shape
+    step = max(1, max(size_y, size_x) // size)
+    if projection == "slice":
+        z_range = slice(size_z // 2, size_z // 2 + 1)
+    else:
+        z_range = slice(None)
+    # ZCYX, as make_thumbnail wants it
+    reduced = np.stack(
+        [np.asarray(image[c, z_range, ::step, ::step]) for c in channel_indices], axis=1
+    )
+    generator = thumbnailGenerator.ThumbnailGenerator(
+        channel_indices=list(range(len(channel_indices))),
+        size=size,
+        mask_channel_index=0,  # apply_cell_mask=False to ignore this
+        colors=colors,
+        projection=projection,
+    )
+    return generator.make_thumbnail(reduced, apply_cell_mask=False)
 
 
 # assuming 3d segmentation image (ZYX)
-def get_segmentation_bounds(segmentation_image, index, margin=5):
+def get_segmentation_bounds(segmentation_image, index, margin=5, label_index=None):
+    if label_index is not None:
+        return label_index.padded_bounds(index, margin)
+
     # find bounding box
     b = np.argwhere(segmentation_image == index)
     # ths plus-1 means these bounds are min-inclusive and max-exclusive.
     # in other words, looping for i = start; i < stop; ++i
     (zstart, ystart, xstart), (zstop, ystop, xstop) = b.min(0), b.max(0) + 1
 
-    # apply margins and clamp to image edges
-    # TODO: margin in z is not the same as xy
-    xstart, ystart, zstart = clamp(
-        xstart - margin, ystart - margin, zstart - margin, segmentation_image.shape
-    )
-    xstop, ystop, zstop = clamp(
-        xstop + margin, ystop + margin, zstop + margin, segmentation_image.shape
+    return pad_bounds(
+        [[xstart, xstop], [ystart, ystop], [zstart, zstop]],
+        segmentation_image.shape,
+        margin,
     )
 
-    return [[xstart, xstop], [ystart, ystop], [zstart, zstop]]
+
+# assuming 4d image (CZYX) and bounds as [[xmin,xmax],[ymin,ymax],[zmin,zmax]]
+# returns a view into image: nothing is copied
+def crop_view(image, bounds):
+    return image[
+        :,
+        bounds[2][0] : bounds[2][1],
+        bounds[1][0] : bounds[1][1],
+        bounds[0][0] : bounds[0][1],
+    ]
 
 
 # assuming 4d image (CZYX) and bounds as [[xmin,xmax],[ymin,ymax],[zmin,zmax]]
 def crop_to_bounds(image, bounds):
-    atrim = np.copy(
-        image[
-            :,
-            bounds[2][0] : bounds[2][1],
-            bounds[1][0] : bounds[1][1],
-            bounds[0][0] : bounds[0][1],
-        ]
-    )
-    return atrim
+    return np.copy(crop_view(image, bounds))
 
 
 def image_to_mask(image3d, index, mask_positive_value=1):
     return np.where(image3d == index, mask_positive_value, 0).astype(image3d.dtype)
 
 
+# same as image_to_mask, but overwrites image3d instead of allocating new arrays.
+# scratch is an optional boolean array of the same shape, to be reused between calls.
+def image_to_mask_in_place(image3d, index, mask_positive_value=1, scratch=None):
+    scratch = np.equal(image3d, index, out=scratch)
+    np.multiply(scratch, mask_positive_value, out=image3d, casting="unsafe")
+    return image3d
+
+
 def make_dir(dirname):
     if not os.path.exists(dirname):
         try:
@@ -379,15 +208,72 @@ def make_dir(dirname):
 
 CellMeta = collections.namedtuple("CellMeta", "bounds parent_image index")
 
+# indices of channels in the combined image used for thumbnails
+# (membrane, nucleus, structure), as re-organized in add_segs_to_img
+THUMBNAIL_CHANNEL_INDICES = [0, 2, 1]
+THUMBNAIL_COLORS = [[1.0, 0.0, 1.0], [0.0, 1.0, 1.0], [1.0, 1.0, 0.0]]
+# cells stored as references into the full field ome-tiff: file name suffix and
+# format version of the json records that cell_extraction reads
+CELL_RECORD_SUFFIX = "_cell.json"
+CELL_RECORD_VERSION = 1
+# the OME annotation with the channel aliases (see alias_duplicate_channels), as json
+CHANNEL_ALIASES_NAMESPACE = "alleninstitute.org/cellbrowser/channelAliases"
+
+
+# identifies the raw pixels of a fov: the source file (path, size and modification
+# time) and the channels taken from it
+def raw_fingerprint(path, channel_indices):
+    return file_fingerprint(path, channel_indices)[:16]
+
+
+class OmeTemplate:
+    """
+    Derives the OME metadata of a cropped cell from the full field OME by structural
+    patching, instead of a to_xml/from_xml round trip per cell.
+    The full field OME is treated as read-only: each crop gets new OME, Image and
+    Pixels objects and new z-shifted planes, while everything else (instruments,
+    channels, annotations) is shared with the full field model.
+    """
+
+    def __init__(self, ome):
+        self.ome = ome
+
+    def crop(self, size_x, size_y, zmin, zmax):
+        image = self.ome.images[0]
+        pixels = image.pixels
+        # drop planes outside of z bounds and shift the remaining ones
+        planes = [
+            p.copy(update={"the_z": p.the_z - zmin})
+            for p in pixels.planes
+            if zmin <= p.the_z < zmax
+        ]
+        cropped_pixels = pixels.copy(
+            update={
+                "size_x": size_x,
+                "size_y": size_y,
+                "size_z": zmax - zmin,
+                "planes": planes,
+                "tiff_data_blocks": [TiffData(plane_count=len(planes))],
+            }
+        )
+        cropped_image = image.copy(update={"pixels": cropped_pixels})
+        return self.ome.copy(update={"images": [cropped_image] + self.ome.images[1:]})
+
 
 class ImageProcessor:
     def __init__(self, info):
         self.do_thumbnails = True
+        # see ProcessingOptions
+        self.options = utils.ProcessingOptions()
+        self.metrics_path = None
+        self.writer = None
 
         self.job = info
         if isinstance(info, cellJob.CellJob):
             self.row = info.cells[0]
             self.do_thumbnails = info.do_thumbnails
+            self.options = utils.ProcessingOptions.from_job(info)
+            self.metrics_path = info.metrics_path
         elif "cells" in info:
             self.row = info.cells[0]
         else:
@@ -400,11 +286,34 @@ class ImageProcessor:
         self.image_file = utils.normalize_path(readpath)
         self.file_name = utils.get_fov_name_from_row(self.row)
         self._generate_paths()
+        # time and bytes of every stage, appended to metrics_path as json lines
+        self.metrics = StageMetrics(self.file_name, self.metrics_path)
 
         # Setting up segmentation channels for full image
         self.seg_indices = []
         self.channels_to_mask = []
+        # name of a channel not stored -> name of the stored channel with the same data
+        self.channel_aliases = {}
         self.omexml = None
+        # identifies the raw channels of this fov; see raw_fingerprint
+        self.raw_fingerprint = None
+        # saved full field atlas metadata of a previous build with the same raw
+        # channels, in segmentation only mode
+        self.previous_atlas = None
+        # CZYX shape and dtype of the combined image
+        self.image_shape = None
+        self.image_dtype = None
+        # slab mode (see memory_budget_mb): instead of a combined image in memory, the
+        # still open sources and the (path, channel) read for each combined channel
+        self.sources = None
+        self.slab_channels = None
+        self._read_lock = threading.Lock()
+        # file backing the combined image when it is mapped from scratch_dir
+        self.scratch_path = None
+        # per channel min and max of the combined image, gathered in slab mode
+        self.channel_range = None
+        # histograms of the fov and its cells; see LabelHistograms
+        self.intensity_stats = None
 
         self.image = self.add_segs_to_img()
 
@@ -588,8 +497,42 @@ class ImageProcessor:
             self.channel_colors.append(_rgba255(0, 255, 255, 255))
             self.channels_to_mask.append(len(self.channel_names) - 1)
 
+        if self.options.alias_duplicate_channels:
+            file_list = self._alias_duplicate_channels(file_list)
+
         return file_list
 
+    # Drop channels whose voxels would be identical to an earlier channel: same file,
+    # same channel index and same masking. They are recorded in self.channel_aliases
+    # instead of being stored a second time.
+    def _alias_duplicate_channels(self, file_list):
+        nch = len(self.channel_names) - len(file_list)
+        channel_names = self.channel_names[:nch]
+        channel_colors = self.channel_colors[:nch]
+        channels_to_mask = [c for c in self.channels_to_mask if c < nch]
+        kept = []
+        sources = {}
+        for i, f in enumerate(file_list):
+            masked = (nch + i) in self.channels_to_mask
+            key = (f[0], int(f[1]), masked)
+            if key in sources:
+                log.info(
+                    f"{f[2]} is identical to {sources[key]}; storing it as an alias"
+                )
+                self.channel_aliases[f[2]] = sources[key]
+                continue
+            sources[key] = f[2]
+            kept.append(f)
+            channel_names.append(self.channel_names[nch + i])
+            channel_colors.append(self.channel_colors[nch + i])
+            if masked:
+                channels_to_mask.append(len(channel_names) - 1)
+
+        self.channel_names = channel_names
+        self.channel_colors = channel_colors
+        self.channels_to_mask = channels_to_mask
+        return kept
+
     def add_segs_to_img(self):
         # outdir = self.job.cbrImageLocation
         # make_dir(outdir)
@@ -603,35 +546,137 @@ class ImageProcessor:
         image_file = utils.normalize_path(image_file)
         # print(image_file)
 
-        # COPY FILE TO LOCAL TMP STORAGE BEFORE READING
-        image_file = retrieve_file(image_file, self.row[DataField.SourceFilename])
-
-        # 1. obtain OME XML metadata from original microscopy image
-        cr = AICSImage(image_file)
-
-        with TiffFile(image_file) as tiff:
-            if tiff.is_ome:
-                description = tiff.pages[0].description.strip()
-                description = _clean_ome_xml_for_known_issues(description)
-                # print(description)
-                self.omexml = from_xml(description)
+        self.raw_fingerprint = raw_fingerprint(image_file, list(self.channel_indices))
+        # raw channels stored by a previous build of this fov, if they can be reused
+        previous_image = None
+        if self.options.segmentation_only:
+            previous_image = self._find_previous_image()
+
+        # every file of this fov is opened (and each channel decoded) at most once
+        ome_cache = None
+        if self.options.ome_cache_dir:
+            ome_cache = OmeMetadataCache(self.options.ome_cache_dir)
+        staging = get_staging_cache(
+            self.options.staging_dir, self.options.staging_max_gb
+        )
+        if staging is not None:
+            # copy every file of this fov concurrently, while the first ones are read
+            raw_file = previous_image if previous_image is not None else image_file
+            staging.prefetch([raw_file] + [f[0] for f in file_list])
+        sources = SourceCache(ome_cache, staging, self.metrics)
+        keep_open = False
+        try:
+            image = self._combine_sources(
+                sources, image_file, file_list, previous_image
+            )
+            # in slab mode the pixels are read later on, from the same open sources
+            keep_open = image is None
+            return image
+        except Exception:
+            self.remove_scratch()
+            raise
+        finally:
+            if keep_open:
+                self.sources = sources
             else:
-                # this is REALLY catastrophic. Its not expected to happen for AICS data.
-                raise ValueError("Bad OME TIFF file")
-
-        # 2. obtain relevant channels from original image file
-        image = cr.get_image_data("CZYX", T=0)
-        if len(image.shape) != 4:
-            raise ValueError("Image did not return 4d CZYX data")
-
-        # image.shape[0] is num of channels.
-        if image.shape[0] <= max(self.channel_indices):
+                sources.close()
+
+    # segmentation only mode: the full field ome-tiff of a previous build whose raw
+    # channels are the ones this build would read, according to its saved atlas
+    def _find_previous_image(self):
+        previous = load_atlas_metadata(self.atlas_dir, self.file_name)
+        user_data = (previous or {}).get("userData") or {}
+        if user_data.get("rawFingerprint") != self.raw_fingerprint:
+            log.info("no previous build with the same raw channels; rebuilding all")
+            return None
+        nch = len(self.channel_indices)
+        if previous.get("channel_names", [])[:nch] != self.channel_names[:nch]:
+            log.info("raw channels of the previous build differ; rebuilding all")
+            return None
+        self.previous_atlas = previous
+        path = os.path.join(self.ometif_dir, self.file_name + ".ome.tif")
+        if not os.path.exists(path):
+            # only the atlas planes can be reused
+            return None
+        return path
+
+    def close_sources(self):
+        if self.sources is not None:
+            self.sources.close()
+            self.sources = None
+
+    # the combined image lives in anonymous memory, or in a file mapped from local
+    # scratch storage if scratch_dir is set. a mapped image can be paged out by the
+    # os, so more fov processes fit on one node without being killed for memory.
+    def _allocate_combined(self, shape, dtype):
+        if not self.options.scratch_dir:
+            return np.empty(shape, dtype=dtype)
+        scratch_dir = local_dir(self.options.scratch_dir)
+        make_dir(scratch_dir)
+        fd, self.scratch_path = tempfile.mkstemp(
+            dir=scratch_dir, prefix=f"{self.file_name}_", suffix=".dat"
+        )
+        os.close(fd)
+        log.info(f"mapping combined image to {self.scratch_path}")
+        combined = np.memmap(self.scratch_path, dtype=dtype, mode="w+", shape=shape)
+        if os.name == "posix":
+            # the mapping keeps the data until it is dropped, and nothing is left
+            # behind on scratch if the job is killed
+            self.remove_scratch()
+        return combined
+
+    def remove_scratch(self):
+        if self.scratch_path is not None:
+            try:
+                os.remove(self.scratch_path)
+            except FileNotFoundError:
+                pass
+            self.scratch_path = None
+
+    def _memory_budget_bytes(self):
+        if not self.options.memory_budget_mb or self.options.memory_budget_mb <= 0:
+            return 0
+        return int(self.options.memory_budget_mb * 1024 * 1024)
+
+    def _combine_sources(self, sources, image_file, file_list, previous_image=None):
+        # (path, channel) of the raw channels of the combined image
+        raw_channels = [(image_file, c) for c in self.channel_indices]
+        if previous_image is not None:
+            # segmentation only: the raw pixels were stored as the first channels of
+            # the previous full field ome-tiff. only the metadata of the source image
+            # is read, without staging it.
+            with OmeTiffSource(image_file, sources.ome_cache) as cr:
+                with self.metrics.stage("metadata clean"):
+                    self.omexml = cr.ome
+            previous = sources.source(previous_image)
+            nch = len(self.channel_indices)
+            same_shape = (previous.size_z, previous.size_y, previous.size_x) == (
+                cr.size_z,
+                cr.size_y,
+                cr.size_x,
+            )
+            if same_shape and previous.size_c >= nch:
+                log.info(f"reusing raw channels of {previous_image}")
+                raw_channels = [(previous_image, c) for c in range(nch)]
+            else:
+                log.info(f"{previous_image} does not match the source; not reused")
+                cr = sources.source(image_file, self.row[DataField.SourceFilename])
+        else:
+            # 1. obtain OME XML metadata from original microscopy image.
+            # the same open file serves the pixel reads below.
+            cr = sources.source(image_file, self.row[DataField.SourceFilename])
+            with self.metrics.stage("metadata clean"):
+                self.omexml = cr.ome
+
+        # 2. check the original image file has the channels we need.
+        # the pixels are read further down, one requested channel at a time, so that
+        # channels we discard are never pulled from disk.
+        num_channels = cr.size_c
+        if num_channels <= max(self.channel_indices):
             raise ValueError(
-                f"Image does not have enough channels - needs at least {max(self.channel_indices)} but has {image.shape[0]}"
+                f"Image does not have enough channels - needs at least {max(self.channel_indices)} but has {num_channels}"
             )
 
-        image = np.array([image[i] for i in self.channel_indices])
-
         # 3. fix up XML to reorder channels
         # we want to preserve all channel and plane data for the channels we are keeping!
         # rename:
@@ -640,6 +685,7 @@ class ImageProcessor:
         #   channel_indices[2] to channel2
         #   channel_indices[3] to channel3
 
+        ome_start = time.perf_counter()
         pix = self.omexml.images[0].pixels
         chxml = [pix.channels[channel] for channel in self.channel_indices]
         pix.channels = chxml
@@ -662,54 +708,99 @@ class ImageProcessor:
         # 4. remove all tiffdata elements in favor of one single one
         pix.tiff_data_blocks = [TiffData(plane_count=len(pix.planes))]
         check_num_planes(pix)
+        self.metrics.record("ome build", time.perf_counter() - ome_start)
 
         def add_channel(pix, name):
             channel_index = len(pix.channels)
             channel = Channel(id=f"Channel:0:{channel_index}", name=name)
             pix.channels.append(channel)
-            # add Planes(?)
-            for p in range(pix.size_z):
-                pix.planes.append(
-                    Plane(the_c=channel_index, the_z=p, the_t=pix.size_t - 1)
-                )
+            # add one Plane per z. validate a single Plane and copy it for the rest.
+            plane = Plane(the_c=channel_index, the_z=0, the_t=pix.size_t - 1)
+            pix.planes.extend(
+                [plane.copy(update={"the_z": z}) for z in range(pix.size_z)]
+            )
             pix.size_c += 1
 
+        # open every segmentation source up front so that the combined image can be
+        # allocated once at its final size and dtype, instead of growing it with
+        # np.append (which copies the whole volume) for every added channel
         nch = len(self.channel_indices)
+        seg_readers = [sources.source(f[0]) for f in file_list]
+
+        # same type promotion that np.append would have done
+        dtype = np.result_type(cr.dtype, *[r.dtype for r in seg_readers])
+        shape = (nch + len(file_list), cr.size_z, cr.size_y, cr.size_x)
+        self.image_shape = shape
+        self.image_dtype = dtype
+
+        budget = self._memory_budget_bytes()
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        if budget and nbytes > budget:
+            # too big to hold at once: generate_and_save streams it in z slabs
+            log.info(
+                f"combined image of {nbytes} bytes exceeds memory budget of {budget} bytes; using slab mode"
+            )
+            combined = None
+            self.slab_channels = list(raw_channels)
+        else:
+            combined = self._allocate_combined(shape, dtype)
+            # a volume is only kept around when another channel reads it again
+            reads = collections.Counter(
+                raw_channels + [(f[0], int(f[1])) for f in file_list]
+            )
+            for i, (path, c) in enumerate(raw_channels):
+                # only decodes the planes belonging to channel c
+                sources.read_zyx(
+                    path, c=c, t=0, out=combined[i], keep=reads[(path, c)] > 1
+                )
+
         self.seg_indices = []
-        i = 0
-        for f in file_list:
-            fpath = retrieve_file(f[0], os.path.basename(f[0]))
-            # expect TifReader to handle it.
-            reader = AICSImage(fpath)
-            seg = reader.get_image_data("ZYX", C=f[1], T=0)
+        for i, (f, reader) in enumerate(zip(file_list, seg_readers)):
             # seg is expected to be ZYX
             # image is expected to be CZYX
-            if seg.shape[0] != image.shape[1]:
+            seg_shape = (reader.size_z, reader.size_y, reader.size_x)
+            if seg_shape[0] != shape[1]:
                 raise ValueError(
-                    f"FOV {self.row[DataField.FOVId]} has shape mismatch {f[2]} {seg.shape[0]} vs FOV {image.shape[1]}"
+                    f"FOV {self.row[DataField.FOVId]} has shape mismatch {f[2]} {seg_shape[0]} vs FOV {shape[1]}"
                 )
-            if seg.shape[1] != image.shape[2]:
+            if seg_shape[1] != shape[2]:
                 raise ValueError(
-                    f"FOV {self.row[DataField.FOVId]} has shape mismatch {f[2]} {seg.shape[1]} vs FOV {image.shape[2]}"
+                    f"FOV {self.row[DataField.FOVId]} has shape mismatch {f[2]} {seg_shape[1]} vs FOV {shape[2]}"
                 )
-            if seg.shape[2] != image.shape[3]:
+            if seg_shape[2] != shape[3]:
                 raise ValueError(
-                    f"FOV {self.row[DataField.FOVId]} has shape mismatch {f[2]} {seg.shape[2]} vs FOV {image.shape[3]}"
+                    f"FOV {self.row[DataField.FOVId]} has shape mismatch {f[2]} {seg_shape[2]} vs FOV {shape[3]}"
                 )
             # append channels containing segmentations
             add_channel(pix, self.channel_names[nch + i])
 
-            # axis=0 is the C axis, and nucseg, cellseg, and structseg are assumed to be of shape ZYX
-            image = np.append(image, [seg], axis=0)
-            self.seg_indices.append(image.shape[0] - 1)
-            reader.close()
-            unretrieve_file(fpath)
-            i += 1
+            # C index nch + i, nucseg, cellseg, and structseg are assumed to be of shape ZYX
+            if combined is None:
+                self.slab_channels.append((f[0], int(f[1])))
+            else:
+                sources.read_zyx(
+                    f[0],
+                    c=int(f[1]),
+                    t=0,
+                    out=combined[nch + i],
+                    stage="segmentation read",
+                    keep=reads[(f[0], int(f[1]))] > 1,
+                )
+            self.seg_indices.append(nch + i)
+
+        if self.channel_aliases:
+            # channels that were not stored because they duplicate another channel.
+            # cell ome-tiffs share the annotations of the full field.
+            self.omexml.structured_annotations.append(
+                CommentAnnotation(
+                    id="Annotation:ChannelAliases",
+                    namespace=CHANNEL_ALIASES_NAMESPACE,
+                    value=json.dumps(self.channel_aliases, sort_keys=True),
+                )
+            )
 
         log.info("done making combined image")
-        cr.close()
-        unretrieve_file(image_file)
-        return image
+        return combined
 
     def generate_meta(self, metadata, row, cell_meta: CellMeta = None):
         m = {}
@@ -770,34 +861,134 @@ class ImageProcessor:
         m["gene"] = row[DataField.Gene]
         m["FOVId"] = row[DataField.FOVId]
 
-        # TODO: any preset viewing / slider values go here, including contrast presets
+        # lets segmentation only builds find outputs with the same raw channels
+        if self.raw_fingerprint is not None:
+            m["rawFingerprint"] = self.raw_fingerprint
+
+        # channels that were not stored because they duplicate another channel
+        if self.channel_aliases:
+            m["channelAliases"] = dict(self.channel_aliases)
+
+        # intensity histograms and contrast presets of the raw channels, so that
+        # viewers need not compute them from the atlas
+        if self.intensity_stats is not None:
+            names = self.channel_names[: len(self.channel_indices)]
+            label = cell_meta.index if cell_meta is not None else None
+            m.update(self.intensity_stats.metadata(names, label))
 
         return m
 
     def generate_and_save(self, do_segmented_cells=True, save_raw=True):
+        # with a write queue, outputs are written in the background while the next
+        # cell is computed. all writes are flushed (and errors raised) before returning.
+        start = time.perf_counter()
+        try:
+            if self.options.write_queue_size > 0:
+                try:
+                    with BackgroundWriter(
+                        max_pending=self.options.write_queue_size
+                    ) as writer:
+                        self.writer = writer
+                        self._generate_and_save(do_segmented_cells, save_raw)
+                finally:
+                    self.writer = None
+            else:
+                self._generate_and_save(do_segmented_cells, save_raw)
+        finally:
+            self.close_sources()
+            self.remove_scratch()
+            self.metrics.record("fov total", time.perf_counter() - start)
+            self.metrics.flush()
+
+    def _generate_and_save(self, do_segmented_cells, save_raw):
         base = self.file_name
 
-        # indices of channels in the original image
-        # before this, indices have been re-organized in add_segs_to_img (in __init__)
-        memb_index = 0
-        nuc_index = 2
-        struct_index = 1
-        thumbnail_colors = [[1.0, 0.0, 1.0], [0.0, 1.0, 1.0], [1.0, 1.0, 0.0]]
-
         log.info(f"Generating images for FOVId {self.row[DataField.FOVId]}")
 
+        if self.image is None:
+            label_index = self._save_fov_from_slabs(
+                base, save_raw, cells=do_segmented_cells
+            )
+        else:
+            label_index = None
+            cells = do_segmented_cells and self._has_cell_segmentation()
+            if cells:
+                # assumption: less than 256 cells segmented in the file.
+                # assumption: cell segmentation is a numeric index in the pixels
+                label_index = LabelIndex(self.image_shape[1:])
+            # one pass over the planes for the bounds of every cell, and the histograms
+            # of the fov and of the cells
+            log.info("indexing labels and histograms...")
+            with self.metrics.stage("label index"):
+                self.intensity_stats = self._gather_intensity_stats(
+                    label_index, cells=cells
+                )
+            self._save_fov(base, save_raw)
+
+        # GET READY TO DO SEGMENTED CELL IMAGES
+        if not do_segmented_cells:
+            return
+
+        log.info(f"found {len(label_index.labels())} labels")
+        thumbnails = None
+        if self.do_thumbnails and self.options.batch_cell_thumbnails:
+            log.info("making cell thumbnails...")
+            with self.metrics.stage("cell thumbnails"):
+                thumbnails = self._batch_cell_thumbnails(label_index)
+            log.info("done making cell thumbnails")
+        atlas_range = None
+        if self.options.batch_cell_atlases:
+            atlas_range = self._cell_atlas_range()
+        # the full field metadata is shared by all cells; see OmeTemplate
+        ome_template = OmeTemplate(self.omexml)
+
+        # cells only read from the shared combined image, so they can be processed
+        # concurrently. map keeps the cell order, and re-raises the first failure in
+        # that order, so the outcome does not depend on scheduling.
+        num_workers = self._num_cell_workers()
+        log.info(f"processing {len(self.job.cells)} cells with {num_workers} workers")
+
+        def do_cells(rows, crops=None):
+            def do_cell(row):
+                cropped = None
+                if crops is not None:
+                    cropped = crops.get(int(row[DataField.CellIndex]))
+                return self._generate_cell(
+                    row,
+                    label_index,
+                    ome_template,
+                    save_raw,
+                    thumbnails,
+                    atlas_range,
+                    cropped,
+                )
+
+            if num_workers > 1:
+                with ThreadPoolExecutor(max_workers=num_workers) as executor:
+                    list(executor.map(do_cell, rows))
+            else:
+                for row in rows:
+                    do_cell(row)
+
+        if self.image is None:
+            # the crops of a batch of cells come from one pass over the slabs
+            for rows, crops in self._crop_batches(label_index):
+                do_cells(rows, crops)
+                del crops
+        else:
+            do_cells(self.job.cells)
+        log.info("done processing cells for this fov")
+
+    def _save_fov(self, base, save_raw):
         if self.do_thumbnails:
             log.info("making thumbnail...")
-            generator = thumbnailGenerator.ThumbnailGenerator(
-                channel_indices=[memb_index, nuc_index, struct_index],
-                size=self.job.cbrThumbnailSize,
-                mask_channel_index=self.seg_indices[1],
-                colors=thumbnail_colors,
-                projection="slice",
-            )
-            ffthumb = generator.make_thumbnail(
-                self.image.transpose(1, 0, 2, 3), apply_cell_mask=False
-            )
+            with self.metrics.stage("thumbnail"):
+                ffthumb = make_fov_thumbnail(
+                    self.image,
+                    THUMBNAIL_CHANNEL_INDICES,
+                    THUMBNAIL_COLORS,
+                    self.job.cbrThumbnailSize,
+                )
             log.info("done making thumbnail")
         else:
             ffthumb = None
@@ -808,12 +999,8 @@ class ImageProcessor:
         aimage = AICSImage(self.image, known_dims="CZYX")
 
         log.info("generating atlas ...")
-        atlas = textureAtlas.generate_texture_atlas(
-            aimage,
-            name=base,
-            max_edge=2048,
-            pack_order=None,
-        )
+        with self.metrics.stage("atlas"):
+            atlas = self._generate_atlas(aimage, base, self.previous_atlas)
         log.info("done making atlas")
         p = self.omexml.images[0].pixels
         atlas.dims.pixel_size_x = p.physical_size_x
@@ -830,132 +1017,534 @@ class ImageProcessor:
             name=base,
             omexml=self.omexml,
             other_data=static_meta,
+            full_field=True,
         )
 
-        # GET READY TO DO SEGMENTED CELL IMAGES
-        if not do_segmented_cells:
-            return
+    # Same outputs as _save_fov, for a combined image that is never held in memory.
+    # One pass over z slabs feeds the label index, a copy of the volume reduced to the
+    # atlas tile size, the center slice for the thumbnail and the full field ome-tiff,
+    # which is written plane by plane as the slabs come in.
+    # Returns the label index of the cell segmentation.
+    def _save_fov_from_slabs(self, base, save_raw, cells=True):
+        nc, size_z, size_y, size_x = self.image_shape
+        nch = len(self.channel_indices)
+        cells = cells and self._has_cell_segmentation()
+        labels = self._cell_labels() if cells else []
+        counts_bytes = self._value_counts_bytes(labels)
+        value_counts = None
+        if counts_bytes is None or counts_bytes > self._memory_budget_bytes() // 2:
+            counts_bytes = 0
+        else:
+            # the ranges of the histograms are only known after this pass. the counts
+            # take their memory from the budget of the slabs.
+            value_counts = LabelValueCounts(nch, labels)
+        slab_depth = self._slab_depth(reserved=counts_bytes)
+        log.info(f"streaming {size_z} z slices in slabs of {slab_depth}")
+
+        label_index = LabelIndex((size_z, size_y, size_x))
+        tile_x, tile_y = atlas_tile_size(size_x, size_y, size_z)
+        reduced = np.empty((nc, size_z, tile_y, tile_x), dtype=np.float32)
+        center_z = size_z // 2
+        thumbnail = {}
+        lows, highs = [], []
+
+        def planes():
+            for z0 in range(0, size_z, slab_depth):
+                z1 = min(z0 + slab_depth, size_z)
+                slab = self._read_slab(z0, z1)
+                cell_seg = None
+                if cells:
+                    cell_seg = slab[self.seg_indices[1]]
+                    with self.metrics.stage("label index"):
+                        label_index.add_slab(cell_seg, z0)
+                if value_counts is not None:
+                    with self.metrics.stage("histograms"):
+                        for z in range(z1 - z0):
+                            value_counts.add_plane(
+                                slab[:nch, z], None if cell_seg is None else cell_seg[z]
+                            )
+                lows.append(slab.min(axis=(1, 2, 3)))
+                highs.append(slab.max(axis=(1, 2, 3)))
+                for c in range(nc):
+                    for z in range(z1 - z0):
+                        # same resampling as the atlas tiles, so that the atlas built
+                        # from the reduced volume below matches one built from the full one
+                        reduced[c, z0 + z] = sktransform.resize(
+                            slab[c, z], (tile_y, tile_x), preserve_range=True
+                        )
+                if self.do_thumbnails and z0 <= center_z < z1:
+                    # the "slice" thumbnail only looks at the center slice
+                    log.info("making thumbnail...")
+                    with self.metrics.stage("thumbnail"):
+                        thumbnail["image"] = make_fov_thumbnail(
+                            slab[:, center_z - z0 : center_z - z0 + 1],
+                            THUMBNAIL_CHANNEL_INDICES,
+                            THUMBNAIL_COLORS,
+                            self.job.cbrThumbnailSize,
+                        )
+                    log.info("done making thumbnail")
+                # channels vary fastest: the plane order of a ZCYX array
+                for z in range(z1 - z0):
+                    for c in range(nc):
+                        yield slab[c, z]
+                del slab
+
+        if save_raw:
+            ometif_dir = os.path.join(self.ometif_dir, base + ".ome.tif")
+            # pyramid levels of a volume over the memory budget wait on disk
+            level_dir = tempfile.gettempdir()
+            if self.options.scratch_dir:
+                level_dir = local_dir(self.options.scratch_dir)
+                make_dir(level_dir)
+            self._write_ome_tiff_planes(
+                ometif_dir,
+                planes(),
+                self.omexml,
+                (size_z, nc, size_y, size_x),
+                self.image_dtype,
+                full_field=True,
+                level_dir=level_dir,
+            )
+        else:
+            for _ in planes():
+                pass
+
+        ffthumb = thumbnail.get("image")
+        self.channel_range = (np.min(lows, axis=0), np.max(highs, axis=0))
+        if value_counts is not None:
+            lo, hi = self.channel_range
+            self.intensity_stats = value_counts.histograms(
+                list(zip(lo[:nch], hi[:nch]))
+            )
+        else:
+            # values too wide to count one by one, or counts over the memory budget:
+            # read the raw channels and cell segmentation once more, now that their
+            # ranges are known
+            with self.metrics.stage("histograms"):
+                self.intensity_stats = self._gather_intensity_stats(cells=cells)
+
+        log.info("generating atlas ...")
+        with self.metrics.stage("atlas"):
+            atlas = self._generate_atlas(
+                AICSImage(reduced, known_dims="CZYX"), base, self.previous_atlas
+            )
+        # the atlas describes the full volume, not the reduced copy it was built from
+        atlas.dims.width = size_x
+        atlas.dims.height = size_y
+        log.info("done making atlas")
+        p = self.omexml.images[0].pixels
+        atlas.dims.pixel_size_x = p.physical_size_x
+        atlas.dims.pixel_size_y = p.physical_size_y
+        atlas.dims.pixel_size_z = p.physical_size_z
+        atlas.dims.channel_names = [c for c in self.channel_names]
+        static_meta = self.generate_meta(self.omexml, self.row)
 
-        # assumption: less than 256 cells segmented in the file.
-        # assumption: cell segmentation is a numeric index in the pixels
-        cell_segmentation_image = self.image[self.seg_indices[1], :, :, :]
-        # which bins have segmented pixels?
-        # note that this includes zeroes, which is to be ignored.
-        h0 = np.unique(cell_segmentation_image)
-        h0 = h0[h0 > 0]
-
-        for idx, row in enumerate(self.job.cells):
-            # for each cell segmented from this image:
-            cell_name = utils.get_cell_name(
-                row[DataField.CellId], row[DataField.FOVId], row[DataField.CellLine]
+        self._save_and_post(
+            image=None,
+            thumbnail=ffthumb,
+            textureatlas=atlas,
+            name=base,
+            omexml=self.omexml,
+            other_data=static_meta,
+        )
+        return label_index
+
+    # number of z slices of every combined channel that fit in the memory budget less
+    # reserved bytes, leaving about as much again for the reads and resampling working
+    # on a slab
+    def _slab_depth(self, reserved=0):
+        nc, size_z, size_y, size_x = self.image_shape
+        slice_bytes = 2 * nc * size_y * size_x * self.image_dtype.itemsize
+        budget = max(0, self._memory_budget_bytes() - reserved)
+        return int(max(1, min(size_z, budget // slice_bytes)))
+
+    def _read_zyx(self, path, c, z_start, z_stop):
+        # open files are shared between cell threads
+        with self._read_lock:
+            with self.metrics.stage("channel read") as record:
+                data = self.sources.source(path).read_zyx(
+                    c=c, t=0, z_start=z_start, z_stop=z_stop
+                )
+                record["bytes_read"] = data.nbytes
+            return data
+
+    # CZYX slab z_start <= z < z_stop of the combined image
+    def _read_slab(self, z_start, z_stop):
+        nc, size_z, size_y, size_x = self.image_shape
+        slab = np.empty((nc, z_stop - z_start, size_y, size_x), dtype=self.image_dtype)
+        # channels repeated in the combined image are read once per slab
+        read = {}
+        for i, (path, c) in enumerate(self.slab_channels):
+            if (path, c) in read:
+                slab[i] = slab[read[(path, c)]]
+            else:
+                slab[i] = self._read_zyx(path, c, z_start, z_stop)
+                read[(path, c)] = i
+        return slab
+
+    # crops of the combined image from one pass over the z slabs they span.
+    # assuming bounds as label -> [[xmin,xmax],[ymin,ymax],[zmin,zmax]], returns
+    # label -> CZYX crop
+    def _read_crops(self, bounds):
+        if not bounds:
+            return {}
+        crops = {}
+        for i, ((x0, x1), (y0, y1), (z0, z1)) in bounds.items():
+            crops[i] = np.empty(
+                (len(self.slab_channels), z1 - z0, y1 - y0, x1 - x0),
+                dtype=self.image_dtype,
             )
+        z_start = min(b[2][0] for b in bounds.values())
+        z_stop = max(b[2][1] for b in bounds.values())
+        step = self._slab_depth()
+        for zs in range(z_start, z_stop, step):
+            ze = min(zs + step, z_stop)
+            slab = self._read_slab(zs, ze)
+            for i, ((x0, x1), (y0, y1), (z0, z1)) in bounds.items():
+                a, b = max(z0, zs), min(z1, ze)
+                if a < b:
+                    crops[i][:, a - z0 : b - z0] = slab[
+                        :, a - zs : b - zs, y0:y1, x0:x1
+                    ]
+            del slab
+        return crops
+
+    # The cells of this job in batches whose crops fit in half of the memory budget,
+    # the other half being left for the slab they are cut from.
+    # Yields (rows, label -> CZYX crop) for each batch.
+    def _crop_batches(self, label_index):
+        nc = self.image_shape[0]
+        limit = self._memory_budget_bytes() // 2
+        rows, bounds, nbytes = [], {}, 0
+        for row in self.job.cells:
             i = row[DataField.CellIndex]
-            log.info(
-                f"Generating images for CellId {row[DataField.CellId]}, segmented cell index {i}"
+            if i in label_index:
+                b = label_index.padded_bounds(i)
+                (x0, x1), (y0, y1), (z0, z1) = b
+                size = (
+                    nc * (x1 - x0) * (y1 - y0) * (z1 - z0) * self.image_dtype.itemsize
+                )
+                if bounds and nbytes + size > limit:
+                    yield rows, self._read_crops(bounds)
+                    rows, bounds, nbytes = [], {}, 0
+                bounds[int(i)] = b
+                nbytes += size
+            # cells without voxels fail in _generate_cell
+            rows.append(row)
+        if rows:
+            yield rows, self._read_crops(bounds)
+
+    # (lo, hi) values of each channel that every cell atlas scales to 0 and 255: the
+    # range over the whole fov, including 0. masked channels are 0 or 255 in cells.
+    def _cell_atlas_range(self):
+        if self.channel_range is not None:
+            lo, hi = self.channel_range
+        else:
+            flat = self.image.reshape(self.image.shape[0], -1)
+            lo, hi = flat.min(axis=1), flat.max(axis=1)
+        lo = np.minimum(lo.astype(np.float64), 0)
+        hi = hi.astype(np.float64)
+        for c in self.channels_to_mask:
+            lo[c], hi[c] = 0, 255
+        return lo, hi
+
+    # the planes of the given channels of the combined image, for each z
+    def _iter_planes(self, channels):
+        if self.image is not None:
+            for z in range(self.image_shape[1]):
+                yield [self.image[c, z] for c in channels]
+            return
+        size_z = self.image_shape[1]
+        step = self._slab_depth()
+        for z0 in range(0, size_z, step):
+            z1 = min(z0 + step, size_z)
+            read = {}
+            for c in channels:
+                if self.slab_channels[c] not in read:
+                    path, pc = self.slab_channels[c]
+                    read[(path, pc)] = self._read_zyx(path, pc, z0, z1)
+            slabs = [read[self.slab_channels[c]] for c in channels]
+            for z in range(z1 - z0):
+                yield [slab[z] for slab in slabs]
+            del read, slabs
+
+    # bytes the LabelValueCounts of the raw channels can grow to with labels: a count
+    # of every value of the dtype for the fov and for each label, per channel, and as
+    # much again for the counts of one plane. None if the raw values are too wide to
+    # be counted one by one.
+    def _value_counts_bytes(self, labels):
+        if self.image_dtype.kind not in "ui" or self.image_dtype.itemsize > 2:
+            return None
+        width = 1 << (8 * self.image_dtype.itemsize)
+        return (len(self.channel_indices) + 1) * (len(labels) + 1) * width * 8
+
+    # the cell segmentation is seg_indices[1], as in the masks of the cell images
+    def _has_cell_segmentation(self):
+        readpath = self.row[DataField.MembraneSegmentationReadPath]
+        return readpath != "" and readpath is not None and len(self.seg_indices) > 1
+
+    # the cell segmentation labels of the cells of this job
+    def _cell_labels(self):
+        return [int(row[DataField.CellIndex]) for row in self.job.cells]
+
+    # One pass over the raw channels for the histograms of the fov, and, if cells, over
+    # the cell segmentation for the histograms of every cell of this job. label_index,
+    # if given, is filled in the same pass.
+    def _gather_intensity_stats(self, label_index=None, cells=True):
+        nch = len(self.channel_indices)
+        labels = self._cell_labels() if cells else []
+        if self.channel_range is not None:
+            lo, hi = self.channel_range
+        else:
+            flat = self.image[:nch].reshape(nch, -1)
+            lo, hi = flat.min(axis=1), flat.max(axis=1)
+        stats = LabelHistograms(list(zip(lo[:nch], hi[:nch])), labels)
+        channels = list(range(nch))
+        if cells or label_index is not None:
+            channels.append(self.seg_indices[1])
+        for z, planes in enumerate(self._iter_planes(channels)):
+            cell_seg = planes[nch] if len(planes) > nch else None
+            if label_index is not None:
+                label_index.add_slab(cell_seg[np.newaxis], z)
+            stats.add_plane(planes[:nch], cell_seg)
+        return stats
+
+    # Thumbnails of every cell of this job, from one pass over the fov: label -> CYX.
+    # The noise floor of each channel is estimated once from the whole fov, where the
+    # per cell ThumbnailGenerator estimates it from each crop.
+    def _batch_cell_thumbnails(self, label_index):
+        bounds = {}
+        for row in self.job.cells:
+            i = row[DataField.CellIndex]
+            if i in label_index:
+                bounds[int(i)] = label_index.padded_bounds(i)
+        projections = LabelProjections(bounds, len(THUMBNAIL_CHANNEL_INDICES))
+        # every 4th pixel in y and x is plenty for a 32 bin histogram
+        samples = [[] for _ in THUMBNAIL_CHANNEL_INDICES]
+        channels = [self.seg_indices[1]] + THUMBNAIL_CHANNEL_INDICES
+        for planes in self._iter_planes(channels):
+            projections.add_plane(planes[0], planes[1:])
+            for sample, plane in zip(samples, planes[1:]):
+                sample.append(plane[::4, ::4].copy())
+        floors = [noise_floor(np.stack(sample)) for sample in samples]
+        del samples
+
+        generator = thumbnailGenerator.ThumbnailGenerator(
+            channel_indices=THUMBNAIL_CHANNEL_INDICES,
+            size=self.job.cbrThumbnailSize,
+            mask_channel_index=self.seg_indices[1],
+            colors=THUMBNAIL_COLORS,
+            projection="max",
+        )
+        return {
+            label: projection_thumbnail(
+                generator, projections.projection(label), floors
             )
+            for label in bounds
+        }
+
+    def _num_cell_workers(self):
+        # 0 means one worker per cpu available to this process
+        workers = self.options.cell_workers
+        if workers is None or workers <= 0:
+            if hasattr(os, "sched_getaffinity"):
+                workers = len(os.sched_getaffinity(0))
+            else:
+                workers = os.cpu_count() or 1
+        return max(1, min(workers, len(self.job.cells)))
+
+    def _generate_cell(
+        self,
+        row,
+        label_index,
+        ome_template,
+        save_raw,
+        thumbnails=None,
+        atlas_range=None,
+        cropped=None,
+    ):
+        base = self.file_name
 
-            bounds = get_segmentation_bounds(cell_segmentation_image, i)
+        # for each cell segmented from this image:
+        cell_name = utils.get_cell_name(
+            row[DataField.CellId], row[DataField.FOVId], row[DataField.CellLine]
+        )
+        i = row[DataField.CellIndex]
+        log.info(
+            f"Generating images for CellId {row[DataField.CellId]}, segmented cell index {i}"
+        )
+
+        if i not in label_index:
+            raise ValueError(
+                f"FOV {self.row[DataField.FOVId]} has no segmented voxels for cell index {i}"
+            )
+        bounds = label_index.padded_bounds(i)
+        crop_start = time.perf_counter()
+        # the one copy of this cell's voxels. everything below works on it in place
+        # or through views. in slab mode it was read with the other cells of its batch.
+        if cropped is None:
             cropped = crop_to_bounds(self.image, bounds)
-            # Turn the seg channels into true masks
-            # by zeroing out all elements != i.
-            # Note that structure segmentation and contour does not use same masking index rules -
-            # the values stored are not indexed by cell number.
-            for mi in self.channels_to_mask:
-                cropped[mi] = image_to_mask(cropped[mi], i, 255)
-
-            if self.do_thumbnails:
-                log.info("making thumbnail...")
-                generator = thumbnailGenerator.ThumbnailGenerator(
-                    channel_indices=[memb_index, nuc_index, struct_index],
-                    size=self.job.cbrThumbnailSize,
-                    mask_channel_index=self.seg_indices[1],
-                    colors=thumbnail_colors,
-                    projection="max",
-                )
+        # Turn the seg channels into true masks
+        # by zeroing out all elements != i.
+        # Note that structure segmentation and contour does not use same masking index rules -
+        # the values stored are not indexed by cell number.
+        scratch = np.empty(cropped.shape[1:], dtype=bool)
+        for mi in self.channels_to_mask:
+            image_to_mask_in_place(cropped[mi], i, 255, scratch=scratch)
+        del scratch
+        self.metrics.record("crop", time.perf_counter() - crop_start, cell=cell_name)
+
+        if thumbnails is not None:
+            # made for all cells at once; see _batch_cell_thumbnails
+            thumb = thumbnails[int(i)]
+        elif self.do_thumbnails:
+            log.info("making thumbnail...")
+            generator = thumbnailGenerator.ThumbnailGenerator(
+                channel_indices=THUMBNAIL_CHANNEL_INDICES,
+                size=self.job.cbrThumbnailSize,
+                mask_channel_index=self.seg_indices[1],
+                colors=THUMBNAIL_COLORS,
+                projection="max",
+            )
+            # make_thumbnail converts to float32 first, so a transposed view is enough
+            with self.metrics.stage("thumbnail", cell=cell_name):
                 thumb = generator.make_thumbnail(
-                    cropped.copy().transpose(1, 0, 2, 3), apply_cell_mask=True
+                    cropped.transpose(1, 0, 2, 3), apply_cell_mask=True
                 )
-                log.info("done making thumbnail")
-            else:
-                thumb = None
-
-            cell_meta = CellMeta(
-                bounds={
-                    "xmin": int(bounds[0][0]),
-                    "xmax": int(bounds[0][1]),
-                    "ymin": int(bounds[1][0]),
-                    "ymax": int(bounds[1][1]),
-                    "zmin": int(bounds[2][0]),
-                    "zmax": int(bounds[2][1]),
-                },
-                index=i,
-                parent_image=base,
-            )
+            log.info("done making thumbnail")
+        else:
+            thumb = None
+
+        cell_meta = CellMeta(
+            bounds={
+                "xmin": int(bounds[0][0]),
+                "xmax": int(bounds[0][1]),
+                "ymin": int(bounds[1][0]),
+                "ymax": int(bounds[1][1]),
+                "zmin": int(bounds[2][0]),
+                "zmax": int(bounds[2][1]),
+            },
+            index=i,
+            parent_image=base,
+        )
 
-            # for bn in cell_meta.bounds:
-            #    print(bn, cell_meta.bounds[bn])
-            minz = int(bounds[2][0])
-            maxz = int(bounds[2][1])
-
-            # print(f"cell Z size = {cropped.shape[1]}")
-            # print(f"cell Z bounds: {minz} to {maxz}")
-
-            # copy self.omexml for output
-            copyxml = None
-
-            log.info("making cropped image...")
-            # start with original metadata and make a copy
-            # copyxml = self.omexml.copy(deep=True)
-            copystr = to_xml(self.omexml)
-            copyxml = from_xml(copystr)
-
-            # now fix it up
-            pixels = copyxml.images[0].pixels
-            pixels.size_x = cropped.shape[3]
-            pixels.size_y = cropped.shape[2]
-            pixels.size_z = cropped.shape[1]
-
-            # if sizeZ changed, then we have to use bounds to fix up the plane elements:
-            # 1. drop planes outside of z bounds.
-            # 2. update remaining planes' the_z indices.
-            pixels.planes = [
-                p for p in pixels.planes if ((p.the_z < maxz) and (p.the_z >= minz))
-            ]
-            for p in pixels.planes:
-                p.the_z -= minz
+        # for bn in cell_meta.bounds:
+        #    print(bn, cell_meta.bounds[bn])
+        minz = int(bounds[2][0])
+        maxz = int(bounds[2][1])
+
+        # print(f"cell Z size = {cropped.shape[1]}")
+        # print(f"cell Z bounds: {minz} to {maxz}")
+
+        log.info("making cropped image...")
+        # derive the cell metadata from the full field metadata.
+        # if sizeZ changed, then the plane elements are fixed up using the bounds.
+        with self.metrics.stage("ome build", cell=cell_name):
+            copyxml = ome_template.crop(
+                size_x=cropped.shape[3],
+                size_y=cropped.shape[2],
+                zmin=minz,
+                zmax=maxz,
+            )
+        pixels = copyxml.images[0].pixels
 
-            log.info("done making cropped image")
+        log.info("done making cropped image")
 
-            # do texture atlas here
-            aimage_cropped = AICSImage(cropped, known_dims="CZYX")
-            # aimage_cropped.metadata = copyxml
-            log.info("generating cropped atlas ...")
-            atlas_cropped = textureAtlas.generate_texture_atlas(
+        # do texture atlas here
+        aimage_cropped = AICSImage(cropped, known_dims="CZYX")
+        # aimage_cropped.metadata = copyxml
+        log.info("generating cropped atlas ...")
+        with self.metrics.stage("atlas", cell=cell_name):
+            atlas_cropped = self._generate_atlas(
                 aimage_cropped,
-                name=cell_name,
-                max_edge=2048,
-                pack_order=None,
-            )
-            atlas_cropped.dims.pixel_size_x = pixels.physical_size_x
-            atlas_cropped.dims.pixel_size_y = pixels.physical_size_y
-            atlas_cropped.dims.pixel_size_z = pixels.physical_size_z
-            atlas_cropped.dims.channel_names = [c for c in self.channel_names]
-
-            static_meta_cropped = self.generate_meta(copyxml, row, cell_meta)
-
-            im_to_save = cropped
-            log.info("done making cropped atlas")
-
-            self._save_and_post(
-                image=im_to_save if save_raw else None,
-                thumbnail=thumb,
-                textureatlas=atlas_cropped,
-                name=cell_name,
-                omexml=copyxml,
-                other_data=static_meta_cropped,
+                cell_name,
+                self._previous_cell_atlas(cell_name, cell_meta),
+                atlas_range,
             )
-            log.info("done with cropped image")
-        log.info("done processing cells for this fov")
+        atlas_cropped.dims.pixel_size_x = pixels.physical_size_x
+        atlas_cropped.dims.pixel_size_y = pixels.physical_size_y
+        atlas_cropped.dims.pixel_size_z = pixels.physical_size_z
+        atlas_cropped.dims.channel_names = [c for c in self.channel_names]
+
+        static_meta_cropped = self.generate_meta(copyxml, row, cell_meta)
+
+        im_to_save = cropped
+        log.info("done making cropped atlas")
+
+        if save_raw and self.options.cell_records:
+            # the voxels are already in the full field ome-tiff; store where they are
+            record = self.cell_record(row, cell_meta)
+            record_path = os.path.join(self.ometif_dir, cell_name + CELL_RECORD_SUFFIX)
+            self._write(self._write_cell_record, record_path, record)
+            im_to_save = None
+
+        self._save_and_post(
+            image=im_to_save if save_raw else None,
+            thumbnail=thumb,
+            textureatlas=atlas_cropped,
+            name=cell_name,
+            omexml=copyxml,
+            other_data=static_meta_cropped,
+        )
+        log.info("done with cropped image")
+
+    # everything needed to cut this cell back out of the full field ome-tiff
+    def cell_record(self, row, cell_meta: CellMeta):
+        return {
+            "version": CELL_RECORD_VERSION,
+            "CellId": row[DataField.CellId],
+            "FOVId": row[DataField.FOVId],
+            # relative to the directory of the record, which is the same as the
+            # directory of the full field ome-tiff
+            "parent_image": cell_meta.parent_image + ".ome.tif",
+            "index": int(cell_meta.index),
+            "bounds": cell_meta.bounds,
+            "channel_names": [c for c in self.channel_names],
+            "channels_to_mask": [int(c) for c in self.channels_to_mask],
+            "mask_value": 255,
+            # channel name -> name of the stored channel it duplicates
+            "channel_aliases": dict(self.channel_aliases),
+        }
+
+    # texture atlas of image. with the saved atlas metadata of a previous build with
+    # the same raw channels, the atlas planes of the raw channels are taken from it.
+    def _generate_atlas(self, image, name, previous=None, atlas_range=None):
+        reused_channels = []
+        if previous is not None:
+            names = previous.get("channel_names", [])
+            reused_channels = [
+                c
+                for c in range(len(self.channel_indices))
+                if c < len(names) and names[c] == self.channel_names[c]
+            ]
+        return build_texture_atlas(
+            image, name, self.atlas_dir, previous, reused_channels, atlas_range
+        )
+
+    # saved atlas metadata of this cell from a previous build with the same raw
+    # channels, if the cell has the same bounds. cells whose bounds changed are
+    # rebuilt entirely.
+    def _previous_cell_atlas(self, cell_name, cell_meta: CellMeta):
+        if self.previous_atlas is None:
+            return None
+        previous = load_atlas_metadata(self.atlas_dir, cell_name)
+        if previous is None:
+            return None
+        user_data = previous.get("userData") or {}
+        bounds = [
+            cell_meta.bounds["xmin"],
+            cell_meta.bounds["xmax"],
+            cell_meta.bounds["ymin"],
+            cell_meta.bounds["ymax"],
+            cell_meta.bounds["zmin"],
+            cell_meta.bounds["zmax"],
+        ]
+        if user_data.get("rawFingerprint") != self.raw_fingerprint:
+            return None
+        if user_data.get("bounds") != bounds:
+            log.info(f"bounds of {cell_name} changed; rebuilding its atlas")
+            return None
+        return previous
 
     def _save_and_post(
         self,
@@ -965,28 +1554,16 @@ class ImageProcessor:
         name="",
         omexml=None,
         other_data=None,
+        full_field=False,
     ):
-        # physical_size = [0.065, 0.065, 0.29]
-        # note these are strings here.  it's ok for xml purposes but not for any math.
-        physical_size = [
-            self.row[DataField.PixelScaleX],
-            self.row[DataField.PixelScaleY],
-            self.row[DataField.PixelScaleZ],
-        ]
-
         png_dir = os.path.join(self.png_dir, name + ".png")
         ometif_dir = os.path.join(self.ometif_dir, name + ".ome.tif")
         # atlas_dir = os.path.join(self.atlas_dir, name + "_atlas.json")
 
         if thumbnail is not None:
-            log.info("saving thumbnail...")
-            with TwoDWriter(file_path=png_dir, overwrite_file=True) as writer:
-                writer.save(thumbnail)
-            log.info("thumbnail saved")
+            self._write(self._write_thumbnail, png_dir, thumbnail)
 
         if image is not None:
-            transposed_image = image.transpose(1, 0, 2, 3)
-            log.info("saving image...")
             # calculate the proper plane count
             omepixels = omexml.images[0].pixels
             check_num_planes(omepixels)
@@ -995,23 +1572,110 @@ class ImageProcessor:
                     plane_count=omepixels.size_c * omepixels.size_z * omepixels.size_t
                 )
             ]
-
-            ome_str = to_xml(omexml)
-            # appease ChimeraX and possibly others who expect to see this
-            ome_str = '<?xml version="1.0" encoding="UTF-8"?>' + ome_str
-            with OmeTiffWriter(file_path=ometif_dir, overwrite_file=True) as writer:
-                writer.save(
-                    transposed_image,
-                    ome_xml=ome_str,
-                    # channel_names=self.channel_names, channel_colors=self.channel_colors,
-                    pixels_physical_size=physical_size,
-                )
-            log.info("image saved")
+            self._write(
+                self._write_ome_tiff,
+                ometif_dir,
+                image,
+                omexml,
+                full_field,
+            )
 
         if textureatlas is not None:
-            log.info("saving texture atlas...")
-            textureatlas.save(self.atlas_dir, user_data=other_data)
-            log.info("texture atlas saved")
+            self._write(self._write_atlas, textureatlas, other_data)
+
+    # run a write on the background writer if there is one, otherwise right away.
+    # everything passed in must not be modified by the caller afterwards.
+    def _write(self, fn, *args):
+        if self.writer is not None:
+            self.writer.submit(fn, *args)
+        else:
+            fn(*args)
+
+    def _write_thumbnail(self, png_dir, thumbnail):
+        log.info("saving thumbnail...")
+        name = os.path.basename(png_dir)
+        with self.metrics.stage("write thumbnail", output=name) as record:
+            with TwoDWriter(file_path=png_dir, overwrite_file=True) as writer:
+                writer.save(thumbnail)
+            record["bytes_written"] = file_size(png_dir)
+        log.info("thumbnail saved")
+
+    def _write_ome_tiff(self, ometif_dir, image, omexml, full_field):
+        # CZYX image, written as ZCYX planes
+        size_c, size_z, size_y, size_x = image.shape
+        planes = (image[c, z] for z in range(size_z) for c in range(size_c))
+        self._write_ome_tiff_planes(
+            ometif_dir,
+            planes,
+            omexml,
+            (size_z, size_c, size_y, size_x),
+            image.dtype,
+            full_field=full_field,
+        )
+
+    # ome-tiff writer for ZCYX planes that may arrive one at a time, compressed with
+    # the configured codec. full field images are also tiled and given pyramid levels
+    # if configured.
+    def _write_ome_tiff_planes(
+        self, ometif_dir, planes, omexml, shape, dtype, full_field=False, level_dir=None
+    ):
+        omexml = omexml.copy(deep=True)
+        omepixels = omexml.images[0].pixels
+        check_num_planes(omepixels)
+        omepixels.tiff_data_blocks = [
+            TiffData(plane_count=omepixels.size_c * omepixels.size_z * omepixels.size_t)
+        ]
+        # the planes come z by z with channels varying fastest
+        omepixels.dimension_order = type(omepixels.dimension_order)("XYCZT")
+        ome_str = '<?xml version="1.0" encoding="UTF-8"?>' + to_xml(omexml)
+        log.info("saving image...")
+        name = os.path.basename(ometif_dir)
+        # in slab mode this includes reading the slabs the planes come from. they may
+        # be read from the previous version of this very file (segmentation only
+        # mode), which is why it is only replaced once all planes are written.
+        with self.metrics.stage("write ome-tiff", output=name) as record:
+            with atomic_path(ometif_dir) as part_path:
+                write_ome_tiff_planes(
+                    part_path,
+                    planes,
+                    ome_str,
+                    shape,
+                    dtype,
+                    compression=self.options.compression,
+                    compression_level=self.options.compression_level,
+                    workers=self.options.compression_workers,
+                    tile_size=self.options.tile_size if full_field else 0,
+                    pyramid_levels=self.options.pyramid_levels if full_field else 0,
+                    # segmentations and contours
+                    label_channels=self.seg_indices,
+                    level_dir=level_dir,
+                )
+            record["bytes_written"] = file_size(ometif_dir)
+        log.info("image saved")
+
+    def _write_cell_record(self, record_path, record):
+        log.info("saving cell record...")
+        name = os.path.basename(record_path)
+        with self.metrics.stage("write cell record", output=name) as stage:
+            with open(record_path, "w") as f:
+                json.dump(record, f, indent=2)
+            stage["bytes_written"] = file_size(record_path)
+        log.info("cell record saved")
+
+    def _write_atlas(self, textureatlas, other_data):
+        log.info("saving texture atlas...")
+        name = textureatlas.name + "_atlas.json"
+        with self.metrics.stage("write atlas", output=name) as record:
+            levels = atlas_levels(
+                textureatlas, self.options.atlas_levels, self.seg_indices
+            )
+            files = save_texture_atlas(
+                textureatlas, self.atlas_dir, user_data=other_data, levels=levels
+            )
+            record["bytes_written"] = sum(
+                file_size(os.path.join(self.atlas_dir, f)) for f in files
+            )
+        log.info("texture atlas saved")
 
 
 def do_main_image_with_celljob(info):
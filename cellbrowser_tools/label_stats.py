@@ -0,0 +1,336 @@
+import numpy as np
+
+
+# intensity histograms in the atlas metadata, and the percentiles of their default
+# window/level preset
+HISTOGRAM_BINS = 256
+PRESET_PERCENTILES = (0.5, 99.5)
+
+
+# note that shape is expected to be z,y,x
+def clamp(x, y, z, shape):
+    # do not subtract 1 from max sizes because this will be used as an array range
+    # in crop_to_segmentation below
+    return max(0, min(x, shape[2])), max(0, min(y, shape[1])), max(0, min(z, shape[0]))
+
+
+# bounds as [[xmin,xmax],[ymin,ymax],[zmin,zmax]], shape as z,y,x
+def pad_bounds(bounds, shape, margin=5):
+    (xstart, xstop), (ystart, ystop), (zstart, zstop) = bounds
+    # apply margins and clamp to image edges
+    # TODO: margin in z is not the same as xy
+    xstart, ystart, zstart = clamp(
+        xstart - margin, ystart - margin, zstart - margin, shape
+    )
+    xstop, ystop, zstop = clamp(xstop + margin, ystop + margin, zstop + margin, shape)
+
+    return [[xstart, xstop], [ystart, ystop], [zstart, zstop]]
+
+
+class LabelIndex:
+    """
+    Bounds, voxel counts and centroids for every nonzero label of a ZYX segmentation,
+    gathered in one pass over the volume instead of one full scan per cell.
+    Planes are visited one at a time so the extra memory is bounded by a single plane.
+    """
+
+    def __init__(self, shape):
+        # z,y,x shape of the full segmentation volume
+        self.shape = tuple(shape)
+        self._size = 0
+        self._counts = np.zeros(0, dtype=np.int64)
+        self._mins = np.zeros((3, 0), dtype=np.int64)
+        self._maxs = np.zeros((3, 0), dtype=np.int64)
+        self._sums = np.zeros((3, 0), dtype=np.float64)
+
+    @classmethod
+    def from_image(cls, segmentation_image):
+        index = cls(segmentation_image.shape)
+        index.add_slab(segmentation_image, 0)
+        return index
+
+    def _grow(self, size):
+        extra = size - self._size
+        big = np.iinfo(np.int64).max
+        self._counts = np.append(self._counts, np.zeros(extra, dtype=np.int64))
+        self._mins = np.append(self._mins, np.full((3, extra), big), axis=1)
+        self._maxs = np.append(self._maxs, np.full((3, extra), -1), axis=1)
+        self._sums = np.append(self._sums, np.zeros((3, extra)), axis=1)
+        self._size = size
+
+    # slab is ZYX and starts at plane z_offset of the full volume
+    def add_slab(self, slab, z_offset=0):
+        for z in range(slab.shape[0]):
+            plane = slab[z]
+            ys, xs = np.nonzero(plane)
+            if len(ys) == 0:
+                continue
+            labels = plane[ys, xs].astype(np.intp)
+            top = int(labels.max()) + 1
+            if top > self._size:
+                self._grow(top)
+            counts = np.bincount(labels, minlength=self._size)
+            present = np.flatnonzero(counts)
+            self._counts += counts
+            zs = z + z_offset
+            # axis order here is x,y,z to match the bounds layout
+            for axis, coords in ((0, xs), (1, ys)):
+                np.minimum.at(self._mins[axis], labels, coords)
+                np.maximum.at(self._maxs[axis], labels, coords)
+                self._sums[axis] += np.bincount(
+                    labels, weights=coords, minlength=self._size
+                )
+            self._mins[2, present] = np.minimum(self._mins[2, present], zs)
+            self._maxs[2, present] = np.maximum(self._maxs[2, present], zs)
+            self._sums[2] += counts * zs
+
+    def labels(self):
+        present = np.flatnonzero(self._counts)
+        return [int(label) for label in present if label > 0]
+
+    def __contains__(self, label):
+        label = int(label)
+        return 0 < label < self._size and self._counts[label] > 0
+
+    def voxel_count(self, label):
+        return int(self._counts[int(label)]) if label in self else 0
+
+    # x,y,z center of mass of the label
+    def centroid(self, label):
+        if label not in self:
+            raise KeyError(label)
+        label = int(label)
+        return tuple(float(s) for s in self._sums[:, label] / self._counts[label])
+
+    # min-inclusive, max-exclusive bounds without any margin
+    def bounds(self, label):
+        if label not in self:
+            raise KeyError(label)
+        label = int(label)
+        return [
+            [int(self._mins[axis, label]), int(self._maxs[axis, label]) + 1]
+            for axis in range(3)
+        ]
+
+    def padded_bounds(self, label, margin=5):
+        return pad_bounds(self.bounds(label), self.shape, margin)
+
+
+class LabelProjections:
+    """
+    Max projections along z of a few channels, masked by a label image, for many labels
+    at once. Every labeled pixel of a plane goes to the projection of its own label, so
+    one pass over the planes costs the same however many labels there are.
+    Each projection covers the x,y extent of the bounds of its label.
+    """
+
+    def __init__(self, bounds, num_channels):
+        # label -> [[xmin,xmax],[ymin,ymax],...] bounds, containing every voxel of
+        # that label
+        self.bounds = bounds
+        size = max(bounds) + 1 if bounds else 1
+        self._known = np.zeros(size, dtype=bool)
+        self._offset = np.zeros(size, dtype=np.intp)
+        self._x0 = np.zeros(size, dtype=np.intp)
+        self._y0 = np.zeros(size, dtype=np.intp)
+        self._width = np.zeros(size, dtype=np.intp)
+        offset = 0
+        for label, ((x0, x1), (y0, y1), _) in bounds.items():
+            self._known[label] = True
+            self._offset[label] = offset
+            self._x0[label] = x0
+            self._y0[label] = y0
+            self._width[label] = x1 - x0
+            offset += (x1 - x0) * (y1 - y0)
+        # the projections of all labels, one after the other
+        self._buffer = np.zeros((num_channels, offset), dtype=np.float32)
+
+    # labels is a YX plane of the label image, channels the same plane of each channel
+    def add_plane(self, labels, channels):
+        flat = labels.ravel()
+        where = np.flatnonzero(flat)
+        found = flat[where].astype(np.intp)
+        keep = found < len(self._known)
+        where, found = where[keep], found[keep]
+        keep = self._known[found]
+        where, found = where[keep], found[keep]
+        ys, xs = np.divmod(where, labels.shape[1])
+        # a pixel has one label, so no position repeats within a plane
+        pos = (
+            self._offset[found]
+            + (ys - self._y0[found]) * self._width[found]
+            + (xs - self._x0[found])
+        )
+        for c, plane in enumerate(channels):
+            values = plane.ravel()[where]
+            self._buffer[c, pos] = np.maximum(self._buffer[c, pos], values)
+
+    # CYX projections of label; zero where no voxel of the label is
+    def projection(self, label):
+        (x0, x1), (y0, y1), _ = self.bounds[label]
+        start = self._offset[label]
+        size = (x1 - x0) * (y1 - y0)
+        return self._buffer[:, start : start + size].reshape(-1, y1 - y0, x1 - x0)
+
+
+class LabelHistograms:
+    """
+    Histograms of a few channels over the whole volume and over the voxels of each of
+    many labels, all with the same bins, gathered in one pass over the planes.
+    """
+
+    def __init__(self, ranges, labels=(), bins=HISTOGRAM_BINS):
+        # (min, max) of each channel, split into equal bins
+        self.lo = np.array([r[0] for r in ranges], dtype=np.float64)
+        self.hi = np.array([r[1] for r in ranges], dtype=np.float64)
+        self.bins = bins
+        self.labels = [int(label) for label in labels]
+        self._index = np.full(max(self.labels, default=0) + 1, -1, dtype=np.intp)
+        self._index[self.labels] = np.arange(len(self.labels))
+        self.total = np.zeros((len(ranges), bins), dtype=np.int64)
+        self.per_label = np.zeros((len(ranges), len(self.labels), bins), dtype=np.int64)
+
+    def _bin(self, c, values):
+        span = self.hi[c] - self.lo[c]
+        if span <= 0:
+            return np.zeros(values.shape, dtype=np.intp)
+        found = ((values - self.lo[c]) * (self.bins / span)).astype(np.intp)
+        return np.clip(found, 0, self.bins - 1)
+
+    # channels are the same YX plane of each channel, labels that plane of the labels
+    def add_plane(self, channels, labels=None):
+        where = None
+        if labels is not None and self.labels:
+            where, k = _label_positions(labels, self._index)
+        size = len(self.labels) * self.bins
+        for c, plane in enumerate(channels):
+            binned = self._bin(c, plane.ravel())
+            self.total[c] += np.bincount(binned, minlength=self.bins)
+            if where is not None and len(where):
+                counts = np.bincount(k * self.bins + binned[where], minlength=size)
+                self.per_label[c] += counts.reshape(len(self.labels), self.bins)
+
+    # "histograms" and "presets" of the volume, or of one label, for atlas metadata
+    def metadata(self, channel_names, label=None):
+        if label is None:
+            counts = self.total
+        else:
+            counts = self.per_label[:, self.labels.index(int(label))]
+        histograms = []
+        presets = []
+        for c, name in enumerate(channel_names):
+            lo, hi = float(self.lo[c]), float(self.hi[c])
+            histograms.append(
+                {"channel": name, "min": lo, "max": hi, "counts": counts[c].tolist()}
+            )
+            presets.append({"channel": name, **histogram_preset(counts[c], lo, hi)})
+        return {"histograms": histograms, "presets": presets}
+
+
+# flat positions of the pixels of a YX plane of labels that belong to one of the
+# labels mapped by index (label -> k, or -1), and their k
+def _label_positions(labels, index):
+    flat = labels.ravel()
+    where = np.flatnonzero(flat)
+    found = flat[where].astype(np.intp)
+    keep = found < len(index)
+    where, found = where[keep], found[keep]
+    k = index[found]
+    keep = k >= 0
+    return where[keep], k[keep]
+
+
+class LabelValueCounts:
+    """
+    Exact counts of every value of a few 8 or 16 bit integer channels, over the whole
+    volume and over the voxels of each of many labels, gathered in one pass over the
+    planes. Unlike LabelHistograms, the range the bins split does not have to be known
+    before the pass: histograms() bins the counts afterwards, into the same bins that
+    LabelHistograms would have filled. Memory is 8 bytes times the number of labels
+    times the largest value seen, per channel: up to 65536 values for 16 bit channels,
+    so much more than LabelHistograms takes when the ranges are known.
+    """
+
+    def __init__(self, num_channels, labels=()):
+        self.labels = [int(label) for label in labels]
+        self._index = np.full(max(self.labels, default=0) + 1, -1, dtype=np.intp)
+        self._index[self.labels] = np.arange(len(self.labels))
+        # index i counts the value i + offset; offset is the lowest value of the dtype
+        self.offset = 0
+        self.total = [np.zeros(0, dtype=np.int64) for _ in range(num_channels)]
+        self.per_label = [
+            np.zeros((len(self.labels), 0), dtype=np.int64) for _ in range(num_channels)
+        ]
+
+    def _grow(self, c, size):
+        extra = size - len(self.total[c])
+        if extra > 0:
+            self.total[c] = np.append(self.total[c], np.zeros(extra, dtype=np.int64))
+            self.per_label[c] = np.append(
+                self.per_label[c],
+                np.zeros((len(self.labels), extra), dtype=np.int64),
+                axis=1,
+            )
+
+    # channels are the same YX plane of each channel, labels that plane of the labels
+    def add_plane(self, channels, labels=None):
+        where = None
+        if labels is not None and self.labels:
+            where, k = _label_positions(labels, self._index)
+        for c, plane in enumerate(channels):
+            self.offset = int(np.iinfo(plane.dtype).min)
+            values = plane.ravel()
+            if self.offset:
+                values = values.astype(np.intp) - self.offset
+            counts = np.bincount(values)
+            self._grow(c, len(counts))
+            self.total[c][: len(counts)] += counts
+            if where is not None and len(where):
+                width = len(self.total[c])
+                counts = np.bincount(
+                    k * width + values[where], minlength=len(self.labels) * width
+                )
+                self.per_label[c] += counts.reshape(len(self.labels), width)
+
+    # (min, max) value of channel c
+    def value_range(self, c):
+        present = np.flatnonzero(self.total[c])
+        if len(present) == 0:
+            return 0, 0
+        return int(present[0]) + self.offset, int(present[-1]) + self.offset
+
+    # LabelHistograms of the counts, with the bins of channel c splitting ranges[c]
+    def histograms(self, ranges, bins=HISTOGRAM_BINS):
+        stats = LabelHistograms(ranges, self.labels, bins)
+        for c, total in enumerate(self.total):
+            if len(total) == 0:
+                continue
+            binned = stats._bin(c, np.arange(len(total)) + self.offset)
+            # values ascend, and so do their bins: sum each run of the same bin
+            starts = np.flatnonzero(np.diff(binned, prepend=-1))
+            stats.total[c][binned[starts]] = np.add.reduceat(total, starts)
+            if len(self.labels):
+                stats.per_label[c][:, binned[starts]] = np.add.reduceat(
+                    self.per_label[c], starts, axis=1
+                )
+        return stats
+
+
+# window/level preset of a histogram of bins between lo and hi: the intensities at
+# the two percentiles
+def histogram_preset(counts, lo, hi, percentiles=PRESET_PERCENTILES):
+    cdf = np.cumsum(counts)
+    low, high = lo, hi
+    if len(cdf) and cdf[-1] > 0:
+        width = (hi - lo) / len(counts)
+        first = np.searchsorted(cdf, cdf[-1] * percentiles[0] / 100.0, side="right")
+        last = np.searchsorted(cdf, cdf[-1] * percentiles[1] / 100.0, side="left")
+        low = lo + width * min(first, len(counts) - 1)
+        high = lo + width * (min(last, len(counts) - 1) + 1)
+    return {
+        "percentiles": list(percentiles),
+        "min": float(low),
+        "max": float(high),
+        "window": float(high - low),
+        "level": float((high + low) / 2),
+    }
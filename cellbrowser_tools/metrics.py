@@ -0,0 +1,109 @@
+from contextlib import contextmanager
+import json
+import logging
+import os
+import threading
+import time
+
+
+log = logging.getLogger(__name__)
+
+
+class StageMetrics:
+    """
+    Wall time, bytes read and bytes written of each processing stage of one fov, and of
+    each of its cells. Stages may run on several threads at once.
+    flush() appends one json line per stage to path; without a path nothing is kept.
+    """
+
+    def __init__(self, fov=None, path=None):
+        self.fov = fov
+        self.path = path
+        self._records = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name, cell=None, bytes_read=0, bytes_written=0, **fields):
+        """
+        Time the body of a with statement as stage name. The body may add to the
+        "bytes_read" and "bytes_written" of the record it is given.
+        """
+        record = {
+            "fov": self.fov,
+            "cell": cell,
+            "stage": name,
+            "bytes_read": bytes_read,
+            "bytes_written": bytes_written,
+            **fields,
+        }
+        start = time.perf_counter()
+        try:
+            yield record
+        except Exception:
+            record["failed"] = True
+            raise
+        finally:
+            record["seconds"] = time.perf_counter() - start
+            self._append(record)
+
+    # a stage timed by the caller
+    def record(self, name, seconds, cell=None, bytes_read=0, bytes_written=0, **fields):
+        self._append(
+            {
+                "fov": self.fov,
+                "cell": cell,
+                "stage": name,
+                "bytes_read": bytes_read,
+                "bytes_written": bytes_written,
+                **fields,
+                "seconds": seconds,
+            }
+        )
+
+    def _append(self, record):
+        if self.path:
+            with self._lock:
+                self._records.append(record)
+
+    def flush(self):
+        with self._lock:
+            records, self._records = self._records, []
+        if not self.path or not records:
+            return
+        text = "".join(json.dumps(r, default=str) + "\n" for r in records)
+        try:
+            # one append per fov, so that the lines of concurrent jobs don't interleave
+            with open(self.path, "a") as f:
+                f.write(text)
+        except OSError as e:
+            # metrics are never worth failing a fov for
+            log.warning(f"could not write metrics to {self.path}: {e}")
+
+
+def file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+# totals per stage over the json lines files at paths:
+# stage -> {"count", "seconds", "bytes_read", "bytes_written"}
+def summarize(paths):
+    totals = {}
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                record = json.loads(line)
+                entry = totals.setdefault(
+                    record["stage"],
+                    {"count": 0, "seconds": 0.0, "bytes_read": 0, "bytes_written": 0},
+                )
+                entry["count"] += 1
+                entry["seconds"] += record.get("seconds", 0.0)
+                entry["bytes_read"] += record.get("bytes_read", 0)
+                entry["bytes_written"] += record.get("bytes_written", 0)
+    return totals
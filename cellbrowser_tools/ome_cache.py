@@ -0,0 +1,52 @@
+import logging
+import os
+import pickle
+
+import ome_types
+
+from .file_utils import atomic_path, file_fingerprint, local_dir
+
+
+log = logging.getLogger(__name__)
+
+# bump this when the cleaning of OME metadata changes, to invalidate old entries
+CACHE_FORMAT_VERSION = 1
+
+
+class OmeMetadataCache:
+    """
+    Persistent on-disk cache of cleaned and parsed OME metadata.
+
+    Entries are keyed by the source file's absolute path, size and modification time,
+    so a file that is rewritten is parsed again, while reruns and retries over files
+    that never change skip the xml cleaning and validation entirely.
+    Every get() returns a fresh object, which callers are free to modify.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = local_dir(cache_dir)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _entry_path(self, path):
+        digest = file_fingerprint(
+            path, CACHE_FORMAT_VERSION, getattr(ome_types, "__version__", "")
+        )
+        return os.path.join(self.cache_dir, f"{digest}.pkl")
+
+    def get(self, path):
+        entry = self._entry_path(path)
+        try:
+            with open(entry, "rb") as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            # a damaged entry is treated as a miss and overwritten by the next put()
+            log.warning(f"ignoring unreadable OME metadata cache entry {entry}: {e}")
+            return None
+
+    def put(self, path, ome):
+        # concurrent jobs never read a partially written entry
+        with atomic_path(self._entry_path(path)) as tmp:
+            with open(tmp, "wb") as f:
+                pickle.dump(ome, f, protocol=pickle.HIGHEST_PROTOCOL)
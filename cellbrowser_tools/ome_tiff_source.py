@@ -0,0 +1,481 @@
+from aicsimageio import AICSImage
+import logging
+import numpy as np
+from ome_types import from_xml
+import os
+import re
+from tifffile import TiffFile
+import xml.etree.ElementTree as ET
+
+from .metrics import StageMetrics
+
+
+log = logging.getLogger(__name__)
+
+
+def check_num_planes(omepixels):
+    if len(omepixels.planes) != omepixels.size_c * omepixels.size_t * omepixels.size_z:
+        raise ValueError(
+            f"number of planes {len(omepixels.planes)} not consistent with sizeC*sizeZ*sizeT {omepixels.size_c}*{omepixels.size_t}*{omepixels.size_z}"
+        )
+
+
+# position of each Pixels child in the schema order:
+# channels -> bindata | tiffdata | metadataonly -> planes
+_PIXELS_CHILD_RANKS = {
+    "Channel": 0,
+    "BinData": 1,
+    "TiffData": 1,
+    "MetadataOnly": 1,
+    "Plane": 2,
+}
+
+
+def _pixels_children_out_of_order(pixels, namespace) -> bool:
+    # True if the children of a Pixels element have to be rebuilt: they are not in
+    # schema order, they mix more than one of bindata / tiffdata / metadataonly,
+    # or there is a child we don't know how to place.
+    last_rank = 0
+    data_tags = set()
+    for child in pixels:
+        tag = child.tag[len(namespace) :]
+        rank = _PIXELS_CHILD_RANKS.get(tag)
+        if rank is None or rank < last_rank:
+            return True
+        if rank == 1:
+            data_tags.add(tag)
+        last_rank = rank
+    return len(data_tags) > 1
+
+
+def _clean_ome_xml_for_known_issues(xml: str) -> str:
+    # This is a known issue that could have been caused by prior versions of aicsimageio
+    # due to our old OMEXML.py file.
+    #
+    # You can see the PR that updated this exact line here:
+    # https://github.com/AllenCellModeling/aicsimageio/pull/116/commits/e3f9cde7f680edeef3ef3586a67fd8106e746167#diff-46a483e94af833f7eaa1106921191fed5e7c77f33a5c0c47a8f5a2d35ad3ba96L47
+    #
+    # Notably why this is invalid is that the 2012-03 schema _doesn't exist_
+    #
+    # Don't know how this wasn't ever caught before that PR but to ensure that we don't
+    # error in reading the OME in aicsimageio>=4.0.0, we manually find and replace this
+    # line in OME xml prior to creating the OME object.
+    KNOWN_INVALID_OME_XSD_REFERENCES = [
+        "www.openmicroscopy.org/Schemas/ome/2013-06",
+        "www.openmicroscopy.org/Schemas/OME/2012-03",
+    ]
+    REPLACEMENT_OME_XSD_REFERENCE = "www.openmicroscopy.org/Schemas/OME/2016-06"
+    # Store list of changes to print out with warning
+    metadata_changes = []
+
+    # Fix xsd reference
+    # This is from OMEXML object just having invalid reference
+    for known_invalid_ref in KNOWN_INVALID_OME_XSD_REFERENCES:
+        if known_invalid_ref in xml:
+            xml = xml.replace(
+                known_invalid_ref,
+                REPLACEMENT_OME_XSD_REFERENCE,
+            )
+            metadata_changes.append(
+                f"Replaced '{known_invalid_ref}' with "
+                f"'{REPLACEMENT_OME_XSD_REFERENCE}'."
+            )
+
+    # Read in XML
+    root = ET.fromstring(xml)
+
+    # Get the namespace
+    # In XML etree this looks like
+    # "{http://www.openmicroscopy.org/Schemas/OME/2016-06}"
+    # and must prepend any etree finds
+    namespace_matches = re.match(r"\{.*\}", root.tag)
+    if namespace_matches is not None:
+        namespace = namespace_matches.group(0)
+    else:
+        raise ValueError("XML does not contain a namespace")
+
+    # Find all Image elements and fix IDs
+    # This is for certain for test files of ours and ACTK files
+    for image_index, image in enumerate(root.findall(f"{namespace}Image")):
+        image_id = image.get("ID")
+        if not image_id.startswith("Image"):
+            image.set("ID", f"Image:{image_id}")
+            metadata_changes.append(
+                f"Updated attribute 'ID' from '{image_id}' to 'Image:{image_id}' "
+                f"on Image element at position {image_index}."
+            )
+
+        # Find all Pixels elements and fix IDs
+        for pixels_index, pixels in enumerate(image.findall(f"{namespace}Pixels")):
+            pixels_id = pixels.get("ID")
+            if not pixels_id.startswith("Pixels"):
+                pixels.set("ID", f"Pixels:{pixels_id}")
+                metadata_changes.append(
+                    f"Updated attribute 'ID' from '{pixels_id}' to "
+                    f"Pixels:{pixels_id}' on Pixels element at "
+                    f"position {pixels_index}."
+                )
+
+            # Determine if there is an out-of-order channel / plane elem
+            # This is due to OMEXML "add channel" function
+            # That added Channels and appropriate Planes to the XML
+            # But, placed them in:
+            # Channel
+            # Plane
+            # Plane
+            # ...
+            # Channel
+            # Plane
+            # Plane
+            #
+            # Instead of grouped together:
+            # Channel
+            # Channel
+            # ...
+            # Plane
+            # Plane
+            # ...
+            #
+            # This effects all CFE files (new and old) but for different reasons
+            pixels_children_out_of_order = _pixels_children_out_of_order(
+                pixels, namespace
+            )
+
+            # Ensure order of:
+            # channels -> bindata | tiffdata | metadataonly -> planes
+            if pixels_children_out_of_order:
+                # Get all relevant elems.
+                # No copies are needed: the elements are detached and re-attached below.
+                channels = pixels.findall(f"{namespace}Channel")
+                bin_data = pixels.findall(f"{namespace}BinData")
+                tiff_data = pixels.findall(f"{namespace}TiffData")
+                # There should only be one metadata only element but to standardize
+                # list comprehensions later we findall
+                metadata_only = pixels.findall(f"{namespace}MetadataOnly")
+                planes = pixels.findall(f"{namespace}Plane")
+
+                # Old (2018 ish) cell feature explorer files sometimes contain both
+                # an empty metadata only element and filled tiffdata elements
+                # Since the metadata only elements are empty we can check this and
+                # choose the tiff data elements instead
+                #
+                # First check if there are any metadata only elements
+                if len(metadata_only) == 1:
+                    # Now check if _one of_ of the other two choices are filled
+                    # ^ in Python is XOR
+                    if (len(bin_data) > 0) ^ (len(tiff_data) > 0):
+                        metadata_children = list(metadata_only[0])
+                        # Now check if the metadata only elem has no children
+                        if len(metadata_children) == 0:
+                            # If so, just "purge" by creating empty list
+                            metadata_only = []
+
+                        # If there are children elements
+                        # Return XML and let XMLSchema Validation show error
+                        else:
+                            return xml
+
+                # After cleaning metadata only, validate the normal behaviors of
+                # OME schema
+                #
+                # Validate that there is only one of bindata, tiffdata, or metadata
+                if len(bin_data) > 0:
+                    if len(tiff_data) == 0 and len(metadata_only) == 0:
+                        selected_choice = bin_data
+                    else:
+                        # Return XML and let XMLSchema Validation show error
+                        return xml
+                elif len(tiff_data) > 0:
+                    if len(bin_data) == 0 and len(metadata_only) == 0:
+                        selected_choice = tiff_data
+                    else:
+                        # Return XML and let XMLSchema Validation show error
+                        return xml
+                elif len(metadata_only) == 1:
+                    if len(bin_data) == 0 and len(tiff_data) == 0:
+                        selected_choice = metadata_only
+                    else:
+                        # Return XML and let XMLSchema Validation show error
+                        return xml
+                else:
+                    # Return XML and let XMLSchema Validation show error
+                    return xml
+
+                # Remove all children from element to be replaced
+                # with ordered elements
+                for elem in list(pixels):
+                    pixels.remove(elem)
+
+                # Re-attach elements
+                for channel in channels:
+                    pixels.append(channel)
+                for elem in selected_choice:
+                    pixels.append(elem)
+                for plane in planes:
+                    pixels.append(plane)
+
+                metadata_changes.append(
+                    f"Reordered children of Pixels element at "
+                    f"position {pixels_index}."
+                )
+
+    # This is a result of dumping basically all experiement metadata
+    # into "StructuredAnnotation" blocks
+    #
+    # This affects new (2020) Cell Feature Explorer files
+    #
+    # Because these are structured annotations we don't want to mess with anyones
+    # besides the AICS generated bad structured annotations
+    aics_anno_removed_count = 0
+    sa = root.find(f"{namespace}StructuredAnnotations")
+    if sa is not None:
+        for xml_anno in sa.findall(f"{namespace}XMLAnnotation"):
+            # At least these are namespaced
+            if xml_anno.get("Namespace") == "alleninstitute.org/CZIMetadata":
+                # Get ID because some elements have annotation refs
+                # in both the base Image element and all plane elements
+                aics_anno_id = xml_anno.get("ID")
+                for image in root.findall(f"{namespace}Image"):
+                    for anno_ref in image.findall(f"{namespace}AnnotationRef"):
+                        if anno_ref.get("ID") == aics_anno_id:
+                            image.remove(anno_ref)
+
+                    # Clean planes
+                    pixels = image.find(f"{namespace}Pixels")
+                    for plane in pixels.findall(f"{namespace}Plane"):
+                        for anno_ref in plane.findall(f"{namespace}AnnotationRef"):
+                            if anno_ref.get("ID") == aics_anno_id:
+                                plane.remove(anno_ref)
+
+                # Remove the whole etree
+                sa.remove(xml_anno)
+                aics_anno_removed_count += 1
+
+    # Log changes
+    if aics_anno_removed_count > 0:
+        metadata_changes.append(
+            f"Removed {aics_anno_removed_count} AICS generated XMLAnnotations."
+        )
+
+    # If there are no annotations in StructuredAnnotations, remove it
+    if sa is not None:
+        if len(list(sa)) == 0:
+            root.remove(sa)
+
+    # If any piece of metadata was changed alert and rewrite
+    if len(metadata_changes) > 0:
+        log.debug("OME metadata was cleaned for known AICSImageIO 3.x OMEXML errors.")
+        log.debug(f"Full list of OME cleaning changes: {metadata_changes}")
+
+        # Register namespace
+        ET.register_namespace("", f"http://{REPLACEMENT_OME_XSD_REFERENCE}")
+
+        # Write out cleaned XML to string
+        xml = ET.tostring(
+            root,
+            encoding="unicode",
+            method="xml",
+        )
+
+    return xml
+
+
+class OmeTiffSource:
+    """
+    A single open tiff file handle that serves both the pixel data and the cleaned
+    OME metadata of an image, instead of opening the file once for the pixels and
+    again for its OME XML. Pixels are read page by page, so only the planes of the
+    requested channel (and z range) are decoded.
+    With an OmeMetadataCache, the cleaned OME metadata is looked up by the fingerprint
+    of origin_path (the file before it was retrieved to local storage) and only
+    parsed on a cache miss.
+    """
+
+    # tifffile axes that may stand in for Z in tiffs without OME metadata
+    _Z_ALIASES = "IQ"
+
+    def __init__(self, path, ome_cache=None, origin_path=None):
+        self.path = path
+        self.origin_path = origin_path if origin_path is not None else path
+        self.ome_cache = ome_cache
+        self.tiff = TiffFile(path)
+        self._ome = None
+        # layouts that can't be mapped to pages are read through AICSImage instead
+        self._fallback = None
+        try:
+            series = self.tiff.series[0]
+            axes = series.axes
+            if "Z" not in axes:
+                for alias in self._Z_ALIASES:
+                    if alias in axes:
+                        axes = axes.replace(alias, "Z")
+                        break
+            self.dtype = np.dtype(series.dtype)
+            if axes.endswith("YX") and all(a in "TCZ" for a in axes[:-2]):
+                self._axes = axes[:-2]
+                self._shape = series.shape[:-2]
+                self.size_y, self.size_x = series.shape[-2:]
+            else:
+                log.debug(f"{path}: reading tiff axes {series.axes} with AICSImage")
+                self._fallback = AICSImage(path)
+                dims = self._fallback.dims
+                self._axes = "TCZ"
+                self._shape = (dims.T, dims.C, dims.Z)
+                self.size_y, self.size_x = dims.Y, dims.X
+        except Exception:
+            self.tiff.close()
+            raise
+
+    def _size(self, axis):
+        return self._shape[self._axes.index(axis)] if axis in self._axes else 1
+
+    @property
+    def size_t(self):
+        return self._size("T")
+
+    @property
+    def size_c(self):
+        return self._size("C")
+
+    @property
+    def size_z(self):
+        return self._size("Z")
+
+    @property
+    def ome(self):
+        # the OME metadata, cleaned of known issues from old writers
+        if self._ome is None and self.ome_cache is not None:
+            self._ome = self.ome_cache.get(self.origin_path)
+        if self._ome is None:
+            if not self.tiff.is_ome:
+                # this is REALLY catastrophic. Its not expected to happen for AICS data.
+                raise ValueError("Bad OME TIFF file")
+            description = self.tiff.pages[0].description.strip()
+            description = _clean_ome_xml_for_known_issues(description)
+            self._ome = from_xml(description)
+            if self.ome_cache is not None:
+                try:
+                    self.ome_cache.put(self.origin_path, self._ome)
+                except Exception as e:
+                    # the cache only saves time, never fail the image for it
+                    log.warning(f"could not cache OME metadata of {self.path}: {e}")
+        return self._ome
+
+    # ZYX planes of one channel, optionally limited to z_start <= z < z_stop.
+    # with out, the planes are decoded straight into that contiguous buffer.
+    def read_zyx(self, c=0, t=0, z_start=0, z_stop=None, out=None):
+        if z_stop is None:
+            z_stop = self.size_z
+        if self._fallback is not None:
+            data = self._fallback.get_image_data("ZYX", C=c, T=t)
+            if out is None:
+                return data[z_start:z_stop]
+            out[...] = data[z_start:z_stop]
+            return out
+        position = {"T": t, "C": c}
+        indices = []
+        for z in range(z_start, z_stop):
+            position["Z"] = z
+            indices.append(
+                int(
+                    np.ravel_multi_index(
+                        [position[axis] for axis in self._axes], self._shape
+                    )
+                )
+                if self._axes
+                else 0
+            )
+        if out is not None and out.dtype == self.dtype:
+            self.tiff.asarray(key=indices, series=0, out=out)
+            return out
+        data = self.tiff.asarray(key=indices, series=0)
+        data = data.reshape((len(indices), self.size_y, self.size_x))
+        if out is None:
+            return data
+        # tifffile only decodes into a buffer of the file's own dtype
+        out[...] = data
+        return out
+
+    def close(self):
+        if self._fallback is not None:
+            self._fallback.close()
+        self.tiff.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+
+class SourceCache:
+    """
+    Per-fov cache of open OmeTiffSource handles and decoded channel volumes, keyed by
+    path. A file referenced by several channels (e.g. contours that default to the
+    segmentation files) is opened once, and each (file, channel) is decoded once.
+    Volumes are decoded directly into the output buffer, and only kept when the caller
+    says the same channel is read again; the kept buffer is then copied from memory.
+    """
+
+    def __init__(self, ome_cache=None, staging=None, metrics=None):
+        self.ome_cache = ome_cache
+        self.staging = staging
+        self.metrics = metrics if metrics is not None else StageMetrics()
+        # path -> (local path, OmeTiffSource)
+        self._sources = {}
+        # (path, c, t) -> ZYX array
+        self._volumes = {}
+
+    def source(self, path, file_name=None):
+        if path not in self._sources:
+            if file_name is None:
+                file_name = os.path.basename(path)
+            with self.metrics.stage("open"):
+                # COPY FILE TO LOCAL TMP STORAGE BEFORE READING
+                localpath = retrieve_file(path, file_name, self.staging)
+                self._sources[path] = (
+                    localpath,
+                    OmeTiffSource(localpath, self.ome_cache, origin_path=path),
+                )
+        return self._sources[path][1]
+
+    # stage names the read in the metrics. keep caches the volume for a later read.
+    def read_zyx(self, path, c=0, t=0, out=None, stage="channel read", keep=False):
+        key = (path, c, t)
+        cached = self._volumes.get(key)
+        if cached is not None:
+            log.info(f"reusing decoded channel {c} of {path}")
+            if out is None:
+                return cached
+            out[...] = cached
+            return out
+        source = self.source(path)
+        with self.metrics.stage(stage) as record:
+            data = source.read_zyx(c=c, t=t, out=out)
+            record["bytes_read"] = data.nbytes
+        if keep:
+            self._volumes[key] = data
+        return data
+
+    def close(self):
+        self._volumes = {}
+        for localpath, source in self._sources.values():
+            source.close()
+            unretrieve_file(localpath, self.staging)
+        self._sources = {}
+
+
+def retrieve_file(read_path, file_name, staging=None):
+    """
+    Copy a file to local scratch storage through the staging cache, and return the full
+    destination path. Without a staging cache, the file is read in place.
+    """
+    if staging is None:
+        return read_path
+    return staging.stage(read_path)
+
+
+def unretrieve_file(localpath, staging=None):
+    # the staged copy stays in the cache, it just becomes evictable again
+    if staging is not None:
+        staging.release(localpath)
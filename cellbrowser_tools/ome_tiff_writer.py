@@ -0,0 +1,127 @@
+import numpy as np
+import tempfile
+from tifffile import TiffWriter
+
+
+# tifffile codecs that ome-tiff outputs can be compressed with
+OME_TIFF_COMPRESSIONS = ["zlib", "zstd", "lzw"]
+# codecs that take a compression level
+LEVELED_COMPRESSIONS = ["zlib", "zstd"]
+
+
+# Half resolution of a YX plane: means of 2x2 blocks, or every other pixel for label
+# images, where averaging would make up labels that don't exist. Odd sizes round up.
+def downsample_2x(plane, labels=False):
+    if labels:
+        return plane[::2, ::2]
+    h, w = plane.shape
+    if h % 2 or w % 2:
+        plane = np.pad(plane, ((0, h % 2), (0, w % 2)), mode="edge")
+    blocks = plane.reshape(plane.shape[0] // 2, 2, plane.shape[1] // 2, 2)
+    mean = blocks.mean(axis=(1, 3))
+    if np.issubdtype(plane.dtype, np.integer):
+        mean = np.rint(mean)
+    return mean.astype(plane.dtype)
+
+
+def _iter_tiles(planes, tile_size):
+    # tifffile takes tiled data from an iterator one tile at a time, row by row.
+    # partial tiles at the edges are padded by tifffile.
+    for plane in planes:
+        for y in range(0, plane.shape[0], tile_size):
+            for x in range(0, plane.shape[1], tile_size):
+                yield plane[y : y + tile_size, x : x + tile_size]
+
+
+# Write an ome-tiff described by ome_str, from YX planes of a ZCYX image given in order
+# (channels varying fastest). planes may be an iterator, so the image never has to be
+# in memory at once. With compression, the strips of each plane are encoded on up to
+# workers threads (0 or None lets tifffile decide).
+# With tile_size, planes are stored as square tiles; with pyramid_levels, every plane
+# gets that many SubIFDs of successively halved resolution. All levels are computed in
+# the single pass that writes the full resolution planes, and the channels in
+# label_channels are downsampled without averaging. The levels are written after the
+# full resolution; with level_dir they wait in memory mapped temporary files there
+# instead of in memory.
+def write_ome_tiff_planes(
+    path,
+    planes,
+    ome_str,
+    shape,
+    dtype,
+    compression=None,
+    compression_level=None,
+    workers=0,
+    tile_size=0,
+    pyramid_levels=0,
+    label_channels=(),
+    level_dir=None,
+):
+    size_z, size_c, size_y, size_x = shape
+    dtype = np.dtype(dtype)
+    kwargs = {}
+    if compression:
+        if compression not in OME_TIFF_COMPRESSIONS:
+            raise ValueError(
+                f"Unsupported compression {compression}, expected one of {OME_TIFF_COMPRESSIONS}"
+            )
+        kwargs["compression"] = compression
+        if compression_level is not None and compression in LEVELED_COMPRESSIONS:
+            kwargs["compressionargs"] = {"level": compression_level}
+        kwargs["maxworkers"] = workers if workers else None
+    if tile_size:
+        # tiff tiles must be multiples of 16
+        tile_size = max(16, int(tile_size) // 16 * 16)
+        kwargs["tile"] = (tile_size, tile_size)
+
+    num_planes = size_z * size_c
+    levels = []
+    if pyramid_levels:
+        level_y, level_x = size_y, size_x
+        for _ in range(pyramid_levels):
+            level_y, level_x = (level_y + 1) // 2, (level_x + 1) // 2
+            level_shape = (num_planes, level_y, level_x)
+            if level_dir is None:
+                levels.append(np.empty(level_shape, dtype=dtype))
+            else:
+                # the mapping keeps the unnamed file until it is dropped
+                with tempfile.TemporaryFile(dir=level_dir, suffix=".dat") as f:
+                    levels.append(
+                        np.memmap(f, dtype=dtype, mode="w+", shape=level_shape)
+                    )
+
+        def with_levels(planes):
+            for p, plane in enumerate(planes):
+                labels = (p % size_c) in label_channels
+                reduced = plane
+                for level in levels:
+                    reduced = downsample_2x(reduced, labels)
+                    level[p] = reduced
+                yield plane
+
+        planes = with_levels(planes)
+    if tile_size:
+        planes = _iter_tiles(planes, tile_size)
+
+    # sized uncompressed, to be safe
+    nbytes = num_planes * size_y * size_x * dtype.itemsize
+    with TiffWriter(path, bigtiff=nbytes >= 2**32 - 2**25) as tif:
+        tif.write(
+            planes,
+            shape=(num_planes, size_y, size_x),
+            dtype=dtype,
+            photometric="minisblack",
+            description=ome_str.encode("utf-8"),
+            metadata=None,
+            subifds=len(levels) if levels else None,
+            **kwargs,
+        )
+        # the reduced resolutions of every plane, stored as its SubIFDs
+        for level in levels:
+            tif.write(
+                level,
+                photometric="minisblack",
+                subfiletype=1,
+                metadata=None,
+                **kwargs,
+            )
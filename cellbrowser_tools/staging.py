@@ -0,0 +1,218 @@
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+import shutil
+import threading
+
+from . import dataHandoffUtils as utils
+from .dataset_constants import DataField
+from .file_utils import atomic_path, file_fingerprint, local_dir
+
+
+log = logging.getLogger(__name__)
+
+# one cache per directory per process, so that prefetches started for the next fov
+# are found by the processing of that fov
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_staging_cache(cache_dir, max_gb=50, num_threads=2):
+    if not cache_dir:
+        return None
+    cache_dir = local_dir(cache_dir)
+    with _caches_lock:
+        cache = _caches.get(cache_dir)
+        if cache is None:
+            cache = StagingCache(cache_dir, max_gb, num_threads)
+            _caches[cache_dir] = cache
+        return cache
+
+
+def _process_alive(pid):
+    if not pid.isdigit():
+        return False
+    if os.name != "posix":
+        # no cheap liveness check: keep the pin
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+# every source file read for the fov of row
+def fov_read_paths(row):
+    readpath = row.get(DataField.AlignedImageReadPath)
+    if not readpath:
+        readpath = row.get(DataField.SourceReadPath)
+    paths = [readpath]
+    for field in [
+        DataField.StructureSegmentationReadPath,
+        DataField.MembraneSegmentationReadPath,
+        DataField.NucleusSegmentationReadPath,
+        DataField.MembraneContourReadPath,
+        DataField.NucleusContourReadPath,
+    ]:
+        paths.append(row.get(field))
+    result = []
+    for path in paths:
+        if path:
+            path = utils.normalize_path(path)
+            if path not in result:
+                result.append(path)
+    return result
+
+
+class StagingCache:
+    """
+    Node-local LRU cache of copies of source files, so that decoding reads local
+    disk instead of the network share.
+
+    Entries are keyed by the source path, size and modification time; a source that
+    is rewritten is staged again. Total size is capped at max_gb: before a new copy
+    is made, the least recently used entries are removed. Files handed out by stage()
+    are pinned until release(), and are never evicted meanwhile. The cache directory
+    may be shared by several processes on a node: each pinned file has a marker file
+    <copy>.<pid>.pin next to it, which other processes honor while that pid is alive.
+    prefetch() copies files on background threads, so network reads for the next fov
+    overlap with the computation of the current one.
+    """
+
+    def __init__(self, cache_dir, max_gb=50, num_threads=2):
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_gb * 1024 * 1024 * 1024)
+        os.makedirs(cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        # source path -> future of a copy in progress
+        self._pending = {}
+        # local path -> pin count
+        self._pins = {}
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, num_threads), thread_name_prefix="staging"
+        )
+
+    def _entry_path(self, path):
+        digest = file_fingerprint(path)[:16]
+        # keep the file name, readers pick their format from the extension
+        name = f"{digest}_{os.path.basename(path)}"
+        return os.path.join(self.cache_dir, name), os.path.getsize(path)
+
+    def stage(self, path):
+        """
+        Return the path of a local copy of path, copying it if needed.
+        The copy stays pinned until release() is called with the returned path.
+        """
+        with self._lock:
+            future = self._pending.get(path)
+        if future is not None:
+            # already being copied by a prefetch
+            future.result()
+        localpath, size = self._entry_path(path)
+        # pin before copying, so that the copy can't be evicted before it is used
+        with self._lock:
+            count = self._pins.get(localpath, 0)
+            self._pins[localpath] = count + 1
+            if count == 0:
+                open(self._pin_path(localpath), "w").close()
+        try:
+            self._copy(path, localpath, size)
+        except Exception:
+            self.release(localpath)
+            raise
+        return localpath
+
+    def release(self, localpath):
+        with self._lock:
+            count = self._pins.get(localpath, 0) - 1
+            if count > 0:
+                self._pins[localpath] = count
+                return
+            if self._pins.pop(localpath, None) is None:
+                return
+            try:
+                os.remove(self._pin_path(localpath))
+            except FileNotFoundError:
+                pass
+
+    def _pin_path(self, localpath):
+        return f"{localpath}.{os.getpid()}.pin"
+
+    def _is_pinned(self, localpath):
+        with self._lock:
+            if localpath in self._pins:
+                return True
+        # pinned by another process sharing the cache
+        prefix = os.path.basename(localpath) + "."
+        for entry in os.scandir(self.cache_dir):
+            if not (entry.name.startswith(prefix) and entry.name.endswith(".pin")):
+                continue
+            pid = entry.name[len(prefix) : -len(".pin")]
+            if _process_alive(pid):
+                return True
+            # left behind by a process that was killed
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+        return False
+
+    def prefetch(self, paths):
+        """
+        Start copying paths in the background. Returns immediately.
+        """
+        with self._lock:
+            for path in paths:
+                if path in self._pending:
+                    continue
+                self._pending[path] = self._executor.submit(self._prefetch_one, path)
+
+    def _prefetch_one(self, path):
+        try:
+            self._copy(path, *self._entry_path(path))
+        except Exception as e:
+            # stage() will try again, and raise, when the file is needed
+            log.warning(f"prefetch of {path} failed: {e}")
+        finally:
+            with self._lock:
+                self._pending.pop(path, None)
+
+    def _copy(self, path, localpath, size):
+        if os.path.exists(localpath):
+            # mark as recently used
+            os.utime(localpath)
+            return
+        self.evict(size)
+        # other processes sharing the cache never see a partial file
+        with atomic_path(localpath) as tmp:
+            log.info(f"staging {path}")
+            shutil.copyfile(path, tmp)
+
+    def evict(self, incoming_bytes=0):
+        """
+        Remove least recently used entries until incoming_bytes more fit under the cap.
+        """
+        entries = []
+        total = 0
+        for entry in os.scandir(self.cache_dir):
+            if not entry.is_file() or entry.name.endswith((".part", ".pin")):
+                continue
+            st = entry.stat()
+            entries.append((st.st_mtime, st.st_size, entry.path))
+            total += st.st_size
+        entries.sort()
+        for mtime, size, entry_path in entries:
+            if total + incoming_bytes <= self.max_bytes:
+                break
+            if self._is_pinned(entry_path):
+                continue
+            try:
+                os.remove(entry_path)
+                total -= size
+                log.info(f"evicted {entry_path} from staging cache")
+            except FileNotFoundError:
+                # evicted by another process
+                total -= size
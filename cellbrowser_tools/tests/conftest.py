@@ -0,0 +1,130 @@
+from datetime import datetime
+
+import numpy as np
+import pytest
+import tifffile
+
+# shape of the synthetic fov: z, y, x
+FOV_SHAPE = (6, 40, 48)
+# cell label -> z, y, x slices of its box in the cell segmentation
+CELL_BOXES = {
+    1: (slice(1, 5), slice(4, 18), slice(5, 20)),
+    2: (slice(0, 4), slice(20, 36), slice(24, 44)),
+}
+
+
+def ome_xml(
+    name,
+    size_c,
+    size_z,
+    size_y,
+    size_x,
+    dtype,
+    channel_names,
+    dimension_order="XYZCT",
+):
+    from ome_types import to_xml
+    from ome_types.model import OME, Channel, Image, Pixels, Plane, TiffData
+
+    pixels = Pixels(
+        id="Pixels:0",
+        dimension_order=dimension_order,
+        type=np.dtype(dtype).name,
+        size_c=size_c,
+        size_t=1,
+        size_z=size_z,
+        size_y=size_y,
+        size_x=size_x,
+        physical_size_x=0.108,
+        physical_size_y=0.108,
+        physical_size_z=0.29,
+        channels=[
+            Channel(id=f"Channel:0:{c}", name=channel_names[c]) for c in range(size_c)
+        ],
+        planes=[
+            Plane(the_c=c, the_z=z, the_t=0)
+            for c in range(size_c)
+            for z in range(size_z)
+        ],
+        tiff_data_blocks=[TiffData(plane_count=size_c * size_z)],
+    )
+    image = Image(
+        id="Image:0", name=name, acquisition_date=datetime(2020, 1, 1), pixels=pixels
+    )
+    return to_xml(OME(images=[image]))
+
+
+# writes CZYX data as an ome-tiff with planes for every channel and z
+def write_ome_tiff(path, data, channel_names):
+    size_c, size_z, size_y, size_x = data.shape
+    xml = ome_xml(path.name, size_c, size_z, size_y, size_x, data.dtype, channel_names)
+    tifffile.imwrite(
+        str(path),
+        data.reshape(size_c * size_z, size_y, size_x),
+        description=xml.encode("utf-8"),
+        metadata=None,
+        photometric="minisblack",
+    )
+
+
+@pytest.fixture
+def synthetic_fov(tmp_path):
+    """
+    A fov of 4 raw channels, a cell segmentation with the cells of CELL_BOXES, and a
+    nucleus and structure segmentation inside each cell, as ome-tiffs. Returns the
+    manifest rows of its cells.
+    """
+    rng = np.random.default_rng(0)
+    raw = rng.integers(100, 4000, size=(4,) + FOV_SHAPE, dtype=np.uint16)
+    cells = np.zeros(FOV_SHAPE, dtype=np.uint8)
+    nuclei = np.zeros(FOV_SHAPE, dtype=np.uint8)
+    for label, (zs, ys, xs) in CELL_BOXES.items():
+        cells[zs, ys, xs] = label
+        inner = tuple(slice(s.start + 1, s.stop - 1) for s in (ys, xs))
+        nuclei[(zs,) + inner] = label
+    structures = (nuclei > 0).astype(np.uint8) * 255
+
+    source_dir = tmp_path / "source"
+    source_dir.mkdir()
+    write_ome_tiff(
+        source_dir / "fov.ome.tif", raw, ["CMDRP", "EGFP", "H3342", "Bright_2"]
+    )
+    write_ome_tiff(source_dir / "cell_seg.ome.tif", cells[np.newaxis], ["cell"])
+    write_ome_tiff(source_dir / "nuc_seg.ome.tif", nuclei[np.newaxis], ["nucleus"])
+    write_ome_tiff(
+        source_dir / "struct_seg.ome.tif", structures[np.newaxis], ["structure"]
+    )
+
+    row = {
+        "AlignedImageReadPath": None,
+        "SourceReadPath": str(source_dir / "fov.ome.tif"),
+        "SourceFilename": "fov",
+        "FOVId": 1,
+        "CellLine": "AICS-0",
+        "ChannelNumber638": 0,
+        "ChannelNumberStruct": 1,
+        "ChannelNumber405": 2,
+        "ChannelNumberBrightfield": 3,
+        "StructureSegmentationReadPath": str(source_dir / "struct_seg.ome.tif"),
+        "MembraneSegmentationReadPath": str(source_dir / "cell_seg.ome.tif"),
+        "MembraneSegmentationChannelIndex": 0,
+        "NucleusSegmentationReadPath": str(source_dir / "nuc_seg.ome.tif"),
+        "NucleusSegmentationChannelIndex": 0,
+        "MembraneContourReadPath": None,
+        "MembraneContourChannelIndex": 0,
+        "NucleusContourReadPath": None,
+        "NucleusContourChannelIndex": 0,
+        "PixelScaleX": 0.108,
+        "PixelScaleY": 0.108,
+        "PixelScaleZ": 0.29,
+        "ColonyPosition": "",
+        "NucMembSegmentationAlgorithm": "",
+        "NucMembSegmentationAlgorithmVersion": "",
+        "StructureSegmentationAlgorithm": "",
+        "StructureSegmentationAlgorithmVersion": "",
+        "ProteinDisplayName": "",
+        "StructureDisplayName": "",
+        "Gene": "",
+        "MitoticStateId/Name": "",
+    }
+    return [dict(row, CellId=100 + label, CellIndex=label) for label in CELL_BOXES]
@@ -0,0 +1,34 @@
+import pytest
+
+pytest.importorskip("pandas")
+
+from cellbrowser_tools.build_ledger import fov_fingerprint  # noqa: E402
+from cellbrowser_tools.dataHandoffUtils import (  # noqa: E402
+    ActionOptions,
+    ProcessingOptions,
+)
+
+
+def test_ome_tiff_options_only_count_with_save_raw(synthetic_fov):
+    for save_raw in (False, True):
+        actions = ActionOptions(save_raw=save_raw)
+        plain = fov_fingerprint(synthetic_fov, actions, ProcessingOptions(), save_raw)
+        compressed = fov_fingerprint(
+            synthetic_fov,
+            actions,
+            ProcessingOptions(compression="zlib", pyramid_levels=2),
+            save_raw,
+        )
+        assert (plain != compressed) == save_raw
+
+
+def test_non_output_options_do_not_count(synthetic_fov):
+    actions = ActionOptions(save_raw=True)
+    assert fov_fingerprint(
+        synthetic_fov, actions, ProcessingOptions(), True
+    ) == fov_fingerprint(
+        synthetic_fov,
+        actions,
+        ProcessingOptions(cell_workers=4, compression_workers=4),
+        True,
+    )
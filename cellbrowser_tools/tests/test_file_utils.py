@@ -0,0 +1,32 @@
+import os
+
+import pytest
+
+from cellbrowser_tools.file_utils import atomic_path, file_fingerprint
+
+
+def test_file_fingerprint_changes_when_rewritten(tmp_path):
+    path = tmp_path / "a.txt"
+    path.write_text("one")
+    first = file_fingerprint(str(path))
+    assert file_fingerprint(str(path)) == first
+    assert file_fingerprint(str(path), 1) != first
+    path.write_text("three")
+    assert file_fingerprint(str(path)) != first
+
+
+def test_atomic_path(tmp_path):
+    path = tmp_path / "out.txt"
+    path.write_text("old")
+    with pytest.raises(RuntimeError):
+        with atomic_path(str(path)) as tmp:
+            with open(tmp, "w") as f:
+                f.write("partial")
+            raise RuntimeError()
+    assert path.read_text() == "old"
+    with atomic_path(str(path)) as tmp:
+        with open(tmp, "w") as f:
+            f.write("new")
+        assert path.read_text() == "old"
+    assert path.read_text() == "new"
+    assert os.listdir(tmp_path) == ["out.txt"]
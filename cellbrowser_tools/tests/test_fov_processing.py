@@ -0,0 +1,127 @@
+import glob
+import json
+import os
+
+from ome_types import from_xml
+import pytest
+import tifffile
+
+pytest.importorskip("aicsimageio")
+pytest.importorskip("aicsimageprocessing")
+
+from cellbrowser_tools import createJobsFromCSV  # noqa: E402
+from cellbrowser_tools.dataHandoffUtils import ProcessingOptions  # noqa: E402
+from cellbrowser_tools.fov_processing import (  # noqa: E402
+    CELL_RECORD_SUFFIX,
+    CHANNEL_ALIASES_NAMESPACE,
+    ImageProcessor,
+)
+from cellbrowser_tools.tests.conftest import FOV_SHAPE  # noqa: E402
+import skimage.io as skio  # noqa: E402
+
+
+def run_fov(rows, output_dir, do_crop=True, save_raw=False, **options):
+    prefs = {
+        "images_dir": str(output_dir / "images"),
+        "thumbs_dir": str(output_dir / "thumbnails"),
+        "atlas_dir": str(output_dir / "atlases"),
+    }
+    createJobsFromCSV.do_image(
+        False,
+        True,
+        prefs,
+        [dict(row) for row in rows],
+        do_thumbnails=False,
+        do_crop=do_crop,
+        save_raw=save_raw,
+        processing_options=ProcessingOptions(**options),
+    )
+    atlases = {}
+    for path in glob.glob(os.path.join(prefs["atlas_dir"], "*", "*_atlas.json")):
+        with open(path) as f:
+            atlases[os.path.basename(path)] = json.load(f)
+    return atlases
+
+
+# 0.01 mb is less than the combined image of the synthetic fov
+@pytest.mark.parametrize("memory_budget_mb", [0, 0.01])
+def test_full_field_without_segmentations(tmp_path, synthetic_fov, memory_budget_mb):
+    rows = [
+        dict(
+            row,
+            StructureSegmentationReadPath="",
+            MembraneSegmentationReadPath="",
+            NucleusSegmentationReadPath="",
+        )
+        for row in synthetic_fov
+    ]
+    atlases = run_fov(rows, tmp_path, do_crop=False, memory_budget_mb=memory_budget_mb)
+    (atlas,) = atlases.values()
+    histograms = atlas["userData"]["histograms"]
+    assert len(histograms) == 4
+    for histogram in histograms:
+        assert sum(histogram["counts"]) == FOV_SHAPE[0] * FOV_SHAPE[1] * FOV_SHAPE[2]
+
+
+# with value counts, and with a second pass once the ranges are known
+@pytest.mark.parametrize("counts_bytes", [0, None])
+def test_slab_mode_histograms_match_in_memory(
+    monkeypatch, tmp_path, synthetic_fov, counts_bytes
+):
+    monkeypatch.setattr(
+        ImageProcessor, "_value_counts_bytes", lambda self, labels: counts_bytes
+    )
+    in_memory = run_fov(synthetic_fov, tmp_path / "memory")
+    slabs = run_fov(synthetic_fov, tmp_path / "slabs", memory_budget_mb=0.01)
+    assert sorted(in_memory) == sorted(slabs)
+    assert len(in_memory) == 3
+    for name, atlas in in_memory.items():
+        assert atlas["userData"]["histograms"] == slabs[name]["userData"]["histograms"]
+
+
+def atlas_pngs(output_dir):
+    paths = glob.glob(os.path.join(str(output_dir), "atlases", "*", "*.png"))
+    return {os.path.basename(path): skio.imread(path) for path in paths}
+
+
+def test_segmentation_only_rescales_reused_cell_atlases(tmp_path, synthetic_fov):
+    run_fov(synthetic_fov, tmp_path / "rebuilt")
+    run_fov(
+        synthetic_fov,
+        tmp_path / "rebuilt",
+        segmentation_only=True,
+        batch_cell_atlases=True,
+    )
+    run_fov(synthetic_fov, tmp_path / "fresh", batch_cell_atlases=True)
+    rebuilt = atlas_pngs(tmp_path / "rebuilt")
+    fresh = atlas_pngs(tmp_path / "fresh")
+    assert sorted(rebuilt) == sorted(fresh)
+    for name, pixels in fresh.items():
+        assert (rebuilt[name] == pixels).all(), name
+
+
+def test_channel_aliases_in_ome_tiff_and_cell_record(tmp_path, synthetic_fov):
+    rows = [dict(row, MembraneContourReadPath=None) for row in synthetic_fov]
+    run_fov(
+        rows,
+        tmp_path,
+        save_raw=True,
+        alias_duplicate_channels=True,
+        cell_records=True,
+    )
+    images_dir = tmp_path / "images" / "AICS-0"
+    (fov_path,) = glob.glob(str(images_dir / "*.ome.tif"))
+    with tifffile.TiffFile(fov_path) as tif:
+        ome = from_xml(tif.pages[0].description)
+    (annotation,) = [
+        a
+        for a in ome.structured_annotations
+        if a.namespace == CHANNEL_ALIASES_NAMESPACE
+    ]
+    aliases = json.loads(annotation.value)
+    assert aliases == {"CON_Memb": "SEG_Memb", "CON_DNA": "SEG_DNA"}
+    records = glob.glob(str(images_dir / f"*{CELL_RECORD_SUFFIX}"))
+    assert len(records) == 2
+    for record_path in records:
+        with open(record_path) as f:
+            assert json.load(f)["channel_aliases"] == aliases
@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+from cellbrowser_tools.label_stats import (
+    LabelHistograms,
+    LabelIndex,
+    LabelProjections,
+    LabelValueCounts,
+)
+
+
+# ZYX labels of blobs 1..6 (4 is missing) on a background of 0, and 2 channels
+def labeled_volume(dtype=np.uint16):
+    rng = np.random.default_rng(3)
+    labels = np.zeros((9, 50, 60), dtype=np.uint8)
+    for label, (z, y, x) in zip(
+        [1, 2, 3, 5, 6], [(1, 5, 5), (0, 20, 30), (4, 35, 8), (6, 10, 40), (2, 40, 45)]
+    ):
+        depth, height, width = rng.integers(2, 10, size=3)
+        labels[z : z + depth, y : y + height, x : x + width] = label
+    info = np.iinfo(dtype)
+    low, high = max(info.min, -3000), min(info.max + 1, 3000)
+    channels = rng.integers(low, high, size=(2,) + labels.shape, dtype=dtype)
+    return labels, channels
+
+
+def test_label_index_matches_segmentation_bounds():
+    pytest.importorskip("aicsimageio")
+    from cellbrowser_tools.fov_processing import get_segmentation_bounds
+
+    labels, _ = labeled_volume()
+    whole = LabelIndex.from_image(labels)
+    # the same volume, a few planes at a time
+    slabs = LabelIndex(labels.shape)
+    for z0 in range(0, labels.shape[0], 4):
+        slabs.add_slab(labels[z0 : z0 + 4], z0)
+    assert whole.labels() == slabs.labels() == [1, 2, 3, 5, 6]
+    assert 4 not in whole
+    for label in whole.labels():
+        expected = get_segmentation_bounds(labels, label)
+        assert get_segmentation_bounds(labels, label, label_index=whole) == expected
+        assert slabs.padded_bounds(label) == expected
+        zs, ys, xs = np.nonzero(labels == label)
+        assert whole.voxel_count(label) == len(zs)
+        assert whole.centroid(label) == pytest.approx((xs.mean(), ys.mean(), zs.mean()))
+
+
+def test_label_projections_match_masked_max_projection():
+    labels, channels = labeled_volume()
+    index = LabelIndex.from_image(labels)
+    bounds = {label: index.bounds(label) for label in [1, 3, 6]}
+    projections = LabelProjections(bounds, len(channels))
+    for z in range(labels.shape[0]):
+        projections.add_plane(labels[z], channels[:, z])
+    for label, ((x0, x1), (y0, y1), _) in bounds.items():
+        masked = np.where(labels == label, channels, 0).max(axis=1)
+        assert (projections.projection(label) == masked[:, y0:y1, x0:x1]).all()
+
+
+@pytest.mark.parametrize("dtype", [np.uint8, np.uint16, np.int16])
+def test_value_counts_match_histograms(dtype):
+    labels, channels = labeled_volume(dtype)
+    cells = [1, 2, 5, 7]
+    ranges = [(int(c.min()), int(c.max())) for c in channels]
+    histograms = LabelHistograms(ranges, cells)
+    counts = LabelValueCounts(len(channels), cells)
+    for z in range(labels.shape[0]):
+        histograms.add_plane(channels[:, z], labels[z])
+        counts.add_plane(channels[:, z], labels[z])
+    assert [counts.value_range(c) for c in range(len(channels))] == ranges
+    binned = counts.histograms(ranges)
+    assert (binned.total == histograms.total).all()
+    assert (binned.per_label == histograms.per_label).all()
+    names = ["A", "B"]
+    for label in [None] + cells:
+        assert binned.metadata(names, label) == histograms.metadata(names, label)
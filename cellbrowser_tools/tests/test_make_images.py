@@ -0,0 +1,78 @@
+import glob
+import os
+import sys
+
+import pytest
+import tifffile
+
+pytest.importorskip("aicsimageio")
+pytest.importorskip("aicsimageprocessing")
+
+from cellbrowser_tools import createJobsFromCSV  # noqa: E402
+from cellbrowser_tools.bin import make_images  # noqa: E402
+
+
+def run_make_images(monkeypatch, rows, output_dir, *flags):
+    # one fov through the options of the make_images command line
+    argv = ["make_images", "--input_manifest", "manifest.csv"] + list(flags)
+    monkeypatch.setattr(sys, "argv", argv)
+    action_options, processing_options = make_images.make_options(make_images.Args())
+    prefs = {
+        "images_dir": str(output_dir / "images"),
+        "thumbs_dir": str(output_dir / "thumbnails"),
+        "atlas_dir": str(output_dir / "atlases"),
+    }
+    createJobsFromCSV.do_image(
+        False,
+        True,
+        prefs,
+        [dict(row) for row in rows],
+        do_thumbnails=action_options.do_thumbnails,
+        do_crop=action_options.do_crop,
+        save_raw=action_options.save_raw,
+        processing_options=processing_options,
+    )
+    return sorted(glob.glob(os.path.join(prefs["images_dir"], "*", "*.ome.tif")))
+
+
+def test_save_raw_writes_ome_tiffs(monkeypatch, tmp_path, synthetic_fov):
+    assert run_make_images(monkeypatch, synthetic_fov, tmp_path / "off") == []
+    written = run_make_images(
+        monkeypatch, synthetic_fov, tmp_path / "on", "--save_raw", "--do_crop"
+    )
+    assert len(written) == 3
+
+
+def test_compression_flag_changes_ome_tiff(monkeypatch, tmp_path, synthetic_fov):
+    plain = run_make_images(
+        monkeypatch, synthetic_fov, tmp_path / "plain", "--save_raw"
+    )
+    zlib = run_make_images(
+        monkeypatch,
+        synthetic_fov,
+        tmp_path / "zlib",
+        "--save_raw",
+        "--compression",
+        "zlib",
+    )
+    assert [os.path.basename(p) for p in plain] == [os.path.basename(p) for p in zlib]
+    with tifffile.TiffFile(plain[0]) as a, tifffile.TiffFile(zlib[0]) as b:
+        assert a.pages[0].compression == tifffile.TIFF.COMPRESSION.NONE
+        assert b.pages[0].compression == tifffile.TIFF.COMPRESSION.ADOBE_DEFLATE
+        assert (a.asarray() == b.asarray()).all()
+
+
+def test_pyramid_levels_flag_adds_subifds(monkeypatch, tmp_path, synthetic_fov):
+    written = run_make_images(
+        monkeypatch,
+        synthetic_fov,
+        tmp_path,
+        "--save_raw",
+        "--pyramid_levels",
+        "1",
+        "--tile_size",
+        "16",
+    )
+    with tifffile.TiffFile(written[0]) as tif:
+        assert len(tif.series[0].levels) == 2
+        assert tif.pages[0].is_tiled
@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+
+from cellbrowser_tools.ome_tiff_writer import downsample_2x, write_ome_tiff_planes
+from cellbrowser_tools.tests.conftest import ome_xml
+
+pytest.importorskip("aicsimageio")
+
+from cellbrowser_tools.ome_tiff_source import OmeTiffSource  # noqa: E402
+
+
+# ZCYX image of 2 intensity channels and a label channel, with odd y and x sizes
+def zcyx_image():
+    rng = np.random.default_rng(1)
+    image = rng.integers(0, 4000, size=(5, 3, 45, 37), dtype=np.uint16)
+    image[:, 2] = rng.integers(0, 4, size=(5, 45, 37))
+    return image
+
+
+def write(path, image, **kwargs):
+    size_z, size_c, size_y, size_x = image.shape
+    ome_str = ome_xml(
+        "image",
+        size_c,
+        size_z,
+        size_y,
+        size_x,
+        image.dtype,
+        ["A", "B", "SEG_Memb"],
+        dimension_order="XYCZT",
+    )
+    planes = (image[z, c] for z in range(size_z) for c in range(size_c))
+    write_ome_tiff_planes(
+        str(path), planes, ome_str, image.shape, image.dtype, **kwargs
+    )
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        {},
+        {"compression": "zlib"},
+        {"tile_size": 16},
+        {"tile_size": 16, "pyramid_levels": 2, "label_channels": [2]},
+    ],
+)
+def test_round_trip(tmp_path, kwargs):
+    image = zcyx_image()
+    write(tmp_path / "image.ome.tif", image, **kwargs)
+    with OmeTiffSource(str(tmp_path / "image.ome.tif")) as source:
+        assert (source.size_c, source.size_z) == (3, 5)
+        assert [c.name for c in source.ome.images[0].pixels.channels] == [
+            "A",
+            "B",
+            "SEG_Memb",
+        ]
+        for c in range(3):
+            assert (source.read_zyx(c=c) == image[:, c]).all()
+        assert (source.read_zyx(c=1, z_start=2, z_stop=4) == image[2:4, 1]).all()
+
+
+@pytest.mark.parametrize("level_dir", [False, True])
+def test_pyramid_levels(tmp_path, level_dir):
+    image = zcyx_image()
+    write(
+        tmp_path / "image.ome.tif",
+        image,
+        tile_size=16,
+        pyramid_levels=2,
+        label_channels=[2],
+        level_dir=str(tmp_path) if level_dir else None,
+    )
+    with OmeTiffSource(str(tmp_path / "image.ome.tif")) as source:
+        levels = source.tiff.series[0].levels
+        assert len(levels) == 3
+        for z in range(image.shape[0]):
+            for c in range(image.shape[1]):
+                expected = image[z, c]
+                for level in levels[1:]:
+                    expected = downsample_2x(expected, labels=c == 2)
+                    page = level.pages[z * image.shape[1] + c]
+                    assert (page.asarray() == expected).all()
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["image.ome.tif"]
+
+
+def test_downsample_2x():
+    plane = np.array([[1, 3, 5], [3, 5, 7], [9, 9, 9]], dtype=np.uint8)
+    assert downsample_2x(plane).tolist() == [[3, 6], [9, 9]]
+    assert downsample_2x(plane, labels=True).tolist() == [[1, 5], [9, 9]]
@@ -0,0 +1,74 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip("aicsimageio")
+pytest.importorskip("aicsimageprocessing")
+
+from aicsimageio import AICSImage  # noqa: E402
+from aicsimageprocessing import textureAtlas  # noqa: E402
+
+from cellbrowser_tools.texture_atlas import (  # noqa: E402
+    atlas_dimensions,
+    atlas_tile_size,
+    build_texture_atlas,
+    save_texture_atlas,
+)
+
+
+def czyx_image(shape):
+    rng = np.random.default_rng(2)
+    return rng.integers(0, 4000, size=shape, dtype=np.uint16)
+
+
+def read_atlas(atlas_dir, name):
+    with open(os.path.join(atlas_dir, name + "_atlas.json")) as f:
+        metadata = json.load(f)
+    pngs = {}
+    for image in metadata["images"]:
+        with open(os.path.join(atlas_dir, image["name"]), "rb") as f:
+            pngs[image["name"]] = f.read()
+    return metadata, pngs
+
+
+# 6 channels of 7 slices that fit in the atlas, and 3 channels of 40 slices whose
+# tiles are shrunk to fit in 2048
+@pytest.mark.parametrize("shape", [(6, 7, 40, 48), (3, 40, 300, 500)])
+def test_atlas_matches_texture_atlas_library(tmp_path, shape):
+    image = AICSImage(czyx_image(shape), known_dims="CZYX")
+
+    expected = textureAtlas.generate_texture_atlas(image, name="fov")
+    expected.save(str(tmp_path / "library"), user_data={"a": 1})
+    group = build_texture_atlas(image, "fov")
+    save_texture_atlas(group, str(tmp_path / "ours"), user_data={"a": 1})
+
+    library_metadata, library_pngs = read_atlas(tmp_path / "library", "fov")
+    metadata, pngs = read_atlas(tmp_path / "ours", "fov")
+    # the scaling of each channel is only recorded by build_texture_atlas
+    assert metadata.pop("channel_ranges") == [None] * shape[0]
+    assert metadata == library_metadata
+    assert pngs == library_pngs
+
+
+def test_atlas_dimensions_match_texture_atlas_library():
+    for size_x, size_y, size_z in [(48, 40, 7), (500, 300, 40), (924, 624, 65)]:
+        data = np.zeros((1, size_z, size_y, size_x), dtype=np.uint8)
+        library = textureAtlas.TextureAtlasGroup(
+            AICSImage(data, known_dims="CZYX")
+        ).dims
+        dims = atlas_dimensions(size_x, size_y, size_z)
+        for field in [
+            "tile_width",
+            "tile_height",
+            "rows",
+            "cols",
+            "atlas_width",
+            "atlas_height",
+        ]:
+            assert getattr(dims, field) == getattr(library, field)
+        assert atlas_tile_size(size_x, size_y, size_z) == (
+            library.tile_width,
+            library.tile_height,
+        )
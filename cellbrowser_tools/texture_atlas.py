@@ -0,0 +1,322 @@
+from aicsimageio.writers.two_d_writer import TwoDWriter
+from aicsimageprocessing import textureAtlas
+from .ome_tiff_writer import downsample_2x
+
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+import math
+import numpy as np
+import os
+import skimage.io as skio
+import skimage.transform as sktransform
+
+
+log = logging.getLogger(__name__)
+
+ATLAS_MAX_EDGE = 2048
+
+
+# The layout generate_texture_atlas of aicsimageprocessing gives a volume of this
+# shape: one tile per z slice, in the most square grid of rows and columns, with the
+# tiles shrunk so that the atlas fits in max_edge. Same math as TextureAtlasGroup.
+# The channel fields of the returned dims are left to the caller.
+def atlas_dimensions(size_x, size_y, size_z, max_edge=ATLAS_MAX_EDGE):
+    tile_width, tile_height = size_x, size_y
+    # start from one row of all slices
+    atlas_width = tile_width * size_z
+    atlas_height = tile_height
+    ratio = float(atlas_width) / float(atlas_height)
+    for r in range(2, size_z):
+        new_rows = math.ceil(float(size_z) / r)
+        adjusted_width = int(tile_width * new_rows)
+        adjusted_height = int(tile_height * r)
+        new_ratio = float(max(adjusted_width, adjusted_height)) / float(
+            min(adjusted_width, adjusted_height)
+        )
+        if new_ratio < ratio:
+            ratio = new_ratio
+            atlas_width = adjusted_width
+            atlas_height = adjusted_height
+        else:
+            break
+    cols = int(atlas_width // tile_width)
+    rows = int(atlas_height // tile_height)
+    if max_edge < atlas_width or max_edge < atlas_height:
+        tile_width = math.floor(max_edge / cols)
+        tile_height = math.floor(max_edge / rows)
+        atlas_width = tile_width * cols
+        atlas_height = tile_height * rows
+
+    dims = textureAtlas.TextureAtlasDims()
+    dims.tile_width = int(tile_width)
+    dims.tile_height = int(tile_height)
+    dims.rows = rows
+    dims.cols = cols
+    dims.atlas_width = int(atlas_width)
+    dims.atlas_height = int(atlas_height)
+    dims.width = size_x
+    dims.height = size_y
+    dims.tiles = size_z
+    return dims
+
+
+# the x,y size of the tiles generate_texture_atlas would use for a volume of this
+# shape, computed without any pixel data
+def atlas_tile_size(size_x, size_y, size_z, max_edge=ATLAS_MAX_EDGE):
+    dims = atlas_dimensions(size_x, size_y, size_z, max_edge)
+    return dims.tile_width, dims.tile_height
+
+
+class AtlasGroup:
+    """
+    A texture atlas laid out as aicsimageprocessing's TextureAtlasGroup lays it out:
+    the layout in dims, and the uint8 SXY planes of up to 3 channels for each png.
+    Made by build_texture_atlas, saved by save_texture_atlas.
+    """
+
+    def __init__(self, name, dims):
+        self.name = name
+        self.dims = dims
+        # (channel indices, SXY planes) of each png
+        self.pngs = []
+        # [lo, hi] that each channel was scaled by, or None if by its own range
+        self.channel_ranges = [None] * dims.channels
+
+
+# the json metadata of a previously saved texture atlas, or None
+def load_atlas_metadata(atlas_dir, name):
+    try:
+        with open(os.path.join(atlas_dir, name + "_atlas.json")) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        log.warning(f"ignoring unreadable atlas metadata of {name}: {e}")
+        return None
+
+
+# fields of the atlas metadata that determine where every z slice is in the pngs
+_ATLAS_LAYOUT_FIELDS = [
+    "atlas_width",
+    "atlas_height",
+    "tile_width",
+    "tile_height",
+    "rows",
+    "cols",
+    "tiles",
+]
+
+
+# the uint8 atlas planes (atlas_width x atlas_height) of the given channels of a
+# previously saved atlas
+def load_atlas_channels(atlas_dir, metadata, channels):
+    result = {}
+    for png in metadata["images"]:
+        wanted = [(s, c) for s, c in enumerate(png["channels"]) if c in channels]
+        if not wanted:
+            continue
+        # saved as YXS by TwoDWriter from an SXY atlas
+        data = skio.imread(os.path.join(atlas_dir, png["name"]))
+        if data.ndim == 2:
+            data = data[:, :, np.newaxis]
+        for s, c in wanted:
+            result[c] = data[:, :, s].T
+    return result
+
+
+# The uint8 SXY atlas planes of CZYX data, laid out by dims, with the values lo of
+# each channel scaled to 0 and hi to 255. Without lo and hi, each channel is scaled
+# by the range of its own atlas plane, including 0, as TextureAtlas does. All z
+# slices are placed at once; tiles are resampled as TextureAtlas does only if they
+# are smaller than the slices.
+def pack_atlas_planes(data, dims, lo=None, hi=None):
+    nc, size_z, size_y, size_x = data.shape
+    tile_w, tile_h = dims.tile_width, dims.tile_height
+    if (tile_w, tile_h) == (size_x, size_y):
+        tiles = data
+    else:
+        scale = (float(tile_w) / float(size_x), float(tile_h) / float(size_y))
+        tiles = np.empty((nc, size_z, tile_h, tile_w))
+        for c in range(nc):
+            for z in range(size_z):
+                # TextureAtlas resamples XY slices
+                xy = data[c, z].T.astype(np.float32)
+                tiles[c, z] = sktransform.rescale(xy, scale, preserve_range=True).T
+    grid = np.zeros((nc, dims.rows * dims.cols, tile_h, tile_w))
+    grid[:, :size_z] = tiles
+    # slice i goes to row i // cols and column i % cols of an atlas indexed [x, y]
+    atlas = grid.reshape(nc, dims.rows, dims.cols, tile_h, tile_w)
+    atlas = atlas.transpose(0, 2, 4, 1, 3).reshape(
+        nc, dims.cols * tile_w, dims.rows * tile_h
+    )
+    if lo is None:
+        flat = atlas.reshape(nc, -1)
+        lo, hi = np.minimum(flat.min(axis=1), 0), flat.max(axis=1)
+    lo = np.asarray(lo, dtype=np.float64)[:, np.newaxis, np.newaxis]
+    span = np.asarray(hi, dtype=np.float64)[:, np.newaxis, np.newaxis] - lo
+    span[span == 0] = 1
+    atlas = 255.0 * (atlas - lo) / span
+    return atlas.clip(0, 255).astype(np.uint8)
+
+
+# The atlas generate_texture_atlas makes with the default pack order, as an
+# AtlasGroup. The planes of the channels in reused_channels are taken as they are from
+# previous (atlas metadata saved in atlas_dir) instead of being resampled from the
+# image, if the layout of previous is the one this image gets and the channel was
+# scaled the same way.
+# With atlas_range, a (lo, hi) pair of per channel values, the planes are scaled by
+# that range instead of by their own maximum.
+def build_texture_atlas(
+    image, name, atlas_dir=None, previous=None, reused_channels=(), atlas_range=None
+):
+    dims = atlas_dimensions(image.dims.X, image.dims.Y, image.dims.Z)
+    dims.channels = image.dims.C
+    if image.channel_names is not None:
+        dims.channel_names = list(image.channel_names)
+    else:
+        dims.channel_names = [f"CH_{c}" for c in range(image.dims.C)]
+    pixel_sizes = image.physical_pixel_sizes
+    if pixel_sizes is not None:
+        dims.pixel_size_x = pixel_sizes.X
+        dims.pixel_size_y = pixel_sizes.Y
+        dims.pixel_size_z = pixel_sizes.Z
+    group = AtlasGroup(name, dims)
+    if atlas_range is not None:
+        group.channel_ranges = [
+            [float(lo), float(hi)] for lo, hi in zip(atlas_range[0], atlas_range[1])
+        ]
+
+    reused = {}
+    if previous is not None and reused_channels:
+        # atlases saved before the ranges were recorded are not reused
+        previous_ranges = previous.get("channel_ranges") or []
+        if not all(
+            previous.get(field) == getattr(dims, field)
+            for field in _ATLAS_LAYOUT_FIELDS
+        ):
+            log.info(f"atlas layout of {name} changed; not reusing saved atlas planes")
+        elif not all(
+            c < len(previous_ranges) and previous_ranges[c] == group.channel_ranges[c]
+            for c in reused_channels
+        ):
+            log.info(f"atlas scaling of {name} changed; not reusing saved atlas planes")
+        else:
+            reused = load_atlas_channels(atlas_dir, previous, reused_channels)
+            log.info(f"reusing atlas planes of channels {sorted(reused)} for {name}")
+
+    data = image.get_image_data("CZYX", T=0)
+    channel_list = list(range(image.dims.C))
+    for pack in [channel_list[x : x + 3] for x in range(0, len(channel_list), 3)]:
+        planes = []
+        for c in pack:
+            if c in reused:
+                planes.append(reused[c])
+                continue
+            lo = hi = None
+            if atlas_range is not None:
+                lo, hi = atlas_range[0][c : c + 1], atlas_range[1][c : c + 1]
+            # one channel at a time, so that no channels of the image are copied
+            planes.append(pack_atlas_planes(data[c : c + 1], dims, lo, hi)[0])
+        group.pngs.append((pack, np.stack(planes)))
+    return group
+
+
+# Half resolution copies of the atlas of group, each made from the one before by
+# halving every tile. Channels in label_channels are subsampled instead of averaged.
+# One dict per level: its tile and atlas sizes, and the SXY planes of each png.
+def atlas_levels(group, levels, label_channels=()):
+    dims = group.dims
+    tile_w, tile_h = dims.tile_width, dims.tile_height
+    pngs = group.pngs
+    result = []
+    for _ in range(levels):
+        if tile_w < 2 or tile_h < 2:
+            break
+        half_w, half_h = (tile_w + 1) // 2, (tile_h + 1) // 2
+        halved = []
+        for channels, planes in pngs:
+            out = np.zeros(
+                (len(channels), half_w * dims.cols, half_h * dims.rows),
+                dtype=planes.dtype,
+            )
+            for s, c in enumerate(channels):
+                for row in range(dims.rows):
+                    for col in range(dims.cols):
+                        tile = planes[
+                            s,
+                            col * tile_w : (col + 1) * tile_w,
+                            row * tile_h : (row + 1) * tile_h,
+                        ]
+                        out[
+                            s,
+                            col * half_w : (col + 1) * half_w,
+                            row * half_h : (row + 1) * half_h,
+                        ] = downsample_2x(tile, labels=c in label_channels)
+            halved.append((channels, out))
+        tile_w, tile_h, pngs = half_w, half_h, halved
+        result.append(
+            {
+                "tile_width": tile_w,
+                "tile_height": tile_h,
+                "atlas_width": tile_w * dims.cols,
+                "atlas_height": tile_h * dims.rows,
+                "planes": [planes for _, planes in pngs],
+            }
+        )
+    return result
+
+
+# Saves an AtlasGroup the way TextureAtlasGroup.save does, as <name>_atlas.json and
+# <name>_atlas_<png>.png, encoding the pngs in parallel. levels (see atlas_levels) are
+# saved as <name>_atlas_lod<level>_<png>.png and listed in the json as "levels",
+# where level 0 is the atlas itself. Returns the names of the files.
+def save_texture_atlas(group, output_dir, user_data=None, levels=()):
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    pngs = []
+    images = []
+    for i, (channels, planes) in enumerate(group.pngs):
+        png_name = f"{group.name}_atlas_{i}.png"
+        images.append({"name": png_name, "channels": channels})
+        pngs.append((png_name, planes))
+    dims = group.dims
+    level_metadata = [
+        {
+            "tile_width": dims.tile_width,
+            "tile_height": dims.tile_height,
+            "atlas_width": dims.atlas_width,
+            "atlas_height": dims.atlas_height,
+            "images": images,
+        }
+    ]
+    for k, level in enumerate(levels, 1):
+        level_images = []
+        for i, planes in enumerate(level["planes"]):
+            png_name = f"{group.name}_atlas_lod{k}_{i}.png"
+            level_images.append({"name": png_name, "channels": group.pngs[i][0]})
+            pngs.append((png_name, planes))
+        entry = {key: value for key, value in level.items() if key != "planes"}
+        entry["images"] = level_images
+        level_metadata.append(entry)
+
+    def save_png(png):
+        png_name, planes = png
+        TwoDWriter.save(planes, os.path.join(output_dir, png_name), dim_order="SXY")
+
+    with ThreadPoolExecutor(max_workers=max(1, len(pngs))) as executor:
+        list(executor.map(save_png, pngs))
+
+    # the fields of TextureAtlasDims, as TextureAtlasGroup.get_metadata has them
+    metadata = dict(vars(dims))
+    metadata["images"] = images
+    metadata["name"] = group.name
+    metadata["channel_ranges"] = group.channel_ranges
+    if levels:
+        metadata["levels"] = level_metadata
+    if user_data is not None:
+        metadata["userData"] = user_data
+    json_name = group.name + "_atlas.json"
+    with open(os.path.join(output_dir, json_name), "w") as f:
+        json.dump(metadata, f)
+    return [json_name] + [png_name for png_name, _ in pngs]
@@ -2,11 +2,13 @@ from aicsimageio.writers import OmeZarrWriter
 from aicsimageio.writers.two_d_writer import TwoDWriter
 from aicsimageio import AICSImage
 from aicsimageio.types import PhysicalPixelSizes
-from aicsimageprocessing import thumbnailGenerator
 
 from . import cellJob
 from . import dataHandoffUtils as utils
 from .dataset_constants import DataField
+from .staging import get_staging_cache
+
+from .fov_processing import make_fov_thumbnail
 
 import argparse
 import collections
@@ -35,23 +37,20 @@ def check_num_planes(omepixels):
         )
 
 
-def retrieve_file(read_path, file_name):
+def retrieve_file(read_path, file_name, staging=None):
     """
-    Copy a file to a temporary directory, assign it the given name, and return the full destination path.
+    Copy a file to local scratch storage through the staging cache, and return the full
+    destination path. Without a staging cache, the file is read in place.
     """
-    return read_path
-    # output_directory = Path(tempfile.gettempdir())
-    # if not output_directory.is_dir():
-    #     raise Exception(f"Output directory {output_directory} does not exist!")
-
-    # destination = output_directory / file_name
-    # shutil.copyfile(read_path, destination)
-    # return destination
+    if staging is None:
+        return read_path
+    return staging.stage(read_path)
 
 
-def unretrieve_file(localpath):
-    # os.remove(localpath)
-    return
+def unretrieve_file(localpath, staging=None):
+    # the staged copy stays in the cache, it just becomes evictable again
+    if staging is not None:
+        staging.release(localpath)
 
 
 def _int32(x):
@@ -147,11 +146,15 @@ class ImageProcessor:
         self.client = Client(self.cluster)
 
         self.do_thumbnails = True
+        self.staging = None
+        # staged copies read lazily by dask, released in cleanup()
+        self.staged_files = []
 
         self.job = info
         if isinstance(info, cellJob.CellJob):
             self.row = info.cells[0]
             self.do_thumbnails = info.do_thumbnails
+            self.staging = get_staging_cache(info.staging_dir, info.staging_max_gb)
         elif "cells" in info:
             self.row = info.cells[0]
         else:
@@ -203,7 +206,9 @@ class ImageProcessor:
         result = da.array([])
         for index, channel_spec in enumerate(recipe):
             fpath = retrieve_file(
-                channel_spec["file"], os.path.basename(channel_spec["file"])
+                channel_spec["file"],
+                os.path.basename(channel_spec["file"]),
+                self.staging,
             )
             image = AICSImage(fpath)
             data = image.get_image_dask_data(
@@ -225,7 +230,8 @@ class ImageProcessor:
             if channel_spec["channel_name"] == "":
                 cn = image.channel_names
                 channel_spec["channel_name"] = cn[channel_spec["channel_index"]]
-            unretrieve_file(fpath)
+            # the dask data is read lazily, so a staged copy stays pinned until cleanup
+            self.staged_files.append(fpath)
         return result
 
     def build_recipe_variance_hipsc(self, data_row):
@@ -475,16 +481,14 @@ class ImageProcessor:
             thumbnail_colors = [[1.0, 0.0, 1.0], [0.0, 1.0, 1.0], [1.0, 1.0, 0.0]]
             # generate thumbnail and save it here!
             log.info("making thumbnail...")
-            generator = thumbnailGenerator.ThumbnailGenerator(
-                channel_indices=[memb_index, nuc_index, struct_index],
-                size=self.job.cbrThumbnailSize,
-                mask_channel_index=0,  # apply_cell_mask=False to ignore this
-                colors=thumbnail_colors,
+            # only the reduced thumbnail channels are computed from the dask array
+            ffthumb = make_fov_thumbnail(
+                data[0],
+                [memb_index, nuc_index, struct_index],
+                thumbnail_colors,
+                self.job.cbrThumbnailSize,
                 projection="max",
             )
-            ffthumb = generator.make_thumbnail(
-                data[0].transpose(1, 0, 2, 3), apply_cell_mask=False
-            )
             destination = output_thumbnail_root + self.file_name + ".png"
             TwoDWriter.save(ffthumb, destination, dim_order="SXY")
             log.info("thumbnail saved")
@@ -492,6 +496,9 @@ class ImageProcessor:
     def cleanup(self):
         self.client.close()
         self.cluster.close()
+        for fpath in self.staged_files:
+            unretrieve_file(fpath, self.staging)
+        self.staged_files = []
 
 
 def do_main_image_with_celljob(info):
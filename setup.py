@@ -84,6 +84,9 @@ setup(
         "console_scripts": [
             "build_release=cellbrowser_tools.bin.build_release:main",
             "make_images=cellbrowser_tools.bin.make_images:main",
+            "benchmark_compression=cellbrowser_tools.bin.benchmark_compression:main",
+            "extract_cells=cellbrowser_tools.bin.extract_cells:main",
+            "summarize_metrics=cellbrowser_tools.bin.summarize_metrics:main",
             "make_dataset_from_csv=cellbrowser_tools.bin.make_dataset_from_csv:main",
             "make_downloader_manifest=cellbrowser_tools.bin.make_downloader_manifest:main",
             "processImageWithSegmentation=cellbrowser_tools.bin.processImageWithSegmentation:main",